@@ -0,0 +1,55 @@
+# Benchmark of the block hashing done when validating a chain.
+# Compares re-hashing every block (as valid_chain used to on every sync) with
+# the cached block hashes, both for this node's chain and for a peer's chain
+# that extends it by a few blocks.
+# Run from the project root: python -m benchmarks.bench_hashing -n 50000
+
+from argparse import ArgumentParser
+from time import perf_counter
+from blockchain import Blockchain
+
+
+def build_chain(num_blocks):
+    """
+    Build a chain of single transaction vote blocks. Proofs are not mined,
+    since only the hashing cost is being measured.
+    :param num_blocks: Number of blocks to add after the genesis block.
+    :return: The blockchain.
+    """
+    blockchain = Blockchain()
+    for i in range(num_blocks):
+        blockchain.new_transaction(sender="0", recipient="voter_{}".format(i), amount=1)
+        blockchain.new_block(proof=i, previous_hash=None)
+    return blockchain
+
+
+def timed(func, *args):
+    start = perf_counter()
+    result = func(*args)
+    return perf_counter() - start, result
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--numblocks', default=50000, type=int, help='Number of blocks in the chain.')
+    parser.add_argument('-s', '--suffix', default=10, type=int, help='Blocks a peer chain is ahead by.')
+    args = parser.parse_args()
+
+    print("Building a chain of {} blocks...".format(args.numblocks))
+    node = build_chain(args.numblocks)
+    peer = build_chain(0)
+    peer.chain = list(node.chain)
+    peer.block_hashes = list(node.block_hashes)
+    for i in range(args.suffix):
+        peer.new_transaction(sender="0", recipient="late_voter_{}".format(i), amount=1)
+        peer.new_block(proof=i, previous_hash=None)
+
+    before, _ = timed(lambda: [Blockchain.hash(block) for block in node.chain])
+    after, _ = timed(lambda: [node.block_hash(block) for block in node.chain])
+    print("Hashing this node's chain:   {:8.3f}s uncached, {:8.3f}s cached".format(before, after))
+
+    before, _ = timed(lambda: [Blockchain.hash(block) for block in peer.chain])
+    fork_time, fork = timed(node.common_prefix_length, peer.chain)
+    suffix_time, _ = timed(lambda: [Blockchain.hash(block) for block in peer.chain[fork:]])
+    print("Hashing a peer's chain:      {:8.3f}s full, {:8.3f}s from the fork ({} new blocks)".format(
+        before, fork_time + suffix_time, len(peer.chain) - fork))
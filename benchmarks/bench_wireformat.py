@@ -0,0 +1,66 @@
+# Benchmark of sending a chain of votes to a peer as JSON and in the compact binary encoding,
+# whole and as a stream of one record per block.
+# Reports the size of a /chain/ response and the time taken to encode and decode it.
+# Run from the project root: python -m benchmarks.bench_wireformat -n 10000
+
+import json
+from argparse import ArgumentParser
+from time import perf_counter, time
+import cryptfuncs
+import wireformat
+
+
+def build_chain(num_votes, num_keys):
+    """
+    Build a chain of vote blocks like an election's, one cast vote per block.
+    Voters' keys are reused, since generating RSA keys would dominate the run.
+    :param num_votes: Number of vote blocks.
+    :param num_keys: Number of distinct voter keys.
+    :return: The chain, as a list of blocks.
+    """
+    keys = []
+    for _ in range(num_keys):
+        public, private = cryptfuncs.new_rsa(1024)
+        keys.append((public.export_key().decode(), private.export_key().decode()))
+    chain = [{'index': 1, 'timestamp': time(), 'transactions': [], 'proof': 100, 'previous_hash': 1}]
+    for i in range(num_votes):
+        sender, signature = keys[i % num_keys]
+        transaction = {'sender': sender, 'recipient': 'Candidate {}'.format(i % 3), 'amount': 1,
+                       'timestamp': time(), 'signature': signature, 'vote_number': i}
+        chain.append({'index': i + 2, 'timestamp': time(), 'transactions': [transaction],
+                      'proof': 35293 + i, 'previous_hash': '{:064x}'.format(i * 7919)})
+    return chain
+
+
+def timed(func, *args):
+    start = perf_counter()
+    result = func(*args)
+    return perf_counter() - start, result
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--numvotes', default=10000, type=int, help='Number of vote blocks in the chain.')
+    parser.add_argument('-k', '--numkeys', default=20, type=int, help='Number of distinct voter keys.')
+    args = parser.parse_args()
+
+    print("Building a chain of {} votes...".format(args.numvotes))
+    response = {'chain': build_chain(args.numvotes, args.numkeys), 'length': args.numvotes + 1}
+
+    json_encode, json_data = timed(lambda: json.dumps(response).encode())
+    json_decode, _ = timed(lambda: json.loads(json_data.decode()))
+    binary_encode, binary_data = timed(wireformat.encode, response)
+    binary_decode, decoded = timed(wireformat.decode, binary_data)
+    assert decoded == response
+    records = [{'length': response['length']}] + response['chain']
+    lines_encode, lines_data = timed(lambda: b''.join(map(wireformat.encode_json_record, records)))
+    lines_decode, _ = timed(lambda: list(wireformat.read_json_records([lines_data])))
+    stream_encode, stream_data = timed(lambda: b''.join(map(wireformat.encode_record, records)))
+    stream_decode, _ = timed(lambda: list(wireformat.read_records([stream_data])))
+
+    print("{:8} {:>14} {:>12} {:>12}".format('', 'bytes', 'encode', 'decode'))
+    print("{:8} {:14,d} {:11.3f}s {:11.3f}s".format('JSON', len(json_data), json_encode, json_decode))
+    print("{:8} {:14,d} {:11.3f}s {:11.3f}s".format('binary', len(binary_data), binary_encode, binary_decode))
+    print("{:8} {:14,d} {:11.3f}s {:11.3f}s".format('ndjson', len(lines_data), lines_encode, lines_decode))
+    print("{:8} {:14,d} {:11.3f}s {:11.3f}s".format('stream', len(stream_data), stream_encode, stream_decode))
+    print("Binary responses are {:.1%} of the size of JSON.".format(len(binary_data) / len(json_data)))
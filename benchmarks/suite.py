@@ -0,0 +1,308 @@
+# Benchmark suite of the chain, crypto and node hot paths, run against synthetic elections.
+# Each election is generated once and saved under benchmarks/elections/, so later runs
+# measure the same chain. Results can be saved and compared with a later run to flag regressions.
+# Run from the project root:
+#   python -m benchmarks.suite -v 1000 10000 -o before.json
+#   python -m benchmarks.suite -v 1000 10000 -o after.json -c before.json
+
+import json
+import os
+import platform
+import sys
+import tracemalloc
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count
+from time import perf_counter, time
+import cryptfuncs
+import vote_manager_node
+import wireformat
+from blockchain import Blockchain
+from consensus import ProofOfWork
+from initialize_election import new_key_strings
+
+ELECTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'elections')
+CANDIDATES = ['Candidate A', 'Candidate B', 'Candidate C']
+# Elections are sealed with an easy proof of work, so generating them is quick.
+ELECTION_CONSENSUS = ProofOfWork(difficulty=1)
+# Cast votes per block, as a node in block producer mode would seal them.
+VOTES_PER_BLOCK = 100
+# Share of voters who have already voted. The rest are left for the /vote/ benchmark.
+TURNOUT = 0.9
+
+
+def election_path(voters, keys):
+    return os.path.join(ELECTIONS_DIR, 'election-{}-{}.votechain'.format(voters, keys or voters))
+
+
+def generate_election(voters, keys, workers):
+    """
+    Generate an election: a block issuing a vote to each voter, followed by blocks of cast votes.
+    :param voters: Number of voters.
+    :param keys: Number of distinct voter keys, reused round robin. 0 gives every voter their own key.
+    :param workers: Number of key generation processes.
+    :return: A dictionary of the chain, its block hashes and the voters' (public, private) key pairs.
+    """
+    num_keys = keys or voters
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        key_pairs = list(executor.map(new_key_strings, range(num_keys), chunksize=max(1, num_keys // (workers * 4))))
+    chain = [{'index': 0, 'timestamp': time(), 'transactions': [], 'proof': 100, 'previous_hash': 1}]
+    hashes = [Blockchain.hash(chain[0])]
+
+    def seal(transactions):
+        last_block, last_hash = chain[-1], hashes[-1]
+        chain.append({
+            'index': len(chain),
+            'timestamp': time(),
+            'transactions': transactions,
+            'proof': ELECTION_CONSENSUS.proof(last_block, last_hash),
+            'previous_hash': last_hash,
+        })
+        hashes.append(Blockchain.hash(chain[-1]))
+
+    for vote_number in range(1, voters + 1):
+        public, _ = key_pairs[vote_number % num_keys]
+        seal([Blockchain.build_transaction('0', public, 1)])
+    votes = []
+    for vote_number in range(1, int(voters * TURNOUT) + 1):
+        public, private = key_pairs[vote_number % num_keys]
+        votes.append(Blockchain.build_transaction(public, CANDIDATES[vote_number % len(CANDIDATES)],
+                                                  1, private, vote_number))
+        if len(votes) == VOTES_PER_BLOCK:
+            seal(votes)
+            votes = []
+    if votes:
+        seal(votes)
+    return {'voters': voters, 'chain': chain, 'hashes': hashes, 'keys': key_pairs}
+
+
+def load_election(voters, keys, workers):
+    """
+    Load a saved election, generating and saving it first if there isn't one.
+    """
+    path = election_path(voters, keys)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return wireformat.decode(f.read())
+    print("Generating an election of {} voters (saved to {})...".format(voters, path))
+    election = generate_election(voters, keys, workers)
+    os.makedirs(ELECTIONS_DIR, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(wireformat.encode(election))
+    return election
+
+
+def election_node(election):
+    """
+    Build a node holding an election's chain. The blocks are replayed without checking them,
+    the way a node restarted from its chain store does.
+    """
+    blockchain = Blockchain(ProofOfWork(difficulty=1))
+    blockchain.chain = list(election['chain'])
+    blockchain.block_hashes = list(election['hashes'])
+    for position, block in enumerate(blockchain.chain):
+        for transaction in block['transactions']:
+            blockchain.update_wallets(transaction)
+            blockchain.transaction_index[blockchain.transaction_key(transaction)] += 1
+        blockchain.index_issued_vote(block, position)
+    blockchain.set_candidates(CANDIDATES)
+    return blockchain
+
+
+def unverified_node():
+    """
+    A node that has verified no signatures and parsed no keys yet, so each validation starts cold.
+    """
+    cryptfuncs.clear_key_cache()
+    return Blockchain(ProofOfWork(difficulty=1))
+
+
+# Each benchmark takes an election and the parsed arguments, and returns a list of calls
+# to time and the number of items each call handles.
+
+def bench_hash(election, args):
+    blocks = election['chain'][-args.samples:]
+    return [lambda block=block: Blockchain.hash(block) for block in blocks], 1
+
+
+def bench_valid_chain(election, args):
+    chain = election['chain']
+    return [lambda: unverified_node().valid_chain(chain) for _ in range(args.repeat)], len(chain)
+
+
+def bench_chain_transactions_valid(election, args):
+    chain = election['chain']
+    transactions = sum(len(block['transactions']) for block in chain)
+    return [lambda: unverified_node().chain_transactions_valid(chain) for _ in range(args.repeat)], transactions
+
+
+def bench_proof_of_work(election, args):
+    consensus = ProofOfWork(args.difficulty)
+    chain, hashes = election['chain'], election['hashes']
+    calls = min(args.repeat * 10, len(chain))
+    return [lambda i=i: consensus.proof(chain[-i], hashes[-i]) for i in range(1, calls + 1)], 1
+
+
+def bench_sign(election, args):
+    _, private = election['keys'][0]
+    key = cryptfuncs.import_key(private)
+    return [lambda i=i: cryptfuncs.sign('vote {}'.format(i), key) for i in range(args.samples // 10)], 1
+
+
+def bench_verify(election, args):
+    public, private = election['keys'][0]
+    public_key, private_key = cryptfuncs.import_key(public), cryptfuncs.import_key(private)
+    signature = cryptfuncs.sign('vote', private_key)
+    return [lambda: cryptfuncs.verify('vote', signature, public_key) for _ in range(args.samples // 10)], 1
+
+
+def bench_vote_route(election, args):
+    # Casts votes the election left uncast, one request each, as a node sealing a block per vote does.
+    if 'node' not in election:
+        election['node'] = election_node(election)
+        election['uncast'] = count(int(election['voters'] * TURNOUT) + 1)
+    vote_manager_node.blockchain = election['node']
+    vote_manager_node.block_interval = 0
+    client = vote_manager_node.app.test_client()
+    keys = election['keys']
+    calls = []
+    for _ in range(min(args.repeat * 10, election['voters'] // 20)):
+        vote_number = next(election['uncast'])
+        form = {'id': vote_number, 'key': keys[vote_number % len(keys)][1], 'candidate': CANDIDATES[0]}
+        calls.append(lambda form=form: client.post('/vote/', data=form))
+    return calls, 1
+
+
+BENCHMARKS = {
+    'hash': bench_hash,
+    'valid_chain': bench_valid_chain,
+    'chain_transactions_valid': bench_chain_transactions_valid,
+    'proof_of_work': bench_proof_of_work,
+    'sign': bench_sign,
+    'verify': bench_verify,
+    'vote_route': bench_vote_route,
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_benchmark(benchmark, election, args):
+    """
+    Time each call of a benchmark, then run one more call with memory tracing on to find its
+    peak memory. Tracing slows Python down, so it is kept out of the timed calls.
+    Memory used by worker processes is not counted.
+    :return: A dictionary of results, with latencies in seconds per call.
+    """
+    calls, items = benchmark(election, args)
+    if not calls:
+        return None
+    durations = []
+    key_hits = key_lookups = 0
+    for call in calls:
+        before = cryptfuncs.key_cache_info()
+        start = perf_counter()
+        call()
+        durations.append(perf_counter() - start)
+        after = cryptfuncs.key_cache_info()
+        hits, lookups = after.hits, after.hits + after.misses
+        if lookups >= before.hits + before.misses:
+            # Unless the call emptied the cache, only count its own lookups.
+            hits, lookups = hits - before.hits, lookups - before.hits - before.misses
+        key_hits += hits
+        key_lookups += lookups
+    traced_calls, _ = benchmark(election, args)
+    tracemalloc.start()
+    traced_calls[0]()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    total = sum(durations)
+    return {
+        'calls': len(durations),
+        'items_per_call': items,
+        'mean': total / len(durations),
+        'p50': percentile(durations, 0.5),
+        'p95': percentile(durations, 0.95),
+        'throughput': len(durations) * items / total if total else float('inf'),
+        'peak_kib': peak / 1024,
+        # Share of parsed key lookups in this process found in the cache, or None if there were none.
+        'key_hit_rate': key_hits / key_lookups if key_lookups else None,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with those of an earlier run.
+    :param results: Results of this run.
+    :param baseline: Results of the earlier run.
+    :param threshold: Fraction by which a median latency may grow before it is flagged.
+    :return: The names of the benchmarks that regressed.
+    """
+    regressions = []
+    print("\n{:42} {:>12} {:>12} {:>8}".format('benchmark', 'before p50', 'after p50', 'change'))
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['p50'], result['p50']
+        change = after / before - 1 if before else 0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print("{:42} {:11.6f}s {:11.6f}s {:+7.1%}{}".format(name, before, after, change, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-v', '--voters', default=[1000], type=int, nargs='+',
+                        help='Sizes of the elections to run against (default 1000). Eg. -v 1000 10000 100000')
+    parser.add_argument('-b', '--benchmarks', default=list(BENCHMARKS), nargs='+', choices=list(BENCHMARKS),
+                        help='Benchmarks to run (default all).')
+    parser.add_argument('-k', '--keys', default=0, type=int,
+                        help='Distinct voter keys per election, reused round robin. '
+                             '0 gives every voter their own key (default), which is slow to generate.')
+    parser.add_argument('-w', '--workers', default=os.cpu_count() or 1, type=int,
+                        help='Processes used to generate voter keys (default one per core).')
+    parser.add_argument('-r', '--repeat', default=3, type=int, help='Runs of whole chain benchmarks (default 3).')
+    parser.add_argument('-s', '--samples', default=10000, type=int,
+                        help='Calls of per block benchmarks; a tenth as many for RSA (default 10000).')
+    parser.add_argument('-kc', '--key_cache', default=0, type=int,
+                        help='Parsed keys to cache. 0 caches two per voter, as a node does (default).')
+    parser.add_argument('-d', '--difficulty', default=4, type=int, help='Proof of work difficulty (default 4).')
+    parser.add_argument('-o', '--output', default=None, type=str, help='File to save the results to, as JSON.')
+    parser.add_argument('-c', '--compare', default=None, type=str, help='Results file of an earlier run to compare with.')
+    parser.add_argument('-t', '--threshold', default=0.1, type=float,
+                        help='With -c, slowdown of a median latency flagged as a regression (default 0.1).')
+    args = parser.parse_args()
+
+    results = dict()
+    for voters in args.voters:
+        election = load_election(voters, args.keys, args.workers)
+        cryptfuncs.set_key_cache_size(args.key_cache or max(cryptfuncs.KEY_CACHE_SIZE, 2 * voters))
+        print("\nElection of {} voters, {} blocks:".format(voters, len(election['chain'])))
+        print("{:26} {:>6} {:>12} {:>12} {:>14} {:>12} {:>9}".format(
+            'benchmark', 'calls', 'p50', 'p95', 'items/sec', 'peak KiB', 'key hits'))
+        for name in args.benchmarks:
+            result = run_benchmark(BENCHMARKS[name], election, args)
+            if result is None:
+                continue
+            results['{}/{}'.format(voters, name)] = result
+            hit_rate = '-' if result['key_hit_rate'] is None else '{:.1%}'.format(result['key_hit_rate'])
+            print("{:26} {:6d} {:11.6f}s {:11.6f}s {:14,.1f} {:12,.1f} {:>9}".format(
+                name, result['calls'], result['p50'], result['p95'], result['throughput'], result['peak_kib'],
+                hit_rate))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'platform': platform.platform(), 'time': time(),
+                       'keys': args.keys, 'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\n{} benchmark(s) regressed by more than {:.0%}.".format(len(regressions), args.threshold))
+            sys.exit(1)
@@ -3,25 +3,193 @@
 
 import hashlib
 import json
-from time import time
+import multiprocessing
+import os
+import threading
+from collections import ChainMap, Counter
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from time import sleep, time
 from urllib.parse import urlparse
 import requests
+from requests.adapters import HTTPAdapter
 import cryptfuncs
-from simplelog import log
+import wireformat
+from consensus import ProofOfWork
+import miner
+import checkpoints
+from mempool import Mempool, ADMITTED, INVALID, BEHIND
+from simplelog import log, INFO, WARNING, ERROR
+import metrics
+
+# Batches with fewer unverified signatures than this are verified in this process,
+# since starting worker processes would take longer than the verification itself.
+PARALLEL_VERIFY_THRESHOLD = 64
+# Most verified signatures cached at once. The oldest are dropped first.
+MAX_VERIFIED_SIGNATURES = 1 << 18
+
+# Peer chains are fetched concurrently by up to this many threads.
+MAX_PEER_FETCHERS = 16
+# Seconds to wait for a peer to connect and to respond, per attempt.
+PEER_TIMEOUT = (3, 10)
+# Attempts to fetch a chain before a peer is removed, and the delay before the first retry,
+# which doubles with every attempt.
+PEER_RETRIES = 5
+PEER_BACKOFF = 0.1
+# Peers are asked for blocks as JSON, which decodes faster than the compact binary encoding.
+PEER_ACCEPT = 'application/json, {};q=0.5'.format(wireformat.CONTENT_TYPE)
+# Chains are asked for as a stream of blocks, so they can be checked as they arrive.
+PEER_STREAM_ACCEPT = '{}, {};q=0.9, application/json;q=0.5'.format(wireformat.JSON_STREAM_CONTENT_TYPE,
+                                                                  wireformat.STREAM_CONTENT_TYPE)
+JSON_PEER_ACCEPT, JSON_PEER_STREAM_ACCEPT = PEER_ACCEPT, PEER_STREAM_ACCEPT
+# The same, preferring the binary encoding, which is about 60% of the size, for links where bandwidth is short.
+BINARY_PEER_ACCEPT = '{}, application/json;q=0.5'.format(wireformat.CONTENT_TYPE)
+BINARY_PEER_STREAM_ACCEPT = '{}, {};q=0.9, application/json;q=0.5'.format(wireformat.STREAM_CONTENT_TYPE,
+                                                                         wireformat.CONTENT_TYPE)
+# Bytes read from a streamed response at a time.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Results of offering a block from a peer to add_block.
+BLOCK_ADDED = "added"
+BLOCK_KNOWN = "known"
+BLOCK_AHEAD = "ahead"
+BLOCK_INVALID = "invalid"
+
+# Metrics of the chain's hot paths, served by a node on /metrics.
+RESOLVE_SECONDS = metrics.Histogram('resolve_conflicts_seconds', 'Time taken to sync the chain with every peer.')
+PEER_FETCH_SECONDS = metrics.Histogram('peer_fetch_seconds', 'Time taken to fetch the blocks needed from one peer.')
+VALID_CHAIN_SECONDS = metrics.Histogram('valid_chain_seconds', 'Time taken to validate a whole chain.')
+CHAIN_EXTENSION_SECONDS = metrics.Histogram('chain_extension_seconds',
+                                            'Time taken to validate the blocks of a chain after it forks from ours.')
+SIGNATURE_SECONDS = metrics.Histogram('signature_verify_seconds',
+                                      'Time taken to verify one vote signature, in this process.',
+                                      buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+SIGNATURES = metrics.Counter('signatures_verified_total', 'Vote signatures verified, by result.', ['result'])
+CHAINS_REPLACED = metrics.Counter('chains_replaced_total', 'Times this node adopted a longer chain from a peer.')
+
+
+@SIGNATURE_SECONDS.time
+def verify_vote_signature(sender, signature):
+    """
+    Verify the signature of a cast vote. The signature is the private RSA key
+    that corresponds to the public key in the 'sender' field, which is checked
+    by signing the phrase "NO COLLUSION" with it and verifying that with the sender.
+    This is a module level function so that it can be run in worker processes.
+    :param sender: The public key of the voter.
+    :param signature: The private key the voter provided.
+    :return: True if the signature belongs to the sender, else false.
+    """
+    try:
+        voter_private_key = cryptfuncs.cached_import_key(signature)
+        # A voters signature is the private key that is assigned to their vote.
+        # Once used, it is no longer usable. Thus, it doesn't matter that users
+        # are publicizing their private key, something one wouldn't want to do
+        # in most contexts.
+        voter_public_key = cryptfuncs.cached_import_key(sender)
+    except (ValueError, TypeError, IndexError, AttributeError):
+        # Not a key at all.
+        return False
+    verification_message = "NO COLLUSION"
+    signed_message = cryptfuncs.sign(verification_message, voter_private_key)
+    return cryptfuncs.verify(verification_message, signed_message, voter_public_key)
+
+
+# Processes verifying large batches of signatures, started on first use and kept for the life of the node.
+# They are started with spawn rather than fork: the node forks from request threads while other threads
+# hold locks, and a forked child could inherit a lock that is never released.
+verify_executor = None
+# The (workers, key cache size) the pool was started with.
+verify_executor_workers = None
+verify_executor_lock = threading.Lock()
+
+
+def verify_pool(workers):
+    """
+    :param workers: Number of processes.
+    :return: The ProcessPoolExecutor that verifies signatures, with that many processes,
+             each with a parsed key cache the size of this process's.
+    """
+    global verify_executor, verify_executor_workers
+    with verify_executor_lock:
+        if verify_executor is None or verify_executor_workers != (workers, cryptfuncs.key_cache_size):
+            if verify_executor is not None:
+                verify_executor.shutdown(wait=False)
+            verify_executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                                  initializer=cryptfuncs.set_key_cache_size,
+                                                  initargs=(cryptfuncs.key_cache_size,))
+            verify_executor_workers = (workers, cryptfuncs.key_cache_size)
+        return verify_executor
+
+
+def prefer_binary_encoding(enabled=True):
+    """
+    Choose how blocks are asked for from peers.
+    :param enabled: If True, ask for the compact binary encoding, which is smaller but slower to decode.
+                    If False, ask for JSON.
+    """
+    global PEER_ACCEPT, PEER_STREAM_ACCEPT
+    if enabled:
+        PEER_ACCEPT, PEER_STREAM_ACCEPT = BINARY_PEER_ACCEPT, BINARY_PEER_STREAM_ACCEPT
+    else:
+        PEER_ACCEPT, PEER_STREAM_ACCEPT = JSON_PEER_ACCEPT, JSON_PEER_STREAM_ACCEPT
 
 
 class Blockchain:
-    def __init__(self):
+    def __init__(self, consensus=None):
         """
         Constructor. Create a new blockchain with a genesis block.
+        :param consensus: The rules used to seal and check blocks. Defaults to a 4 zero proof of work.
         """
-        self.current_transactions = []
+        self.consensus = consensus or ProofOfWork()
+        # Held by anything that changes the chain, its hashes, the transaction index or the wallets.
+        # New blocks are appended to self.chain and self.block_hashes in place, one after the other,
+        # so a reader that doesn't take the lock may see the two lists at different lengths.
+        # Readers that need them to agree use self.view instead.
+        self.chain_lock = threading.RLock()
+        # Transactions waiting to be sealed into the next block.
+        self.mempool = Mempool()
         self.chain = []
+        # Hash of each block on the chain, kept alongside the chain.
+        self.block_hashes = []
+        # The chain, its hashes and its length, published together by publish_chain after every change.
+        # The lists are only ever grown in place or replaced, so their first length entries
+        # always match, however far they have grown since.
+        self.view = (self.chain, self.block_hashes, 0)
+        # Counts of every transaction on the chain, keyed on transaction_key.
+        self.transaction_index = Counter()
+        # Voter key of each vote issuing block, keyed on the block's position, which is its vote number.
+        self.vote_keys = dict()
+        # Votes each voter key was issued and hasn't cast yet. 0 once they have all been cast.
+        self.unspent_votes = dict()
+        # Cast votes whose signatures have already been verified,
+        # keyed on (sender, signature, vote_number), in the order they were verified.
+        self.verified_signatures = dict()
+        self.max_verified_signatures = MAX_VERIFIED_SIGNATURES
+        # Number of processes used to verify large batches of signatures. None uses every core.
+        self.verify_workers = None
         self.nodes = set()
-        self.new_block(proof=100, previous_hash=1)
+        # Pooled connections to peers, shared by the threads that fetch their chains.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=MAX_PEER_FETCHERS, pool_maxsize=MAX_PEER_FETCHERS)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         self.lock = False
         self.total_value = 0
         self.wallets = dict()
+        # Balances of the candidates of the election, kept up to date as wallets change.
+        self.tally = dict()
+        # Incremented every time the tally changes.
+        self.tally_version = 0
+        # The ChainStore the chain is saved to, if any.
+        self.store = None
+        # Private RsaKey this node signs checkpoints with, if it publishes them, and the blocks between them.
+        self.checkpoint_key = None
+        self.checkpoint_interval = 1000
+        # The latest checkpoint of the chain, signed by this node or by the peer it was bootstrapped from,
+        # and the wallets at that point, which are served with the chain as a snapshot.
+        self.checkpoint = None
+        self.checkpoint_wallets = None
+        self.new_block(proof=100, previous_hash=1)
 
     def register_node(self, address):
         """
@@ -70,6 +238,38 @@ class Blockchain:
             self.wallets[receiver] += amount
         else:
             self.wallets[receiver] = amount
+        if sender == "0":
+            self.total_value += amount
+        self.update_unspent(transaction)
+        self.update_tally((sender, receiver))
+
+    def set_candidates(self, candidates):
+        """
+        Set the candidates of the election, whose balances are kept in the tally.
+        :param candidates: The names of the candidates.
+        """
+        with self.chain_lock:
+            self.tally = {candidate: 0 for candidate in candidates}
+            self.refresh_tally()
+
+    def refresh_tally(self):
+        """
+        Rebuild the tally from the wallets, after the wallets were replaced.
+        """
+        self.update_tally(list(self.tally))
+
+    def update_tally(self, owners):
+        """
+        Copy the balances of any candidates among owners from the wallets to the tally.
+        :param owners: Names or keys whose balances changed.
+        """
+        changed = False
+        for owner in owners:
+            if owner in self.tally:
+                self.tally[owner] = self.wallets.get(owner, 0)
+                changed = True
+        if changed:
+            self.tally_version += 1
 
     def valid_wallets(self, new_chain):
         """
@@ -113,6 +313,7 @@ class Blockchain:
             return False, dict(), 0
         self.wallets = new_wallet
         self.total_value = new_chain_value
+        self.refresh_tally()
         return True, new_wallet, new_chain_value
 
     def balance_check(self, name):
@@ -127,6 +328,7 @@ class Blockchain:
         else:
             return 0
 
+    @VALID_CHAIN_SECONDS.time
     def valid_chain(self, chain):
         """
         Determine if a given blockchain is valid.
@@ -137,66 +339,430 @@ class Blockchain:
         for current_index in range(1, len(chain)):
             block = chain[current_index]
             # Check that the hash of the block is correct
-            last_block_hash = self.hash(last_block)
+            last_block_hash = self.block_hash(last_block)
             if block['previous_hash'] != last_block_hash:
                 return False
-            # Check that the proof of work is correct
-            if not self.valid_proof(last_block['proof'], block['proof'], last_block_hash):
+            # Check that the block is sealed correctly
+            if not self.consensus.valid_seal(last_block, block, last_block_hash):
                 return False
             last_block = block
         # Return true only if all transactions on the chain are valid:
         log("CHAIN HASHES ARE CORRECT. CHECKING FOR VALID TRANSACTIONS.")
         return self.chain_transactions_valid(chain)
 
-    def resolve_conflicts(self):
+    @RESOLVE_SECONDS.time
+    def resolve_conflicts(self, incremental=True):
         """
         Resolves conflicts by replacing our chain with the longest one in the network.
+        :param incremental: If True, only the blocks of a peer's chain after the point where
+                            it forks from this node's chain are verified. If False, every
+                            peer chain is verified from the genesis block.
         :return: True if chain was replaced, False if not.
         """
         log("RESOLVING CONFCLICTS.")
         neighbours = list(self.nodes)
-        new_chain = None
-        new_wallets = self.wallets
-        new_chain_value = self.total_value
-        # Only looking for longer chains:
-        max_length = len(self.chain)
-        # Grab and verify the chains from all the nodes in the network
-        for node in neighbours:
-            response = None
-            for i in range(5):
-                try:
-                    response = requests.get(f'http://{node}/chain/')
-                    if response:
-                        break
-                except:
-                    if i == 4:
-                        # Remove unresponsive nodes.
-                        self.nodes.discard(node)
-                    continue
-            if response:
-                if response.status_code == 200:
-                    length = response.json()['length']
-                    chain = response.json()['chain']
-                    # Check if the length is longer and the chain is valid
-                    log("CHECKING CHAIN.")
-                    if length > max_length and self.valid_chain(chain):
-                        log("CHAIN IS VALID. CHECKING BALANCES.")
-                        valid_wallets, new_wallets, new_chain_value = self.valid_wallets(chain)
-                        # If all blocks have correct hashes, and all blocks have valid
-                        # transactions, and the new chain leads to valid wallets.
-                        if valid_wallets:
-                            max_length = length
-                            new_chain = chain
-        # Replace this node's chain if a new, valid, longer chain is discovered:
-        if new_chain:
-            log("REPLACING THIS NODE'S CHAIN WITH NEW ONE.")
-            self.chain = new_chain
-            self.wallets = new_wallets
-            self.total_value = new_chain_value
-            return True
+        peer_chains = []
+        # Grab the chains from all the nodes in the network at once.
+        if neighbours:
+            with ThreadPoolExecutor(max_workers=min(len(neighbours), MAX_PEER_FETCHERS)) as executor:
+                for peer_chain in executor.map(self.fetch_peer_chain, neighbours):
+                    if peer_chain:
+                        peer_chains.append(peer_chain)
+        return self.adopt_longest_chain(peer_chains, incremental)
+
+    @PEER_FETCH_SECONDS.time
+    def fetch_peer_chain(self, node):
+        """
+        Fetch as much of a peer's chain as this node needs, header first:
+        the peer's length is checked, then only the blocks after the point where
+        our chains fork are downloaded. Starting at the end of our chain, the
+        starting point steps back twice as far each time the first block sent
+        doesn't follow on from our block before it.
+        Peers that don't have these endpoints send their whole chain instead.
+        :param node: Address of the peer. Eg. '192.168.0.5:5000'
+        :return: A (length, chain, hashes) triple, where hashes holds the hash of each block of chain,
+                 or None if the peer has nothing we need.
+        """
+        response = self.get_from_peer(node, '/chain/head/')
+        if response is None:
+            return None
+        if response.status_code == 404:
+            return self.fetch_full_peer_chain(node)
+        values = self.peer_json(response)
+        length = values.get('length') if values else None
+        # The chain, its hashes and its length as one consistent view, without taking the chain lock.
+        chain, hashes, our_length = self.view
+        if not isinstance(length, int) or length <= our_length:
+            return None
+        start, step = our_length, 1
+        while True:
+            last_block, last_hash = (chain[start - 1], hashes[start - 1]) if start else (None, None)
+            received = self.download_blocks(node, '/chain/since/{}'.format(start), last_block, last_hash)
+            if received is None:
+                return None
+            length, blocks, block_hashes = received
+            if blocks is not None:
+                return length, chain[:start] + blocks, hashes[:start] + block_hashes
+            start, step = max(0, our_length - step), step * 2
+
+    def fetch_full_peer_chain(self, node):
+        """
+        Fetch the whole chain of a peer.
+        :param node: Address of the peer. Eg. '192.168.0.5:5000'
+        :return: A (length, chain, hashes) triple, or None if the peer didn't send one.
+        """
+        received = self.download_blocks(node, '/chain/')
+        if received is None or received[1] is None:
+            return None
+        return received
+
+    def download_blocks(self, node, route, last_block=None, last_hash=None):
+        """
+        Download blocks from a peer, checking each one as it arrives: it must follow on from
+        the block before it and carry a valid seal. The download is abandoned at the first
+        block that doesn't, without waiting for the rest of the chain.
+        Peers that can stream send one block at a time, so the response is never held whole.
+        :param node: Address of the peer. Eg. '192.168.0.5:5000'
+        :param route: The route sending the blocks.
+        :param last_block: The block of ours the first block should follow on from.
+                           None if the first block is a genesis block.
+        :param last_hash: The hash of last_block.
+        :return: None if the peer sent nothing usable or an invalid block.
+                 (length, None, None) if the first block doesn't follow on from last_block.
+                 Otherwise the length of the peer's chain, the blocks received and their hashes.
+        """
+        response = self.get_from_peer(node, route, stream=True)
+        if response is None or response.status_code != 200:
+            return None
+        try:
+            received = self.peer_blocks(response)
+            if received is None:
+                return None
+            header, incoming = received
+            length = header.get('length', 0)
+            if not isinstance(length, int):
+                return None
+            blocks, hashes = [], []
+            for block in incoming:
+                if not isinstance(block, dict):
+                    return None
+                if last_block is not None:
+                    if block.get('previous_hash') != last_hash:
+                        if not blocks:
+                            return length, None, None
+                        log("INVALID BLOCK FROM {}. ABANDONING DOWNLOAD.", node, level=WARNING)
+                        return None
+                    if not self.consensus.valid_seal(last_block, block, last_hash):
+                        log("INVALID BLOCK FROM {}. ABANDONING DOWNLOAD.", node, level=WARNING)
+                        return None
+                last_block, last_hash = block, self.hash(block)
+                blocks.append(block)
+                hashes.append(last_hash)
+        except (KeyError, TypeError, ValueError, requests.RequestException):
+            return None
+        finally:
+            response.close()
+        return (length, blocks, hashes) if blocks else None
+
+    @staticmethod
+    def peer_blocks(response):
+        """
+        Read the blocks of a successful chain response from a peer.
+        Streamed responses are decoded one block at a time as they arrive.
+        :param response: A response from /chain/ or /chain/since/.
+        :return: A (header, blocks) pair, where header holds the response's values other than
+                 the chain and blocks is an iterator of blocks. None if the response has no chain.
+        """
+        content_type = response.headers.get('Content-Type', '')
+        if content_type.startswith(wireformat.STREAM_CONTENT_TYPE):
+            records = wireformat.read_records(response.iter_content(STREAM_CHUNK_SIZE))
+        elif content_type.startswith(wireformat.JSON_STREAM_CONTENT_TYPE):
+            records = wireformat.read_json_records(response.iter_content(STREAM_CHUNK_SIZE))
+        else:
+            records = None
+        if records is not None:
+            header = next(records, None)
+            return (header, records) if isinstance(header, dict) else None
+        values = Blockchain.peer_json(response)
+        if not values or not isinstance(values.get('chain'), list):
+            return None
+        return values, iter(values.pop('chain'))
+
+    def get_from_peer(self, node, route, stream=False):
+        """
+        Send a GET request to a peer, retrying with exponential backoff.
+        Unresponsive peers are removed from the list of nodes.
+        :param node: Address of the peer. Eg. '192.168.0.5:5000'
+        :param route: The route to request. Eg. '/chain/'
+        :param stream: If True, ask for a stream of blocks and don't read the body yet.
+        :return: The last response, or None if the peer never responded.
+        """
+        accept = PEER_STREAM_ACCEPT if stream else PEER_ACCEPT
+        response = None
+        for i in range(PEER_RETRIES):
+            try:
+                response = self.session.get(f'http://{node}{route}', headers={'Accept': accept},
+                                            stream=stream, timeout=PEER_TIMEOUT)
+                if response or response.status_code == 404:
+                    break
+            except requests.RequestException:
+                if i == PEER_RETRIES - 1:
+                    # Remove unresponsive nodes.
+                    log("REMOVING UNRESPONSIVE NODE {}", node, level=WARNING)
+                    self.nodes.discard(node)
+                    return None
+            if i < PEER_RETRIES - 1:
+                sleep(PEER_BACKOFF * 2 ** i)
+        return response
+
+    @staticmethod
+    def peer_json(response):
+        """
+        Parse the body of a successful response from a peer, in JSON or the compact binary encoding.
+        :param response: A response.
+        :return: The parsed body, or None if the response was not a 200 with an object.
+        """
+        if response.status_code != 200:
+            return None
+        try:
+            if response.headers.get('Content-Type', '').startswith(wireformat.CONTENT_TYPE):
+                values = wireformat.decode(response.content)
+            else:
+                values = response.json()
+        except ValueError:
+            return None
+        return values if isinstance(values, dict) else None
+
+    def adopt_longest_chain(self, peer_chains, incremental=True):
+        """
+        Replace our chain with the longest valid chain among those given, if it is longer than ours.
+        The chain lock is held throughout, so blocks can't be added while the chains are checked.
+        :param peer_chains: A list of (length, chain, hashes) triples received from peers.
+                            hashes is None unless the blocks were checked as they were downloaded.
+        :param incremental: If True, only verify the blocks after each chain forks from ours.
+        :return: True if chain was replaced, False if not.
+        """
+        with self.chain_lock:
+            new_state = None
+            # Only looking for longer chains:
+            max_length = len(self.chain)
+            for length, chain, hashes in peer_chains:
+                # Check if the length is longer and the chain is valid
+                log("CHECKING CHAIN.")
+                if length > max_length and length == len(chain):
+                    try:
+                        fork = self.common_prefix_length(chain) if incremental else 0
+                        valid, state = self.valid_chain_extension(chain, fork, hashes)
+                    except (KeyError, TypeError, ValueError, IndexError):
+                        # Malformed blocks or transactions. Skip this peer's chain.
+                        valid = False
+                    # If all new blocks have correct hashes, and all new blocks have valid
+                    # transactions, and the new chain leads to valid wallets.
+                    if valid:
+                        max_length = length
+                        new_state = state
+            # Replace this node's chain if a new, valid, longer chain is discovered:
+            if new_state:
+                log("REPLACING THIS NODE'S CHAIN WITH NEW ONE.", level=INFO)
+                self.adopt_chain(*new_state)
+                CHAINS_REPLACED.inc()
+                return True
         log("KEEPING CURRENT CHAIN.")
         return False
 
+    def add_block(self, block):
+        """
+        Add a block pushed by a peer, if it extends the tip of this node's chain.
+        Only the new block is checked, the same way as the new blocks of a peer's chain.
+        :param block: A block sealed by a peer.
+        :return: BLOCK_ADDED if the block was added.
+                 BLOCK_KNOWN if the block is already on this node's chain.
+                 BLOCK_AHEAD if the block doesn't follow on from our chain, so the peer's
+                 chain should be fetched to catch up.
+                 BLOCK_INVALID if the block extends our chain but is not valid.
+        """
+        try:
+            index = block['index']
+            previous_hash = block['previous_hash']
+        except (TypeError, KeyError):
+            return BLOCK_INVALID
+        with self.chain_lock:
+            length = len(self.chain)
+            if not isinstance(index, int) or index < 1:
+                return BLOCK_INVALID
+            if index < length and self.block_hashes[index] == self.hash(block):
+                return BLOCK_KNOWN
+            if index != length or previous_hash != self.last_hash:
+                return BLOCK_AHEAD
+            try:
+                valid, state = self.valid_chain_extension(self.chain + [block], length)
+            except (KeyError, TypeError, ValueError, IndexError):
+                # Malformed block or transactions.
+                valid = False
+            if not valid:
+                return BLOCK_INVALID
+            self.apply_chain_state(*state)
+        log("ADDED BLOCK {} FROM PEER.", index, level=INFO)
+        return BLOCK_ADDED
+
+    def common_prefix_length(self, chain):
+        """
+        Find how many leading blocks another chain shares with this node's chain.
+        Block k of the other chain holds the hash of its block k - 1, so if that hash matches
+        our cached hash of block k - 1, the first k blocks of both chains are the same.
+        :param chain: A blockchain.
+        :return: The number of leading blocks shared with this node's chain.
+        """
+        low, high = 0, min(len(self.block_hashes), len(chain) - 1)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if chain[mid]['previous_hash'] == self.block_hashes[mid - 1]:
+                low = mid
+            else:
+                high = mid - 1
+        return low
+
+    @CHAIN_EXTENSION_SECONDS.time
+    def valid_chain_extension(self, chain, fork, hashes=None):
+        """
+        Validate a chain that shares its first 'fork' blocks with this node's chain.
+        Only the blocks from 'fork' onward are hashed, proof checked, signature verified and
+        applied to the wallets, starting from the state of this node's chain at the fork.
+        Our own copies of the shared blocks are used, so a peer can't slip in altered blocks.
+        :param chain: A blockchain.
+        :param fork: Number of leading blocks shared with this node's chain. 0 validates everything.
+        :param hashes: The hash of each block of chain, if download_blocks already hashed and
+                       seal checked them. Only the link to this node's chain at the fork is then checked.
+                       Must never come from a peer.
+        :return: F and None if the chain is invalid.
+                 T and the state to pass to adopt_chain if the chain is valid.
+        """
+        new_chain = self.chain[:fork] + chain[fork:]
+        # Hash and proof check the new blocks:
+        if fork:
+            last_block_hash = self.block_hashes[fork - 1]
+            new_hashes = []
+        else:
+            last_block_hash = hashes[0] if hashes else self.hash(new_chain[0])
+            new_hashes = [last_block_hash]
+        for current_index in range(max(fork, 1), len(new_chain)):
+            last_block = new_chain[current_index - 1]
+            block = new_chain[current_index]
+            if block['previous_hash'] != last_block_hash:
+                return False, None
+            if hashes:
+                # Seal checked against the downloaded block before it, which has the same hash as ours.
+                last_block_hash = hashes[current_index]
+            else:
+                if not self.consensus.valid_seal(last_block, block, last_block_hash):
+                    return False, None
+                last_block_hash = self.hash(block)
+            new_hashes.append(last_block_hash)
+        log("CHAIN HASHES ARE CORRECT. CHECKING FOR VALID TRANSACTIONS.")
+
+        # Our voter keys up to the fork, hiding those of our blocks after it, then those of the new blocks.
+        new_blocks = new_chain[fork:]
+        vote_keys = ChainMap(self.build_vote_keys(new_blocks, fork),
+                             dict.fromkeys(range(fork, len(self.chain))), self.vote_keys)
+        # Roll our wallets and transaction index back to the fork, recording only the changes.
+        # With no shared blocks the state starts empty, so there is nothing to roll back.
+        if fork:
+            wallets = ChainMap(dict(), self.wallets)
+            index = ChainMap(dict(), self.transaction_index)
+            new_chain_value = self.total_value
+            for block in self.chain[fork:]:
+                for transaction in block['transactions']:
+                    amount = transaction['amount']
+                    sender = transaction['sender']
+                    receiver = transaction['recipient']
+                    wallets[sender] = wallets.get(sender, 0) + amount
+                    wallets[receiver] = wallets.get(receiver, 0) - amount
+                    key = self.transaction_key(transaction)
+                    index[key] = index.get(key, 0) - 1
+                    if sender == "0":
+                        new_chain_value -= amount
+        else:
+            wallets = ChainMap(dict())
+            index = ChainMap(dict())
+            new_chain_value = 0
+
+        # Apply the new blocks:
+        for block in new_blocks:
+            for transaction in block['transactions']:
+                key = self.transaction_key(transaction)
+                index[key] = index.get(key, 0) + 1
+        self.verify_signatures(transaction for block in new_blocks for transaction in block['transactions'])
+        for block in new_blocks:
+            for transaction in block['transactions']:
+                if not self.valid_transaction(transaction, new_chain, index, vote_keys):
+                    return False, None
+                amount = transaction['amount']
+                sender = transaction['sender']
+                receiver = transaction['recipient']
+                wallets[sender] = wallets.get(sender, 0) - amount
+                wallets[receiver] = wallets.get(receiver, 0) + amount
+                if sender == "0":
+                    new_chain_value += amount
+
+        log("CHAIN IS VALID. CHECKING BALANCES.")
+        for owner, balance in wallets.maps[0].items():
+            if owner != "0" and balance < 0:
+                # Prevent tranferer from spending more than they have.
+                return False, None
+        if self.lock and new_chain_value != self.total_value:
+            # If the chain is locked, reject a chain with a different net value.
+            return False, None
+        return True, (new_chain, fork, new_hashes, index.maps[0], wallets.maps[0], new_chain_value)
+
+    def adopt_chain(self, new_chain, fork, new_hashes, index_changes, wallet_changes, new_chain_value):
+        """
+        Replace this node's chain with one validated by valid_chain_extension.
+        :param new_chain: The new chain.
+        :param fork: Number of leading blocks shared with this node's old chain.
+        :param new_hashes: Hashes of the blocks of the new chain from the fork onward.
+        :param index_changes: Transaction index entries changed since the fork.
+        :param wallet_changes: Wallet balances changed since the fork.
+        :param new_chain_value: Total value of the new chain.
+        """
+        with self.chain_lock:
+            self.apply_chain_state(new_chain, fork, new_hashes, index_changes, wallet_changes, new_chain_value)
+
+    def apply_chain_state(self, new_chain, fork, new_hashes, index_changes, wallet_changes, new_chain_value):
+        """
+        Body of adopt_chain. Must be called with the chain lock held.
+        """
+        if fork:
+            self.wallets.update(wallet_changes)
+        else:
+            self.transaction_index = Counter()
+            self.wallets = wallet_changes
+        for key, count in index_changes.items():
+            if count > 0:
+                self.transaction_index[key] = count
+            else:
+                self.transaction_index.pop(key, None)
+        if fork:
+            self.index_votes(self.chain[fork:], fork, -1)
+        else:
+            self.vote_keys = dict()
+            self.unspent_votes = dict()
+        self.index_votes(new_chain[fork:], fork)
+        # Pending transactions that the new blocks already hold are confirmed.
+        self.mempool.discard(transaction for block in new_chain[fork:] for transaction in block['transactions'])
+        self.chain = new_chain
+        self.block_hashes = self.block_hashes[:fork] + new_hashes
+        self.publish_chain()
+        self.total_value = new_chain_value
+        if fork:
+            self.update_tally(wallet_changes)
+        else:
+            self.refresh_tally()
+        if self.checkpoint and fork < self.checkpoint['length']:
+            # The blocks the checkpoint covers have been replaced.
+            self.checkpoint = self.checkpoint_wallets = None
+        self.persist_blocks(fork)
+        self.update_checkpoint()
+
     def chain_transactions_valid(self, chain):
         """
         Checks the validity of a the transactions in a chain.
@@ -206,21 +772,34 @@ class Blockchain:
         :return: True if valid, else false
         """
         log("CHECKING VALIDITY OF TRANSACTIONS.")
+        # Index the chain once so that each redundancy check is a single lookup.
+        index = self.build_transaction_index(chain)
+        vote_keys = self.build_vote_keys(chain)
+        self.verify_signatures(transaction for block in chain for transaction in block['transactions'])
         for block in chain:
             for transaction in block['transactions']:
-                if not self.valid_transaction(transaction, chain):
+                if not self.valid_transaction(transaction, chain, index, vote_keys):
                     return False
         return True
 
-    def valid_transaction(self, transaction, chain):
+    def valid_transaction(self, transaction, chain, index=None, vote_keys=None):
         """
         Checks the validity of a requested transaction by:
         Ensuring transfer amount is positive.
         Checking that the key used to request transaction is correct.
+        :param transaction: The transaction to be checked.
+        :param chain: The chain the transaction is checked against.
+        :param index: Transaction index of the chain. Built from the chain if not given.
+        :param vote_keys: Voter keys of the chain's vote issuing blocks, keyed on vote number.
+                          Built from the chain if not given.
         :return: True if valid, else false
         """
+        if not self.well_formed(transaction):
+            return False
+        if index is None:
+            index = self.transaction_index if chain is self.chain else self.build_transaction_index(chain)
         # Ensure that transaction is not redundant:
-        if not self.non_redundant_transaction(transaction, chain):
+        if not self.non_redundant_transaction(transaction, chain, index):
             return False
         # Ensure transfer amount is positive.
         amount = transaction['amount']
@@ -234,37 +813,105 @@ class Blockchain:
         # If not an original vote producer vote, then the vote is being
         # transferred, e.g. being cast.
         # Ensure that the vote number is the correct one for this vote:
-        vote_number = transaction['vote_number']
-        if len(chain) < vote_number:
+        signature_key = self.signature_key(transaction)
+        if signature_key is None:
             return False
-        target_node_transactions = chain[vote_number]['transactions']
-        if len(target_node_transactions) != 1:
-            # The initial vote nodes only have one transaction per block.
-            return False
-        referenced_voter = target_node_transactions[0]['recipient']
-        if sender != referenced_voter:
+        vote_number = transaction['vote_number']
+        if vote_keys is None:
+            vote_keys = self.vote_keys if chain is self.chain else self.build_vote_keys(chain)
+        if sender != vote_keys.get(vote_number):
             return False
 
         # We now know that someone is trying to cast a vote that is indeed available
         # to be cast. Now we need to verify the signature that the voter provided in
-        # order to ascertain that the transaction is actually valid. The signature is
-        # the phrase "NO COLLUSION" encrypted with a private RSA key that corresponds
-        # to the public key in the 'sender' field.
-        voter_private_key = cryptfuncs.import_key(transaction['signature'])
-        # A voters signature is the private key that is assigned to their vote.
-        # Once used, it is no longer usable. Thus, it doesn't matter that users
-        # are publicizing their private key, something one wouldn't want to do
-        # in most contexts.
-        voter_public_key = cryptfuncs.import_key(sender)
-
-        verification_message = "NO COLLUSION"
-        signature = cryptfuncs.sign(verification_message, voter_private_key)
-        verification = cryptfuncs.verify(verification_message, signature, voter_public_key)
-        log("{} TRANSACTION".format("GOOD" if verification else "BAD"))
-        if not verification:
-            log("THE FOLLOWING TRANSACTION WAS NOT VALID: {}".format(transaction))
+        # order to ascertain that the transaction is actually valid.
+        if signature_key in self.verified_signatures:
+            return True
+        verification = verify_vote_signature(sender, transaction['signature'])
+        SIGNATURES.inc('valid' if verification else 'invalid')
+        if verification:
+            log("GOOD TRANSACTION")
+            self.cache_verified([signature_key])
+        else:
+            log("BAD SIGNATURE FOR VOTE {}.", vote_number, level=WARNING)
         return verification
 
+    @staticmethod
+    def well_formed(transaction):
+        """
+        Check that the fields every transaction has are of the right types, so that a transaction
+        sent by a peer can be keyed and applied to the wallets.
+        :param transaction: A transaction.
+        :return: True if they are, else false.
+        """
+        try:
+            return (isinstance(transaction['sender'], str) and isinstance(transaction['recipient'], str)
+                    and isinstance(transaction['amount'], int)
+                    and isinstance(transaction['timestamp'], (int, float)))
+        except (KeyError, TypeError):
+            return False
+
+    @staticmethod
+    def signature_key(transaction):
+        """
+        The key a cast vote's verified signature is cached under.
+        :param transaction: A cast vote.
+        :return: (sender, signature, vote_number), or None if any of them has the wrong type,
+                 such as a list sent by a peer, which can't be hashed and can't be a valid vote.
+        """
+        sender, signature, vote_number = transaction['sender'], transaction['signature'], transaction['vote_number']
+        if not isinstance(sender, str) or not isinstance(signature, str) or not isinstance(vote_number, int):
+            return None
+        return sender, signature, vote_number
+
+    def verify_signatures(self, transactions):
+        """
+        Verify the signatures of a batch of cast votes ahead of validating them,
+        spreading the RSA work over a pool of worker processes when the batch is large.
+        Verified signatures are cached, so valid_transaction won't check them again.
+        Votes with fields of the wrong type are skipped, and left for valid_transaction to reject.
+        :param transactions: An iterable of transactions.
+        :return: The number of signatures that were newly verified.
+        """
+        pending = set()
+        for transaction in transactions:
+            if transaction['sender'] == "0":
+                continue
+            signature_key = self.signature_key(transaction)
+            if signature_key is not None and signature_key not in self.verified_signatures:
+                pending.add(signature_key)
+        if not pending:
+            return 0
+        pending = list(pending)
+        senders = [signature_key[0] for signature_key in pending]
+        signatures = [signature_key[1] for signature_key in pending]
+        workers = self.verify_workers or os.cpu_count() or 1
+        if workers > 1 and len(pending) >= PARALLEL_VERIFY_THRESHOLD:
+            log("VERIFYING {} SIGNATURES WITH {} PROCESSES.", len(pending), workers)
+            chunksize = max(1, len(pending) // (workers * 4))
+            results = list(verify_pool(workers).map(verify_vote_signature, senders, signatures, chunksize=chunksize))
+        else:
+            results = list(map(verify_vote_signature, senders, signatures))
+        verified = [signature_key for signature_key, result in zip(pending, results) if result]
+        self.cache_verified(verified)
+        SIGNATURES.inc('valid', amount=len(verified))
+        SIGNATURES.inc('invalid', amount=len(pending) - len(verified))
+        return len(verified)
+
+    def cache_verified(self, signature_keys):
+        """
+        Cache verified signatures, dropping the oldest once more than max_verified_signatures are held.
+        A batch is kept whole, even if it is larger than that, since it is about to be validated.
+        :param signature_keys: Keys of the verified signatures, as given by signature_key.
+        """
+        cache = self.verified_signatures
+        for signature_key in signature_keys:
+            cache[signature_key] = None
+        excess = len(cache) - max(self.max_verified_signatures, len(signature_keys))
+        if excess > 0:
+            for signature_key in list(islice(cache, excess)):
+                del cache[signature_key]
+
     def get_transactor(self, vote_number):
         """
         When a person issues a vote, they upload their vote number and signature.
@@ -275,39 +922,118 @@ class Blockchain:
         :vote_number: The number corresponding to the vote being cast.
         :return: The public key of the person voting now. False if failed.
         """
-        if len(self.chain) < vote_number:
-            return False
-        target_node_transactions = self.chain[vote_number]['transactions']
-        if len(target_node_transactions) != 1:
-            # The initial vote nodes only have one transaction per block.
-            return False
-        return target_node_transactions[0]['recipient']
+        return self.vote_keys.get(vote_number, False)
+
+    @staticmethod
+    def issued_voter(block):
+        """
+        Get the voter a block issues votes to. The initial vote blocks hold a single
+        transaction from the "0" sender to the voter's public key.
+        :param block: A block.
+        :return: The voter's public key, or None if the block is not a vote issuing block.
+        """
+        transactions = block['transactions']
+        if len(transactions) != 1 or transactions[0]['sender'] != "0":
+            return None
+        return transactions[0]['recipient']
+
+    @staticmethod
+    def build_vote_keys(blocks, start=0):
+        """
+        Map the vote numbers of the vote issuing blocks among consecutive blocks to their voters.
+        :param blocks: The blocks.
+        :param start: Position of the first block on its chain.
+        :return: A dictionary of vote number -> voter key.
+        """
+        vote_keys = dict()
+        for position, block in enumerate(blocks, start):
+            voter = Blockchain.issued_voter(block)
+            if voter is not None:
+                vote_keys[position] = voter
+        return vote_keys
+
+    def index_issued_vote(self, block, position, direction=1):
+        """
+        Record the voter of a vote issuing block in vote_keys, or remove them again.
+        :param block: A block.
+        :param position: Position of the block on the chain.
+        :param direction: 1 to add the block, -1 to take it out.
+        """
+        voter = self.issued_voter(block)
+        if voter is None:
+            return
+        if direction > 0:
+            self.vote_keys[position] = voter
+        elif self.vote_keys.get(position) == voter:
+            del self.vote_keys[position]
+
+    def update_unspent(self, transaction, direction=1):
+        """
+        Apply a transaction to the unspent votes: votes from the "0" sender are issued to
+        their recipient, and votes from anyone else are cast by their sender.
+        :param transaction: A transaction.
+        :param direction: 1 to apply the transaction, -1 to undo it.
+        """
+        if transaction['sender'] == "0":
+            owner, change = transaction['recipient'], transaction['amount']
+        else:
+            owner, change = transaction['sender'], -transaction['amount']
+        unspent = self.unspent_votes.get(owner, 0) + change * direction
+        if direction < 0 and unspent == 0:
+            self.unspent_votes.pop(owner, None)
+        else:
+            self.unspent_votes[owner] = unspent
+
+    def index_votes(self, blocks, start, direction=1):
+        """
+        Add the votes issued and cast in consecutive blocks of the chain to the vote index, or take them out again.
+        :param blocks: The blocks.
+        :param start: Position of the first block on the chain.
+        :param direction: 1 to add the blocks, -1 to take them out.
+        """
+        for position, block in enumerate(blocks, start):
+            self.index_issued_vote(block, position, direction)
+            for transaction in block['transactions']:
+                self.update_unspent(transaction, direction)
 
     @staticmethod
-    def non_redundant_transaction(transaction, chain):
+    def transaction_key(transaction):
+        """
+        The identity of a transaction, as used when checking for redundant transactions.
+        :param transaction: A transaction.
+        :return: A (timestamp, sender, recipient) tuple.
+        """
+        return transaction['timestamp'], transaction['sender'], transaction['recipient']
+
+    @staticmethod
+    def build_transaction_index(chain):
+        """
+        Count every transaction on a chain by its transaction key.
+        :param chain: The chain to index.
+        :return: A Counter of transaction keys.
+        """
+        index = Counter()
+        for block in chain:
+            for transaction in block['transactions']:
+                index[Blockchain.transaction_key(transaction)] += 1
+        return index
+
+    @staticmethod
+    def non_redundant_transaction(transaction, chain, index=None):
         """
         Check to make sure a transaction isn't already on the chain.
         :param transaction: a pending transaction.
         :param chain: a blockchain to search for the transaction.
+        :param index: Transaction index of the chain. Built from the chain if not given.
         :return: True if not redundant, else false.
         """
-        transaction_time = transaction['timestamp']
-        sender = transaction['sender']
-        recipient = transaction['recipient']
-        transaction_seen = False
-        for block in chain:
-            if block['transactions']:
-                for other_transaction in block['transactions']:
-                    other_time = other_transaction['timestamp']
-                    other_sender = other_transaction['sender']
-                    other_recipient = other_transaction['recipient']
-                    if transaction_time == other_time and sender == other_sender and recipient == other_recipient:
-                        # If we've already seen this transaction, it is redundant. If not, mark it as seen.
-                        if transaction_seen:
-                            # Transaction is redundant.
-                            log("TRANSACTION IS REDUNDANT")
-                            return False
-                        transaction_seen = True
+        if index is None:
+            index = Blockchain.build_transaction_index(chain)
+        # A transaction may appear on the chain once (it is itself on the chain when a
+        # whole chain is checked). If it has been seen more than that, it is redundant.
+        if index.get(Blockchain.transaction_key(transaction), 0) > 1:
+            log("TRANSACTION IS REDUNDANT")
+            return False
         return True
 
     def valid_balance(self, transaction):
@@ -323,15 +1049,27 @@ class Blockchain:
         if sender == "0" and not self.lock:
             # "0" sender, is the original source, and is allowed
             return True
-        if sender in self.wallets:
-            log("SENDER FOUND IN WALLET.")
-            if self.wallets[sender] >= amount:
+        if sender in self.unspent_votes:
+            log("SENDER FOUND IN VOTE INDEX.")
+            if self.unspent_votes[sender] >= amount:
                 log("BALANCE SUFFICIENT.")
                 return True
-        log("{} DOES NOT HAVE A SUFFICIENT BALANCE OR DOES NOT EXIST.".format(sender))
+        log("VOTE {} IS SPENT OR DOES NOT EXIST.", transaction.get('vote_number'))
         return False
 
-    def new_block(self, proof, previous_hash):
+    def seal_block(self, rejected=None):
+        """
+        Seal the pending transactions into a new block on top of the current last block.
+        The chain lock is held from finding the proof until the block is added, so two
+        threads sealing at once can't both build on the same last block.
+        :param rejected: If given, a list that pending transactions which were not valid are added to.
+        :return: The new block, or None if there were pending transactions but none of them were valid.
+        """
+        with self.chain_lock:
+            proof = self.proof_of_work(self.last_block)
+            return self.new_block(proof, self.last_hash, rejected)
+
+    def new_block(self, proof, previous_hash, rejected=None):
         """
         Create a new block in the blockchain.
         Make sure not to add transaction to a block that already exist on the blockchain.
@@ -339,26 +1077,54 @@ class Blockchain:
         Check that the key used to request each transaction is correct.
         :param proof: The proof given by the proof of work algorithm
         :param previous_hash: Hash of previous block
-        :return: A new block
+        :param rejected: If given, a list that pending transactions which were not valid are added to.
+        :return: A new block, or None if there were pending transactions but none of them were valid.
         """
+        with self.chain_lock:
+            return self.append_block(proof, previous_hash, rejected)
+
+    def append_block(self, proof, previous_hash, rejected):
+        """
+        Body of new_block. Must be called with the chain lock held.
+        """
+        # Take the pending transactions, leaving an empty pool for new ones.
+        pending = self.mempool.drain()
         valid_transactions = []
-        for transaction in self.current_transactions:
+        for transaction in pending:
             # Ensure proper vote signature and sufficient balance.
-            if self.valid_transaction(transaction, self.chain) and self.valid_balance(transaction):
+            try:
+                valid = self.valid_transaction(transaction, self.chain) and self.valid_balance(transaction)
+            except (KeyError, TypeError, ValueError):
+                # A malformed transaction is rejected on its own, not with the rest of the batch.
+                valid = False
+            if valid:
                 self.update_wallets(transaction)
+                self.transaction_index[self.transaction_key(transaction)] += 1
                 valid_transactions.append(transaction)
                 log("TRANSACTION ADDED TO NEW BLOCK.")
+            elif rejected is not None:
+                rejected.append(transaction)
+        if pending and not valid_transactions:
+            # Nothing left to seal. An empty block would only lengthen the chain.
+            log("NO VALID PENDING TRANSACTIONS. NO BLOCK SEALED.")
+            return None
         block = {
             'index': len(self.chain),
             'timestamp': time(),
             'transactions': valid_transactions,
             'proof': proof,
-            'previous_hash': previous_hash or self.hash(self.chain[-1])
+            'previous_hash': previous_hash or self.last_hash
         }
-        # Reset the current list of transactions
-        self.current_transactions = []
+        if self.chain:
+            # The genesis block is never checked, so it is left unsealed.
+            block['proof'] = self.consensus.seal(block, proof)
+        self.index_issued_vote(block, len(self.chain))
         self.chain.append(block)
-        log("NEW BLOCK ADDED TO CHAIN.")
+        self.block_hashes.append(self.hash(block))
+        self.publish_chain()
+        self.persist_blocks(len(self.chain) - 1)
+        self.update_checkpoint()
+        log("NEW BLOCK ADDED TO CHAIN.", level=INFO)
         return block
 
     def new_transaction(self, sender, recipient, amount, signature=None, vote_number=0):
@@ -372,7 +1138,68 @@ class Blockchain:
         :param vote_number: The vote block corresponding with the signature.
         :return: The index of the block that will hold this transaction.
         """
-        new_t = {
+        new_t = self.build_transaction(sender, recipient, amount, signature, vote_number)
+        self.mempool.add(new_t)
+        return new_t
+
+    def queue_transaction(self, transaction):
+        """
+        Add a transaction built with build_transaction to the pending transactions,
+        unless it is already pending, its sender already has a transaction pending,
+        or the mempool is full.
+        :param transaction: A transaction.
+        :return: True if the transaction was added, else false.
+        """
+        return self.mempool.add(transaction) == ADMITTED
+
+    def admit_transaction(self, transaction):
+        """
+        Add a transaction received from a peer to the pending transactions, after a check
+        that needs no signature verification: a cast vote must name the vote number its sender
+        was issued, and the vote must not have been cast yet. Copies of a vote gossiped by
+        several peers are only admitted once, so its signature is only verified once, when it is sealed.
+        :param transaction: A transaction.
+        :return: ADMITTED if the transaction was added, INVALID if it failed the check,
+                 BEHIND if it names a vote number past the end of this node's chain,
+                 or the reason the mempool turned it away.
+        """
+        if not self.well_formed(transaction):
+            return INVALID
+        try:
+            sender, amount = transaction['sender'], transaction['amount']
+            if amount < 0:
+                return INVALID
+            if sender == "0":
+                if self.lock:
+                    return INVALID
+            elif transaction['vote_number'] >= len(self.chain):
+                return BEHIND
+            elif (self.vote_keys.get(transaction['vote_number']) != sender
+                  or self.unspent_votes.get(sender, 0) < amount):
+                return INVALID
+        except (KeyError, TypeError):
+            return INVALID
+        return self.mempool.add(transaction)
+
+    @property
+    def current_transactions(self):
+        """
+        The pending transactions, in the order they were added.
+        """
+        return list(self.mempool)
+
+    @staticmethod
+    def build_transaction(sender, recipient, amount, signature=None, vote_number=0):
+        """
+        Creates a new transaction without adding it to the pending transactions.
+        :param sender: Address of the sender
+        :param recipient: Address of the recipient
+        :param amount: Amount of transfer
+        :param signature: A signature authorizing a transfer.
+        :param vote_number: The vote block corresponding with the signature.
+        :return: The transaction.
+        """
+        return {
             'sender': sender,
             'recipient': recipient,
             'timestamp': time(),
@@ -380,13 +1207,235 @@ class Blockchain:
             'signature': signature,
             'vote_number': vote_number
         }
-        self.current_transactions.append(new_t)
-        return new_t
+
+    def attach_store(self, store):
+        """
+        Keep this node's chain in a ChainStore from now on.
+        If the store already holds a chain, it replaces this node's chain. The wallets and
+        transaction index are restored from the store's latest snapshot, and only the blocks
+        after it are re-hashed and applied. Otherwise this node's chain is written to the store.
+        :param store: A ChainStore.
+        :return: True if a chain was loaded from the store, else false.
+        """
+        with self.chain_lock:
+            self.store = None
+            if not len(store):
+                self.store = store
+                self.persist_blocks(0)
+                return False
+            chain = list(store.blocks())
+            hashes = list(store.hashes)
+            snapshot = store.load_snapshot()
+            if snapshot:
+                start = snapshot['length']
+                self.wallets = snapshot['wallets']
+                self.total_value = snapshot['total_value']
+                self.transaction_index = Counter({tuple(entry[:3]): entry[3] for entry in snapshot['transactions']})
+            else:
+                start = 0
+                self.wallets = dict()
+                self.total_value = 0
+                self.transaction_index = Counter()
+            # The vote index isn't snapshotted, since rebuilding it needs no hashing or signature checks.
+            self.vote_keys = dict()
+            self.unspent_votes = dict()
+            self.index_votes(chain[:start], 0)
+            # The store only holds blocks this node had already accepted, so the blocks after the
+            # snapshot are only checked against their stored hashes, in case the files were damaged.
+            for index in range(start, len(chain)):
+                # Each block must match its hash, and follow on from the block before it.
+                if (self.hash(chain[index]) != hashes[index]
+                        or index and chain[index]['previous_hash'] != hashes[index - 1]):
+                    log("CHAIN STORE IS DAMAGED AT BLOCK {}. DROPPING THE REST.", index, level=ERROR)
+                    del chain[index:]
+                    del hashes[index:]
+                    store.truncate(index)
+                    break
+                for transaction in chain[index]['transactions']:
+                    self.update_wallets(transaction)
+                    self.transaction_index[self.transaction_key(transaction)] += 1
+                self.index_issued_vote(chain[index], index)
+            self.chain = chain
+            self.block_hashes = hashes
+            self.publish_chain()
+            self.refresh_tally()
+            self.store = store
+            return True
+
+    def follow_store(self, reader):
+        """
+        Catch up with a chain store that another process writes to, for a node that only serves reads.
+        The writer checked the blocks before storing them, so they are applied without checks,
+        the way attach_store replays the blocks after a snapshot. If stored blocks were replaced,
+        the state is rebuilt from the genesis block.
+        :param reader: A ChainReader.
+        :return: True if the chain changed, else false.
+        """
+        with self.chain_lock:
+            update = reader.refresh()
+            if update is None:
+                return False
+            start, blocks, hashes = update
+            if start < len(self.chain):
+                blocks = self.chain[:start] + blocks
+                hashes = self.block_hashes[:start] + hashes
+                start = 0
+                chain, block_hashes = [], []
+                self.wallets = dict()
+                self.total_value = 0
+                self.transaction_index = Counter()
+                self.vote_keys = dict()
+                self.unspent_votes = dict()
+            else:
+                chain, block_hashes = self.chain, self.block_hashes
+            for position, block in enumerate(blocks, start):
+                for transaction in block['transactions']:
+                    self.update_wallets(transaction)
+                    self.transaction_index[self.transaction_key(transaction)] += 1
+                self.index_issued_vote(block, position)
+            chain.extend(blocks)
+            block_hashes.extend(hashes)
+            self.chain = chain
+            self.block_hashes = block_hashes
+            self.publish_chain()
+            if not start:
+                self.refresh_tally()
+        return True
+
+    def persist_blocks(self, start):
+        """
+        Write the blocks of the chain from index 'start' onward to the store, replacing any stored
+        blocks from that point, and snapshot the chain's state if one is due.
+        Must be called with the chain lock held.
+        :param start: Index of the first block that is new or changed.
+        """
+        if self.store is None:
+            return
+        self.store.truncate(start)
+        for index in range(start, len(self.chain)):
+            self.store.append(self.chain[index], self.block_hashes[index])
+        if self.store.snapshot_due(len(self.chain)):
+            self.store.save_snapshot(len(self.chain), self.wallets, self.total_value, self.transaction_index)
+
+    def update_checkpoint(self):
+        """
+        Sign a new checkpoint if this node publishes them and the chain has grown by
+        checkpoint_interval blocks since the latest one. Must be called with the chain lock held.
+        """
+        if self.checkpoint_key is None:
+            return
+        if len(self.chain) - (self.checkpoint['length'] if self.checkpoint else 0) < self.checkpoint_interval:
+            return
+        self.checkpoint_wallets = dict(self.wallets)
+        self.checkpoint = checkpoints.new_checkpoint(len(self.chain), self.last_hash, self.checkpoint_wallets,
+                                                     self.total_value, self.checkpoint_key)
+        log("SIGNED A CHECKPOINT AT BLOCK {}.", len(self.chain), level=INFO)
+
+    def snapshot(self):
+        """
+        The chain up to the latest checkpoint, with the checkpoint and the wallets at that point,
+        for a new node to start from.
+        :return: A dictionary, or None if there is no checkpoint.
+        """
+        with self.chain_lock:
+            if self.checkpoint is None:
+                return None
+            return {
+                'checkpoint': self.checkpoint,
+                'chain': self.chain[:self.checkpoint['length']],
+                'wallets': self.checkpoint_wallets,
+            }
+
+    def load_snapshot(self, snapshot, trusted_keys):
+        """
+        Replace this node's chain with a snapshot from a peer, if it matches a checkpoint signed by a
+        trusted key. The blocks are only hashed, to check that they lead up to the checkpoint: their
+        seals and signatures are vouched for by the checkpoint, and the wallets by its state digest.
+        The transaction and vote indexes are rebuilt from the blocks, which needs no signature checks.
+        :param snapshot: A snapshot, as sent by snapshot.
+        :param trusted_keys: Public RsaKeys of the nodes whose checkpoints are trusted.
+        :return: True if the snapshot was loaded, else false.
+        """
+        try:
+            checkpoint, chain, wallets = snapshot['checkpoint'], snapshot['chain'], snapshot['wallets']
+            length, total_value = checkpoint['length'], checkpoint['total_value']
+        except (TypeError, KeyError):
+            return False
+        if not isinstance(chain, list) or not isinstance(wallets, dict) or not 0 < length == len(chain):
+            return False
+        if not checkpoints.valid_checkpoint(checkpoint, trusted_keys):
+            return False
+        hashes = []
+        try:
+            for index, block in enumerate(chain):
+                if index and block['previous_hash'] != hashes[-1]:
+                    return False
+                hashes.append(self.hash(block))
+            transaction_index = self.build_transaction_index(chain)
+            digest = checkpoints.state_digest(wallets, total_value)
+        except (TypeError, KeyError):
+            return False
+        if hashes[-1] != checkpoint['tip_hash'] or digest != checkpoint['state_digest']:
+            return False
+        with self.chain_lock:
+            if len(self.chain) >= length:
+                return False
+            self.chain = chain
+            self.block_hashes = hashes
+            self.publish_chain()
+            self.wallets = wallets
+            self.total_value = total_value
+            self.transaction_index = transaction_index
+            self.vote_keys = dict()
+            self.unspent_votes = dict()
+            self.index_votes(chain, 0)
+            self.refresh_tally()
+            self.checkpoint, self.checkpoint_wallets = checkpoint, dict(wallets)
+            self.persist_blocks(0)
+        log("LOADED A SNAPSHOT OF {} BLOCKS.", length, level=INFO)
+        return True
+
+    def bootstrap(self, node, trusted_keys):
+        """
+        Start this node from a peer's snapshot at its latest checkpoint. Blocks after the checkpoint
+        are left for resolve_conflicts, which only validates the blocks past the end of our chain.
+        :param node: Address of the peer. Eg. '192.168.0.5:5000'
+        :param trusted_keys: Public RsaKeys of the nodes whose checkpoints are trusted.
+        :return: True if a snapshot was loaded, else false.
+        """
+        response = self.get_from_peer(node, '/snapshot/')
+        if response is None:
+            return False
+        snapshot = self.peer_json(response)
+        return bool(snapshot) and self.load_snapshot(snapshot, trusted_keys)
+
+    def publish_chain(self):
+        """
+        Publish the chain and its hashes to readers that don't take the chain lock.
+        Must be called with the chain lock held, once both lists hold every block.
+        """
+        self.view = (self.chain, self.block_hashes, len(self.chain))
 
     @property
     def last_block(self):
         return self.chain[-1]
 
+    @property
+    def last_hash(self):
+        return self.block_hashes[-1]
+
+    def block_hash(self, block):
+        """
+        Get the hash of a block, using the cached hash if the block is on this node's chain.
+        Blocks are never modified once they are on the chain, so their hashes never change.
+        :param block: A block.
+        :return: The SHA-256 hash of the block.
+        """
+        index = block.get('index')
+        if isinstance(index, int) and 0 <= index < len(self.chain) and self.chain[index] is block:
+            return self.block_hashes[index]
+        return self.hash(block)
+
     @staticmethod
     def hash(block):
         """
@@ -399,32 +1448,26 @@ class Blockchain:
 
     def proof_of_work(self, last_block):
         """
-        Simple proof of work algorithm:
+        Get the proof for the block following last_block from the consensus rules.
+        With the default proof of work:
          - Find a number p' such that hash(pp') contains leading 4 zeroes
          - Where p is the previous proof, and p' is the new proof
         NOTE: For a blockchain used to store votes in an election, we don't care
-        very much about proof of work at all. Indeed, it might be optimal to
-        completely remove proof of work for non-currency blockchain applications.
-        However, this function is kept here for now.
+        very much about proof of work at all. The authority consensus skips it
+        entirely, and blocks are signed by an election authority instead.
         :param last_block: <dict> last block
-        :return: <int> proof of work.
+        :return: <int> proof of work, or None if the consensus doesn't need one.
         """
-        last_proof = last_block['proof']
-        last_hash = self.hash(last_block)
-        proof = 0
-        while self.valid_proof(last_proof, proof, last_hash) is False:
-            proof += 1
-        return proof
+        return self.consensus.proof(last_block, self.block_hash(last_block))
 
     @staticmethod
-    def valid_proof(last_proof, proof, last_hash):
+    def valid_proof(last_proof, proof, last_hash, difficulty=4):
         """
         Validates a proof of work
         :param last_proof: <int> Previous proof
         :param proof: <int> Current proof
         :param last_hash: <str> The hash of the previous block
+        :param difficulty: <int> Number of leading zeroes the proof's hash needs
         :return: <bool> True if correct, False if not.
         """
-        guess = f'{last_proof}{proof}{last_hash}'.encode()
-        guess_hash = hashlib.sha256(guess).hexdigest()
-        return guess_hash[:4] == "0000"
+        return miner.valid_proof(last_proof, proof, last_hash, difficulty)
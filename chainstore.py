@@ -0,0 +1,236 @@
+# Authors: Sam Champer, Andi Nosler
+# Append-only on-disk storage of a node's chain, so a restarted node doesn't
+# have to download and re-validate the whole election from its peers.
+
+import json
+import os
+import struct
+import wireformat
+from blockchain import Blockchain
+
+# Each block in the log is its length as a 4 byte big endian integer, followed by the block
+# in the compact binary encoding of wireformat.
+RECORD_HEADER = struct.Struct('>I')
+# Each entry of the index is the offset of a block in the log as an 8 byte big endian
+# integer, followed by the 32 byte SHA-256 hash of the block.
+INDEX_ENTRY = struct.Struct('>Q32s')
+
+
+class ChainStore:
+    def __init__(self, directory, snapshot_interval=1000):
+        """
+        Constructor. Open (or create) a chain store in a directory.
+        :param directory: The directory holding the store's files.
+        :param snapshot_interval: Number of blocks between snapshots of the wallets and transaction index.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.log_path = os.path.join(directory, 'blocks.log')
+        self.index_path = os.path.join(directory, 'blocks.idx')
+        self.snapshot_path = os.path.join(directory, 'snapshot.json')
+        self.snapshot_interval = snapshot_interval
+        self.offsets = []
+        self.hashes = []
+        self.load_index()
+        snapshot = self.load_snapshot()
+        # Length of the chain when the latest snapshot was taken.
+        self.snapshot_length = snapshot['length'] if snapshot else 0
+        self.log = open(self.log_path, 'ab')
+        self.index = open(self.index_path, 'ab')
+
+    def load_index(self):
+        """
+        Read the index, dropping any entries or log data left incomplete by a crash.
+        """
+        if not os.path.exists(self.index_path) or not os.path.exists(self.log_path):
+            open(self.log_path, 'wb').close()
+            open(self.index_path, 'wb').close()
+            return
+        log_size = os.path.getsize(self.log_path)
+        log_end = 0
+        with open(self.index_path, 'rb') as f:
+            data = f.read()
+        with open(self.log_path, 'rb') as f:
+            for start in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+                offset, digest = INDEX_ENTRY.unpack_from(data, start)
+                f.seek(offset)
+                header = f.read(RECORD_HEADER.size)
+                if offset != log_end or len(header) < RECORD_HEADER.size:
+                    break
+                record_end = offset + RECORD_HEADER.size + RECORD_HEADER.unpack(header)[0]
+                if record_end > log_size:
+                    break
+                self.offsets.append(offset)
+                self.hashes.append(digest.hex())
+                log_end = record_end
+        os.truncate(self.log_path, log_end)
+        os.truncate(self.index_path, len(self.offsets) * INDEX_ENTRY.size)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def blocks(self):
+        """
+        Read every block in the store, in order.
+        :return: A generator of blocks.
+        """
+        with open(self.log_path, 'rb') as f:
+            for _ in range(len(self.offsets)):
+                size = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))[0]
+                yield wireformat.decode(f.read(size))
+
+    def append(self, block, block_hash):
+        """
+        Append a block to the store.
+        :param block: The block.
+        :param block_hash: The hash of the block, as a hex string.
+        """
+        data = wireformat.encode(block)
+        offset = self.log.tell()
+        self.log.write(RECORD_HEADER.pack(len(data)) + data)
+        self.log.flush()
+        self.index.write(INDEX_ENTRY.pack(offset, bytes.fromhex(block_hash)))
+        self.index.flush()
+        self.offsets.append(offset)
+        self.hashes.append(block_hash)
+
+    def truncate(self, length):
+        """
+        Drop every block from index 'length' onward, e.g. when part of the chain is replaced.
+        A snapshot taken after that point no longer matches the chain, so it is dropped too.
+        :param length: The number of blocks to keep.
+        """
+        if length >= len(self.offsets):
+            return
+        log_size = self.offsets[length]
+        del self.offsets[length:]
+        del self.hashes[length:]
+        self.log.close()
+        self.index.close()
+        os.truncate(self.log_path, log_size)
+        os.truncate(self.index_path, length * INDEX_ENTRY.size)
+        self.log = open(self.log_path, 'ab')
+        self.index = open(self.index_path, 'ab')
+        if os.path.exists(self.snapshot_path) and self.load_snapshot() is None:
+            os.remove(self.snapshot_path)
+            self.snapshot_length = 0
+
+    def snapshot_due(self, length):
+        """
+        :param length: The length of the chain.
+        :return: True if the chain has grown by snapshot_interval blocks since the latest snapshot.
+        """
+        return length - self.snapshot_length >= self.snapshot_interval
+
+    def save_snapshot(self, length, wallets, total_value, transaction_index):
+        """
+        Save the state of the chain after its first 'length' blocks.
+        The snapshot is written to a temporary file first, so a crash never leaves half of one.
+        :param length: The number of blocks the state covers.
+        :param wallets: The wallets.
+        :param total_value: The total value of the chain.
+        :param transaction_index: The transaction index, a Counter of (timestamp, sender, recipient) keys.
+        """
+        snapshot = {
+            'length': length,
+            'tip_hash': self.hashes[length - 1],
+            'wallets': wallets,
+            'total_value': total_value,
+            'transactions': [list(key) + [count] for key, count in transaction_index.items()],
+        }
+        temporary_path = self.snapshot_path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(temporary_path, self.snapshot_path)
+        self.snapshot_length = length
+
+    def load_snapshot(self):
+        """
+        Read the latest snapshot, if it matches the blocks in the store.
+        :return: The snapshot as a dictionary, or None.
+        """
+        if not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+        except ValueError:
+            return None
+        length = snapshot.get('length', 0)
+        if not 0 < length <= len(self.hashes) or self.hashes[length - 1] != snapshot.get('tip_hash'):
+            return None
+        return snapshot
+
+    def close(self):
+        self.log.close()
+        self.index.close()
+
+
+class ChainReader:
+    def __init__(self, directory):
+        """
+        Constructor. Read a chain store that another process writes to, picking up blocks as they are
+        appended. Nothing is ever written, so any number of readers can follow one writer.
+        :param directory: The directory holding the store's files.
+        """
+        self.log_path = os.path.join(directory, 'blocks.log')
+        self.index_path = os.path.join(directory, 'blocks.idx')
+        self.offsets = []
+        self.hashes = []
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def read_entries(self, f, start, stop):
+        f.seek(start * INDEX_ENTRY.size)
+        data = f.read((stop - start) * INDEX_ENTRY.size)
+        return [INDEX_ENTRY.unpack_from(data, position)
+                for position in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size)]
+
+    def refresh(self):
+        """
+        Read the blocks written since the last refresh. The writer only truncates the store to replace
+        blocks, so if the entry of the last block read is unchanged, every block before it is too.
+        Otherwise the whole index is read again to find the first block that changed.
+        Index entries are written after their blocks, so every block with a whole entry is complete.
+        Each block read is checked against the hash in its entry, in case the writer replaced it
+        between the index and the log being read.
+        :return: None if nothing changed, else a tuple of the index of the first new or changed block,
+                 and the blocks and hashes from that index on.
+        """
+        try:
+            entries = os.path.getsize(self.index_path) // INDEX_ENTRY.size
+        except OSError:
+            return None
+        known = len(self.offsets)
+        with open(self.index_path, 'rb') as f:
+            last = self.read_entries(f, known - 1, known) if known else []
+            if known and entries >= known and last == [(self.offsets[-1], bytes.fromhex(self.hashes[-1]))]:
+                start = known
+                new_entries = self.read_entries(f, known, entries)
+            else:
+                new_entries = self.read_entries(f, 0, entries)
+                start = 0
+                while (start < min(known, len(new_entries))
+                       and new_entries[start] == (self.offsets[start], bytes.fromhex(self.hashes[start]))):
+                    start += 1
+                new_entries = new_entries[start:]
+        if start == known and not new_entries:
+            return None
+        blocks = []
+        try:
+            with open(self.log_path, 'rb') as f:
+                for offset, digest in new_entries:
+                    f.seek(offset)
+                    size = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))[0]
+                    block = wireformat.decode(f.read(size))
+                    if Blockchain.hash(block) != digest.hex():
+                        return None
+                    blocks.append(block)
+        except (OSError, struct.error, ValueError, TypeError):
+            # The writer truncated or rewrote the log while it was being read. The next refresh will catch up.
+            return None
+        del self.offsets[start:]
+        del self.hashes[start:]
+        self.offsets.extend(offset for offset, _ in new_entries)
+        self.hashes.extend(digest.hex() for _, digest in new_entries)
+        return start, blocks, self.hashes[start:]
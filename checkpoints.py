@@ -0,0 +1,70 @@
+# Authors: Sam Champer, Andi Nosler
+# Signed checkpoints of a chain. A checkpoint names the length of a chain, the hash of its last block
+# and a digest of the wallets at that point, signed by the node that published it. A new node that
+# trusts the publisher's key can start from a snapshot of the chain at the checkpoint, and only has
+# to validate the blocks after it.
+
+import hashlib
+import json
+from time import time
+import cryptfuncs
+
+
+def state_digest(wallets, total_value):
+    """
+    Digest of the wallets and total value of a chain. The wallets are hashed one at a time,
+    in order of their owners, so the digest doesn't depend on the order they were filled in.
+    :param wallets: The wallets.
+    :param total_value: The total value of the chain.
+    :return: The SHA-256 digest, as a hex string.
+    """
+    digest = hashlib.sha256(json.dumps(total_value).encode())
+    for owner in sorted(wallets):
+        digest.update(json.dumps([owner, wallets[owner]]).encode())
+    return digest.hexdigest()
+
+
+def checkpoint_message(checkpoint):
+    """
+    The content of a checkpoint that is signed: everything but the signature.
+    :param checkpoint: A checkpoint.
+    :return: A string.
+    """
+    unsigned = {key: value for key, value in checkpoint.items() if key != 'signature'}
+    return json.dumps(unsigned, sort_keys=True)
+
+
+def new_checkpoint(length, tip_hash, wallets, total_value, signing_key):
+    """
+    Sign a checkpoint of a chain.
+    :param length: The number of blocks the checkpoint covers.
+    :param tip_hash: The hash of the last of those blocks.
+    :param wallets: The wallets after those blocks.
+    :param total_value: The total value of those blocks.
+    :param signing_key: Private RsaKey to sign the checkpoint with.
+    :return: The checkpoint, as a dictionary.
+    """
+    checkpoint = {
+        'length': length,
+        'tip_hash': tip_hash,
+        'state_digest': state_digest(wallets, total_value),
+        'total_value': total_value,
+        'timestamp': time(),
+    }
+    checkpoint['signature'] = cryptfuncs.sign(checkpoint_message(checkpoint), signing_key).hex()
+    return checkpoint
+
+
+def valid_checkpoint(checkpoint, trusted_keys):
+    """
+    Check that a checkpoint is signed by one of the trusted keys.
+    :param checkpoint: A checkpoint.
+    :param trusted_keys: Public RsaKeys of the nodes whose checkpoints are trusted.
+    :return: True if it is, else false.
+    """
+    try:
+        signature = bytes.fromhex(checkpoint['signature'])
+        message = checkpoint_message(checkpoint)
+    except (TypeError, ValueError, KeyError, AttributeError):
+        return False
+    return any(cryptfuncs.verify(message, signature, key) for key in trusted_keys)
@@ -0,0 +1,229 @@
+# Authors: Sam Champer, Andi Nosler
+# Consensus rules that decide how a new block is sealed and how a sealed block is checked.
+# A Blockchain is given one of these, and every node in an election must use the same rules.
+
+import json
+from os import path
+import cryptfuncs
+from miner import Miner
+import miner
+from simplelog import log
+import metrics
+
+PROOF_OF_WORK_SECONDS = metrics.Histogram('proof_of_work_seconds', 'Time taken to mine a proof of work.',
+                                          buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+
+
+class ProofOfWork:
+    """
+    Blocks are sealed with a proof p' such that hash(pp'h) has a number of leading zeroes,
+    where p is the proof of the previous block and h is the hash of the previous block.
+    Each block records the difficulty it was mined at, which may be above the minimum.
+    """
+    name = "pow"
+
+    def __init__(self, difficulty=4, workers=1, mining_difficulty=None):
+        """
+        :param difficulty: Number of leading zeroes a proof's hash needs.
+        :param workers: Number of processes to mine with.
+        :param mining_difficulty: Number of leading zeroes this node mines its proofs with,
+                                  if it is to mine harder proofs than it needs to.
+        """
+        self.difficulty = difficulty
+        self.mining_difficulty = max(difficulty, mining_difficulty or difficulty)
+        self.miner = Miner(workers)
+
+    @PROOF_OF_WORK_SECONDS.time
+    def proof(self, last_block, last_hash):
+        """
+        Find the proof for the block following last_block.
+        :param last_block: <dict> last block
+        :param last_hash: <str> The hash of the last block
+        :return: <int> proof of work.
+        """
+        proof = self.miner.mine(last_block['proof'], last_hash, self.mining_difficulty)
+        log("MINED A PROOF AT {:.0f} HASHES/SEC.", self.miner.hash_rate)
+        return proof
+
+    def seal(self, block, proof):
+        """
+        Put the proof into a newly assembled block. Proofs of work are found before the block is.
+        The difficulty the proof was mined at is recorded in the block too.
+        :param block: The new block.
+        :param proof: The proof given by the proof function.
+        :return: The proof to store in the block.
+        """
+        block['difficulty'] = self.mining_difficulty
+        return proof
+
+    def valid_seal(self, last_block, block, last_hash):
+        """
+        Check the proof of a block, at the difficulty recorded in the block.
+        Blocks from before difficulties were recorded are checked at the minimum difficulty.
+        :param last_block: The block before the block to check.
+        :param block: The block to check.
+        :param last_hash: The hash of last_block.
+        :return: True if correct, False if not.
+        """
+        difficulty = block.get('difficulty', self.difficulty)
+        if not isinstance(difficulty, int) or difficulty < self.difficulty:
+            return False
+        return miner.valid_proof(last_block['proof'], block['proof'], last_hash, difficulty)
+
+    def valid_proof(self, last_proof, proof, last_hash):
+        """
+        Validates a proof of work at the minimum difficulty.
+        :param last_proof: <int> Previous proof
+        :param proof: <int> Current proof
+        :param last_hash: <str> The hash of the previous block
+        :return: <bool> True if correct, False if not.
+        """
+        return miner.valid_proof(last_proof, proof, last_hash, self.difficulty)
+
+
+class ProofOfAuthority:
+    """
+    Blocks are sealed by signing them with the private key of an election authority,
+    so there is nothing to compute before a block can be added. A block is valid if
+    it is signed by one of the trusted authorities.
+    """
+    name = "authority"
+
+    def __init__(self, authority_keys=(), signing_key=None):
+        """
+        :param authority_keys: Public keys of the trusted authorities, as strings.
+        :param signing_key: Private RsaKey this node seals blocks with. None if this node only validates.
+                            Its public key is trusted.
+        """
+        self.signing_key = signing_key
+        self.authority_keys = [cryptfuncs.import_key(key) for key in authority_keys]
+        if signing_key is not None:
+            self.authority_keys.append(cryptfuncs.get_public_key(signing_key))
+
+    @staticmethod
+    def block_message(block):
+        """
+        The content of a block that the authority signs: everything but the signature.
+        :param block: A block.
+        :return: A string.
+        """
+        unsealed = {key: value for key, value in block.items() if key != 'proof'}
+        return json.dumps(unsealed, sort_keys=True)
+
+    def proof(self, last_block, last_hash):
+        """
+        No work is needed. The block is signed once it is assembled.
+        """
+        return None
+
+    def seal(self, block, proof):
+        """
+        Sign a newly assembled block.
+        :param block: The new block.
+        :param proof: Unused.
+        :return: The signature to store in the block's proof, as a hex string.
+        """
+        if self.signing_key is None:
+            raise ValueError('This node has no authority key to seal blocks with')
+        return cryptfuncs.sign(self.block_message(block), self.signing_key).hex()
+
+    def valid_seal(self, last_block, block, last_hash):
+        """
+        Check that a block is signed by a trusted authority.
+        The block's previous_hash is part of what is signed, so the signature also covers its place on the chain.
+        :param last_block: The block before the block to check.
+        :param block: The block to check.
+        :param last_hash: The hash of last_block.
+        :return: True if correct, False if not.
+        """
+        try:
+            signature = bytes.fromhex(block['proof'])
+        except (TypeError, ValueError):
+            return False
+        message = self.block_message(block)
+        for key in self.authority_keys:
+            if cryptfuncs.verify(message, signature, key):
+                return True
+        return False
+
+
+def make_consensus(name, difficulty=4, authority_keys=(), signing_key=None, workers=1, mining_time=0):
+    """
+    Build the consensus rules selected on the command line.
+    :param name: "pow" or "authority".
+    :param difficulty: Number of leading zeroes of a proof of work.
+    :param authority_keys: Public keys of trusted authorities, as strings.
+    :param signing_key: Private RsaKey this node seals blocks with.
+    :param workers: Number of processes to mine proofs of work with.
+    :param mining_time: If set, mine proofs of work at the highest difficulty (at least 'difficulty')
+                        that takes this machine about this many seconds per block.
+    :return: A consensus object.
+    """
+    if name == ProofOfWork.name:
+        mining_difficulty = Miner(workers).calibrate(mining_time) if mining_time else None
+        return ProofOfWork(difficulty, workers, mining_difficulty)
+    if name == ProofOfAuthority.name:
+        return ProofOfAuthority(authority_keys, signing_key)
+    raise ValueError('Unknown consensus: {}'.format(name))
+
+
+def add_consensus_arguments(parser):
+    """
+    Add the command line arguments that select the consensus rules.
+    :param parser: An ArgumentParser.
+    """
+    parser.add_argument('-c', '--consensus', default=ProofOfWork.name,
+                        choices=[ProofOfWork.name, ProofOfAuthority.name],
+                        help='How blocks are sealed: proof of work, or signed by an election authority.')
+    parser.add_argument('-d', '--difficulty', default=4, type=int,
+                        help='Number of leading zeroes of a proof of work (default 4).')
+    parser.add_argument('-ak', '--authority_key', default=None, type=str,
+                        help='File with the private key this node signs blocks with in authority mode.')
+    parser.add_argument('-ta', '--trusted_authority', default=[], type=str, action='append',
+                        help='File with the public key of another trusted authority. Can be given more than once.')
+    parser.add_argument('-mw', '--mining_workers', default=1, type=int,
+                        help='Number of processes to mine proofs of work with (default 1).')
+    parser.add_argument('-mt', '--mining_time', default=0, type=float,
+                        help='Mine at the highest difficulty (at least -d) that takes this machine about '
+                             'this many seconds per block. 0 mines at -d (default).')
+
+
+def load_private_key(key_file, create=False):
+    """
+    Read a private key from a file.
+    :param key_file: Path of the file.
+    :param create: If True and the file doesn't exist, it is created with a new key,
+                   and its public key is saved next to it with a '.pub' extension.
+    :return: The private RsaKey.
+    """
+    if create and not path.exists(key_file):
+        public, private = cryptfuncs.new_rsa(2048)
+        with open(key_file, 'w') as f:
+            f.write(private.export_key().decode())
+        with open(key_file + '.pub', 'w') as f:
+            f.write(public.export_key().decode())
+        print("   Created new key: {}".format(key_file))
+        return private
+    with open(key_file, 'r') as f:
+        return cryptfuncs.import_key(f.read())
+
+
+def consensus_from_args(args, create_key=False):
+    """
+    Build the consensus rules selected by the arguments added by add_consensus_arguments.
+    :param args: Parsed arguments.
+    :param create_key: If True, a missing authority key file is created with a new key,
+                       and its public key is saved next to it with a '.pub' extension.
+    :return: A consensus object.
+    """
+    signing_key = None
+    if args.consensus == ProofOfAuthority.name:
+        if not args.authority_key:
+            raise ValueError('Authority mode needs an authority key file (-ak).')
+        signing_key = load_private_key(args.authority_key, create_key)
+    authority_keys = []
+    for key_file in args.trusted_authority:
+        with open(key_file, 'r') as f:
+            authority_keys.append(f.read())
+    return make_consensus(args.consensus, args.difficulty, authority_keys, signing_key,
+                          max(1, args.mining_workers), max(0, args.mining_time))
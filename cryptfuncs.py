@@ -6,6 +6,12 @@ from Crypto.Cipher import PKCS1_OAEP
 from Crypto.Signature import PKCS1_v1_5
 from Crypto.Hash import SHA256
 from Crypto import Random
+from functools import lru_cache
+
+# Default maximum number of parsed keys kept by cached_import_key. Validating a chain touches two keys
+# per voter, so a node sizes the cache from its electorate with set_key_cache_size.
+KEY_CACHE_SIZE = 16384
+key_cache_size = KEY_CACHE_SIZE
 
 
 def new_rsa(keysize):
@@ -29,6 +35,44 @@ def import_key(key_string):
     return RSA.importKey(key_string.encode())
 
 
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def cached_import_key(key_string):
+    """
+    Convert a string of a key to a RSAKey object, reusing the result for
+    recently seen keys so that the same keys are not parsed over and over.
+    :param key_string: a string version of a key.
+    :return: An RsaKey object.
+    """
+    return import_key(key_string)
+
+
+def set_key_cache_size(size):
+    """
+    Change the number of parsed keys kept by cached_import_key. The cache is emptied.
+    :param size: The new maximum.
+    """
+    global cached_import_key, key_cache_size
+    if size == key_cache_size:
+        return
+    key_cache_size = size
+    cached_import_key = lru_cache(maxsize=size)(cached_import_key.__wrapped__)
+
+
+def key_cache_info():
+    """
+    Get the statistics of the parsed key cache.
+    :return: A named tuple of hits, misses, maxsize and currsize.
+    """
+    return cached_import_key.cache_info()
+
+
+def clear_key_cache():
+    """
+    Empty the parsed key cache and reset its statistics.
+    """
+    cached_import_key.cache_clear()
+
+
 def get_public_key(priv_key):
     """
     Get the public key associated with a private key.
@@ -5,10 +5,13 @@
 # This node is the only type of node that ever "mines" in an election. This node will
 # mine as many blocks as we want votes, and then be destroyed by a primary voting server.
 
-from os import path
+from os import path, cpu_count
 from flask import Flask, jsonify, request
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from time import time
 from blockchain import Blockchain
+from consensus import add_consensus_arguments, consensus_from_args
 from cryptfuncs import *
 from sys import platform
 
@@ -44,52 +47,136 @@ def no_other_nodes():
     return jsonify(dict()), 204
 
 
-def mine_votes(votes_per_participant):
+def key_file_path(vote_number):
     """
-    The app route to add a new coin/vote to the block.
+    Get the path of the file that holds the secret key for a vote.
+    :param vote_number: The number of the vote.
+    :return: The path of the key file.
     """
-    public, private = new_rsa(1024)
+    script_path = path.dirname(path.abspath(__file__))
+    if platform == "win32":
+        relative_path = "secret_keys\\key_{}.vote".format(vote_number)
+    else:
+        relative_path = "secret_keys/key_{}.vote".format(vote_number)
+    return path.join(script_path, relative_path)
 
+
+def add_vote_block(voter_key, votes_per_participant):
+    """
+    Mine a block holding the votes of one voter.
+    :param voter_key: The public key of the voter, as a string.
+    :param votes_per_participant: Number of votes the voter gets.
+    """
     # Associate the vote with the public key of the voter.
     # The sender is "0" to signify that this is a newly mined coin, not a transfer.
     blockchain.new_transaction(
         sender="0",
-        recipient=public.export_key().decode(),
+        recipient=voter_key,
         amount=votes_per_participant
     )
     # Run the proof of work algorithm to get the next proof:
     last_block = blockchain.last_block
     proof = blockchain.proof_of_work(last_block)
     # Adding the new block to the chain:
-    previous_hash = blockchain.hash(last_block)
+    previous_hash = blockchain.last_hash
     blockchain.new_block(proof, previous_hash)
 
-    script_path = path.dirname(path.abspath(__file__))
-    if platform == "win32":
-        relative_path = "secret_keys\\key_{}.vote".format(i+1)
-    else:
-        relative_path = "secret_keys/key_{}.vote".format(i+1)
-    final_path = path.join(script_path, relative_path)
-    with open(final_path, 'w') as f:
+
+def mine_votes(vote_number, votes_per_participant):
+    """
+    Generate a key pair for a voter, mine their vote and save their secret key.
+    :param vote_number: The number of the vote.
+    :param votes_per_participant: Number of votes the voter gets.
+    """
+    public, private = new_rsa(1024)
+    add_vote_block(public.export_key().decode(), votes_per_participant)
+    with open(key_file_path(vote_number), 'w') as f:
         f.write(private.export_key().decode())
 
 
+def new_key_strings(_):
+    """
+    Generate a key pair for a voter in a worker process.
+    :return: The public and private key, as strings.
+    """
+    public, private = new_rsa(1024)
+    return public.export_key().decode(), private.export_key().decode()
+
+
+def write_key_files(keys):
+    """
+    Save a batch of secret keys.
+    :param keys: A list of (vote number, private key string) pairs.
+    """
+    for vote_number, private in keys:
+        with open(key_file_path(vote_number), 'w') as f:
+            f.write(private)
+
+
+def bulk_mine_votes(num_votes, votes_per_participant, workers, batch_size):
+    """
+    Generate the key pairs for all voters across a pool of processes, mining each
+    vote block as its keys arrive and saving the secret keys in batches.
+    :param num_votes: Number of voters.
+    :param votes_per_participant: Number of votes each voter gets.
+    :param workers: Number of key generation processes.
+    :param batch_size: Number of secret keys written at a time.
+    """
+    start = time()
+    keys = []
+    chunksize = max(1, min(batch_size, num_votes // (workers * 4)))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        key_pairs = executor.map(new_key_strings, range(num_votes), chunksize=chunksize)
+        for vote_number, (public, private) in enumerate(key_pairs, start=1):
+            add_vote_block(public, votes_per_participant)
+            keys.append((vote_number, private))
+            if len(keys) >= batch_size or vote_number == num_votes:
+                write_key_files(keys)
+                keys = []
+                elapsed = time() - start
+                print("   Generated and mined {} of {} votes ({:.1f} keys/sec).".format(
+                    vote_number, num_votes, vote_number / elapsed))
+    elapsed = time() - start
+    print("\n   Set up {} votes in {:.1f} seconds: {:.1f} keys/sec with {} processes.".format(
+        num_votes, elapsed, num_votes / elapsed if elapsed else 0, workers))
+
+
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('-p', '--port', default=4999, type=int, help='port to listen on')
     parser.add_argument('-n', '--numvotes', default=10, type=int,
                         help='The number of votes generated for use in the election.')
+    parser.add_argument('-b', '--bulk', dest='bulk', action='store_true',
+                        help='Generate keys across a pool of processes. Much faster for large elections.')
+    parser.add_argument('-w', '--workers', default=cpu_count() or 1, type=int,
+                        help='Number of key generation processes in bulk mode (default: one per core).')
+    parser.add_argument('-bs', '--batch_size', default=500, type=int,
+                        help='Number of secret key files written at a time in bulk mode.')
+    parser.set_defaults(bulk=False)
     # parser.add_argument('-vpp', '--votes_per_person', default=1, type=int,
     #                     help='For elections where individuals can cast multiple votes.')
+    add_consensus_arguments(parser)
     args = parser.parse_args()
+    try:
+        blockchain.consensus = consensus_from_args(args, create_key=True)
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
     port = args.port
     num_votes = args.numvotes
     # votes_per_person = args.votes_per_person  # Might implement this at some future date.
     votes_per_person = 1
     print()
-    for i in range(num_votes):
-        print("   Generating unique key pair for voter number: {}".format(i + 1))
-        mine_votes(votes_per_person)
+    if args.bulk:
+        bulk_mine_votes(num_votes, votes_per_person, max(1, args.workers), max(1, args.batch_size))
+    else:
+        for i in range(num_votes):
+            print("   Generating unique key pair for voter number: {}".format(i + 1))
+            mine_votes(i + 1, votes_per_person)
+    miner = getattr(blockchain.consensus, 'miner', None)
+    if miner is not None and miner.seconds:
+        print("\n   Mined proofs of work at {:,.0f} hashes/sec with {} process(es).".format(
+            miner.hash_rate, miner.workers))
+        miner.close()
 
     # Initialize the app on the desired port:
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,100 @@
+# Authors: Sam Champer, Andi Nosler
+# Pool of transactions waiting to be sealed into a block.
+
+import threading
+from collections import Counter
+
+# Results of offering a transaction to the pool.
+ADMITTED = "admitted"
+DUPLICATE = "duplicate"
+POOL_FULL = "full"
+SENDER_LIMIT = "sender_limit"
+INVALID = "invalid"
+# The vote number is past the end of this node's chain, so the vote can't be checked until it catches up.
+BEHIND = "behind"
+
+
+class Mempool:
+    def __init__(self, max_size=10000, max_per_sender=1):
+        """
+        Constructor. Transactions are kept in the order they were admitted, keyed on their identity,
+        so a vote that arrives from several peers is only held, and later verified, once.
+        :param max_size: Most transactions held at once. Others are turned away until a block is sealed.
+        :param max_per_sender: Most transactions held at once from any one sender other than "0".
+                               Wallets aren't updated until a block is sealed, so a second vote from
+                               the same voter could otherwise be accepted.
+        """
+        self.max_size = max_size
+        self.max_per_sender = max_per_sender
+        self.lock = threading.Lock()
+        self.transactions = dict()
+        self.sender_counts = Counter()
+
+    @staticmethod
+    def identity(transaction):
+        """
+        The identity of a transaction in the pool. A vote can only be cast once, so cast votes
+        are identified by their voter and vote number, whatever their timestamp.
+        :param transaction: A transaction.
+        :return: A tuple.
+        """
+        if transaction['sender'] == "0":
+            return transaction['timestamp'], transaction['sender'], transaction['recipient']
+        return transaction['sender'], transaction['vote_number']
+
+    def add(self, transaction):
+        """
+        Admit a transaction to the pool.
+        :param transaction: A transaction.
+        :return: ADMITTED if it was added, DUPLICATE if it is already held, POOL_FULL if the pool is full,
+                 or SENDER_LIMIT if its sender already has max_per_sender transactions held.
+        """
+        identity = self.identity(transaction)
+        sender = transaction['sender']
+        with self.lock:
+            if identity in self.transactions:
+                return DUPLICATE
+            if len(self.transactions) >= self.max_size:
+                return POOL_FULL
+            if sender != "0" and self.sender_counts[sender] >= self.max_per_sender:
+                return SENDER_LIMIT
+            self.transactions[identity] = transaction
+            if sender != "0":
+                self.sender_counts[sender] += 1
+        return ADMITTED
+
+    def drain(self):
+        """
+        Take every transaction out of the pool, e.g. to seal them into a block.
+        :return: A list of the transactions, in the order they were admitted.
+        """
+        with self.lock:
+            transactions = list(self.transactions.values())
+            self.transactions = dict()
+            self.sender_counts = Counter()
+        return transactions
+
+    def discard(self, transactions):
+        """
+        Remove transactions that have been sealed into a block by someone else.
+        A held transaction is only removed if it is the same one, so a different vote
+        by the same voter stays until it is rejected when the next block is sealed.
+        :param transactions: The transactions.
+        """
+        with self.lock:
+            for transaction in transactions:
+                identity = self.identity(transaction)
+                if self.transactions.get(identity) == transaction:
+                    del self.transactions[identity]
+                    if transaction['sender'] != "0":
+                        self.sender_counts[transaction['sender']] -= 1
+
+    def __contains__(self, transaction):
+        return self.identity(transaction) in self.transactions
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.transactions.values()))
@@ -0,0 +1,158 @@
+# Authors: Sam Champer, Andi Nosler
+# Counters, gauges and latency histograms of a node, served in the Prometheus text format.
+# Recording is off until enable() is called, and costs a single flag check while it is off,
+# so the instrumentation can stay in the hot paths.
+
+import threading
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Upper bounds, in seconds, of the buckets latencies are counted in.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+enabled = False
+# Every metric, in the order they were defined.
+registry = []
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def format_labels(names, values):
+    pairs = list(zip(names, values))
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('"', '\\"')) for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, description, labels=()):
+        """
+        Constructor. A count that only goes up, registered to be served by render.
+        :param name: Name of the metric.
+        :param description: What it counts.
+        :param labels: Names of the labels the count is split by.
+        """
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = dict()
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        """
+        Add to the count, if metrics are enabled.
+        :param label_values: A value for each label.
+        :param amount: How much to add.
+        """
+        if not enabled:
+            return
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} counter'.format(self.name)]
+        with self.lock:
+            values = dict(self.values)
+        if not values and not self.labels:
+            values[()] = 0
+        for label_values, value in sorted(values.items()):
+            lines.append('{}{} {}'.format(self.name, format_labels(self.labels, label_values), value))
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, description, read):
+        """
+        Constructor. A value that can go up and down, read when the metrics are served.
+        :param name: Name of the metric.
+        :param description: What it measures.
+        :param read: Function returning the current value.
+        """
+        self.name = name
+        self.description = description
+        self.read = read
+        registry.append(self)
+
+    def render(self):
+        return ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} gauge'.format(self.name),
+                '{} {}'.format(self.name, self.read())]
+
+
+class Histogram:
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        """
+        Constructor. Counts of observed latencies by bucket, registered to be served by render.
+        :param name: Name of the metric.
+        :param description: What it measures.
+        :param buckets: Upper bounds of the buckets, in ascending order.
+        """
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        # One count per bucket, plus one for latencies above the last bucket.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value):
+        """
+        Record a latency, if metrics are enabled.
+        :param value: The latency in seconds.
+        """
+        if not enabled:
+            return
+        bucket = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.sum += value
+
+    def time(self, func):
+        """
+        Decorator recording how long each call of a function takes. Calls that raise are recorded too.
+        While metrics are disabled, the function is called without being timed.
+        """
+        @wraps(func)
+        def timed(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.observe(perf_counter() - start)
+        return timed
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} histogram'.format(self.name)]
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, bound, cumulative))
+        lines.append('{}_sum {}'.format(self.name, total))
+        lines.append('{}_count {}'.format(self.name, cumulative))
+        return lines
+
+
+def render():
+    """
+    Render every metric in the Prometheus text format.
+    :return: A string.
+    """
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
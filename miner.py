@@ -0,0 +1,147 @@
+# Authors: Sam Champer, Andi Nosler
+# Proof of work mining, spread across worker processes.
+# A proof p' for a block is a number such that sha256(pp'h) starts with a number of zeroes (in hex),
+# where p is the proof of the previous block and h is the hash of the previous block.
+
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from math import log
+from time import perf_counter
+
+# Proofs each worker checks per task. Small enough that an easy proof is found quickly,
+# large enough that handing out tasks costs little.
+CHUNK_SIZE = 50000
+
+
+def proof_hash(last_proof, proof, last_hash):
+    """
+    :return: The SHA-256 digest that a proof of work is checked against.
+    """
+    return hashlib.sha256(f'{last_proof}{proof}{last_hash}'.encode()).digest()
+
+
+def meets_difficulty(digest, difficulty):
+    """
+    Check that a digest starts with 'difficulty' zeroes in hex, by comparing its bytes
+    rather than formatting it as hex.
+    :param digest: A SHA-256 digest.
+    :param difficulty: Number of leading hex zeroes.
+    :return: True if it does, else false.
+    """
+    if difficulty > 2 * len(digest):
+        return False
+    zero_bytes, half_byte = divmod(difficulty, 2)
+    if any(digest[:zero_bytes]):
+        return False
+    return not half_byte or digest[zero_bytes] < 16
+
+
+def valid_proof(last_proof, proof, last_hash, difficulty):
+    """
+    Validates a proof of work.
+    :param last_proof: Previous proof.
+    :param proof: Current proof.
+    :param last_hash: The hash of the previous block.
+    :param difficulty: Number of leading hex zeroes the proof's hash needs.
+    :return: True if correct, False if not.
+    """
+    return meets_difficulty(proof_hash(last_proof, proof, last_hash), difficulty)
+
+
+def search(last_proof, last_hash, difficulty, start, stop):
+    """
+    Look for a proof among the numbers from start up to stop. The hash of the previous proof,
+    which starts every guess, is computed once and copied for each guess.
+    This is a module level function so that it can be run in worker processes.
+    :return: The smallest proof in the range, or None if there isn't one.
+    """
+    prefix = hashlib.sha256(f'{last_proof}'.encode())
+    suffix = f'{last_hash}'.encode()
+    zero_bytes, half_byte = divmod(difficulty, 2)
+    zeroes = bytes(zero_bytes)
+    for proof in range(start, stop):
+        guess = prefix.copy()
+        guess.update(str(proof).encode())
+        guess.update(suffix)
+        digest = guess.digest()
+        if digest[:zero_bytes] == zeroes and (not half_byte or digest[zero_bytes] < 16):
+            return proof
+    return None
+
+
+class Miner:
+    def __init__(self, workers=1):
+        """
+        Constructor.
+        :param workers: Number of processes to mine with. 1 mines in this process.
+                        They are started with spawn rather than fork, since a node first mines
+                        from a request thread, and a forked child could inherit a lock another thread holds.
+        """
+        self.workers = max(1, workers)
+        self.executor = None
+        # Hashes computed and seconds spent mining so far.
+        self.hashes = 0
+        self.seconds = 0.0
+
+    @property
+    def hash_rate(self):
+        """
+        :return: Hashes per second computed so far, or 0 before anything has been mined.
+        """
+        return self.hashes / self.seconds if self.seconds else 0
+
+    def mine(self, last_proof, last_hash, difficulty):
+        """
+        Find the smallest proof that follows last_proof. The numbers are split into chunks,
+        and each round every worker searches one. The lowest chunk holding a proof is used,
+        so the proof found is the same however many workers there are.
+        :param last_proof: The proof of the previous block.
+        :param last_hash: The hash of the previous block.
+        :param difficulty: Number of leading hex zeroes the proof's hash needs.
+        :return: The proof.
+        """
+        start_time = perf_counter()
+        start = 0
+        proof = None
+        while proof is None:
+            starts = [start + i * CHUNK_SIZE for i in range(self.workers)]
+            if self.workers == 1:
+                results = [search(last_proof, last_hash, difficulty, starts[0], starts[0] + CHUNK_SIZE)]
+            else:
+                if self.executor is None:
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                        mp_context=multiprocessing.get_context('spawn'))
+                futures = [self.executor.submit(search, last_proof, last_hash, difficulty, chunk, chunk + CHUNK_SIZE)
+                           for chunk in starts]
+                results = [future.result() for future in futures]
+            found = [result for result in results if result is not None]
+            if found:
+                proof = found[0]
+                # Chunks above the one holding the proof are counted as searched in full.
+                self.hashes += proof - start + 1 + CHUNK_SIZE * (len(results) - results.index(proof) - 1)
+            else:
+                self.hashes += CHUNK_SIZE * self.workers
+            start += CHUNK_SIZE * self.workers
+        self.seconds += perf_counter() - start_time
+        return proof
+
+    def calibrate(self, seconds=1.0, duration=0.5):
+        """
+        Find the highest difficulty this miner can expect to mine a block at in about 'seconds' seconds,
+        by timing a search that can't succeed for about 'duration' seconds.
+        :return: The difficulty.
+        """
+        tried = 0
+        start_time = perf_counter()
+        while perf_counter() - start_time < duration:
+            search('calibration', 'calibration', 64, tried, tried + CHUNK_SIZE // 10)
+            tried += CHUNK_SIZE // 10
+        rate = tried / (perf_counter() - start_time) * self.workers
+        # A proof takes 16 ** difficulty hashes on average.
+        return max(1, int(log(rate * seconds, 16))) if rate * seconds > 1 else 1
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,133 @@
+# Authors: Sam Champer, Andi Nosler
+# Background delivery of messages from this node to its peers, so that
+# request threads never wait on the network.
+
+import threading
+from queue import Queue, Empty, Full
+from time import sleep
+import requests
+from simplelog import log, WARNING
+
+
+class Outbox:
+    def __init__(self, session, max_attempts=4, backoff=0.5, timeout=(3, 10), max_queued=1000):
+        """
+        Constructor. Each peer gets its own queue and delivery thread, so a slow or dead
+        peer only delays messages to itself, and messages reach each peer in order.
+        :param session: The requests.Session messages are posted with.
+        :param max_attempts: Attempts to deliver a message before it is dropped.
+        :param backoff: Seconds to wait before the first retry. Doubles with every retry.
+        :param timeout: Connect and read timeout of each attempt.
+        :param max_queued: Messages each peer can have waiting. Once full, its oldest message is dropped.
+        """
+        self.session = session
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_queued = max_queued
+        self.queues = dict()
+        # Messages queued or being delivered, per peer.
+        self.pending = dict()
+        # Messages dropped after running out of attempts, or to make room in a full queue, per peer.
+        self.dropped = dict()
+        self.lock = threading.Lock()
+
+    def send(self, node, route, payload):
+        """
+        Queue a message for a peer and return immediately.
+        :param node: Address of the peer. Eg. '192.168.0.5:5000'
+        :param route: The route to post to. Eg. '/block/'
+        :param payload: The JSON body to post.
+        """
+        with self.lock:
+            queue = self.queues.get(node)
+            if queue is None:
+                queue = self.queues[node] = Queue(self.max_queued)
+                self.pending[node] = 0
+                self.dropped[node] = 0
+                threading.Thread(target=self.deliver, args=(node, queue), daemon=True).start()
+            while True:
+                try:
+                    queue.put_nowait((route, payload))
+                    break
+                except Full:
+                    pass
+                try:
+                    queue.get_nowait()
+                except Empty:
+                    # The delivery thread took a message in the meantime.
+                    continue
+                self.pending[node] -= 1
+                self.dropped[node] += 1
+            self.pending[node] += 1
+
+    def remove(self, node):
+        """
+        Stop delivering to a peer, dropping the messages it has waiting.
+        :param node: Address of the peer.
+        """
+        with self.lock:
+            queue = self.queues.pop(node, None)
+            if queue is None:
+                return
+            del self.pending[node]
+            del self.dropped[node]
+            while True:
+                try:
+                    queue.get_nowait()
+                except Empty:
+                    break
+            # Wakes the delivery thread so it stops.
+            queue.put_nowait(None)
+
+    def broadcast(self, nodes, route, payload):
+        """
+        Queue a message for every peer in nodes.
+        :param nodes: Addresses of the peers.
+        :param route: The route to post to.
+        :param payload: The JSON body to post.
+        """
+        for node in list(nodes):
+            self.send(node, route, payload)
+
+    def backlog(self):
+        """
+        Get the number of messages each peer has waiting.
+        :return: A dictionary of peer address -> number of messages queued or being delivered.
+        """
+        with self.lock:
+            return dict(self.pending)
+
+    def deliver(self, node, queue):
+        """
+        Delivery loop of one peer. Posts its messages one at a time, retrying
+        with exponential backoff, and drops a message once it runs out of attempts.
+        Stops when the peer is removed.
+        :param node: Address of the peer.
+        :param queue: The peer's queue.
+        """
+        while True:
+            message = queue.get()
+            if message is None:
+                break
+            route, payload = message
+            delivered = False
+            for attempt in range(self.max_attempts):
+                try:
+                    response = self.session.post("http://" + node + route, json=payload, timeout=self.timeout)
+                    if response:
+                        delivered = True
+                        break
+                except requests.RequestException:
+                    pass
+                if attempt < self.max_attempts - 1:
+                    sleep(self.backoff * 2 ** attempt)
+            with self.lock:
+                if self.queues.get(node) is not queue:
+                    # The peer was removed while the message was being delivered.
+                    break
+                self.pending[node] -= 1
+                if not delivered:
+                    self.dropped[node] += 1
+            if not delivered:
+                log("GAVE UP DELIVERING {} TO {}", route, node, level=WARNING)
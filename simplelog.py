@@ -1,15 +1,161 @@
 # Sam Champer
-# Very simply logger.
+# Very simple logger, with levels. Records are put on a queue and written by a background thread,
+# so logging never makes a request thread wait on stdout. If the writer falls behind and the queue
+# fills, new records are dropped and counted instead. Messages are only formatted,
+# on the writer thread, if their level is being logged:
+#   log("ADDED BLOCK {} FROM PEER.", index)
+#   log("GAVE UP DELIVERING {} TO {}", route, node, level=WARNING)
+# Keyword arguments, and any fields bound to the current thread with set_context
+# (e.g. the id of the request or vote being handled), are added to the record.
+
+import atexit
+import json
+import sys
+import threading
+from queue import Queue, Full
+from time import time
+
+__all__ = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'init_logger', 'stop_logger', 'log', 'debug', 'info',
+           'warning', 'error', 'set_context', 'clear_context', 'logging']
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+# Above every level, so nothing is logged until init_logger is called.
+OFF = 100
 
 logging = False
+# Lowest level being logged.
+threshold = OFF
+json_records = False
+stream = None
+records = None
+writer = None
+# Records dropped because the queue was full.
+dropped = 0
+dropped_lock = threading.Lock()
+# Fields added to every record logged from a thread, such as the request it is handling.
+context = threading.local()
 
 
-def init_logger():
-    global logging
+def init_logger(min_level=DEBUG, json_format=False, output=None, max_records=10000):
+    """
+    Start logging.
+    :param min_level: Lowest level to log. Records below it cost a single comparison.
+    :param json_format: Write each record as a line of JSON instead of text.
+    :param output: File to write to (default stdout).
+    :param max_records: Most records waiting to be written. Records logged while it is full are dropped.
+    """
+    global logging, threshold, json_records, stream, records, writer
+    stop_logger()
+    json_records = json_format
+    stream = output
+    records = Queue(max_records)
+    writer = threading.Thread(target=write_records, args=(records,), daemon=True)
+    writer.start()
+    threshold = min_level
     logging = True
 
 
-def log(*args, **kwargs):
-    if logging:
-        print("   LOG::", end="")
-        print(*args, **kwargs)
+def stop_logger():
+    """
+    Stop logging, once every record already logged has been written.
+    """
+    global logging, threshold, records, writer
+    if writer is None:
+        return
+    threshold = OFF
+    logging = False
+    records.put(None)
+    writer.join()
+    records = writer = None
+
+
+atexit.register(stop_logger)
+
+
+def format_record(record):
+    timestamp, record_level, message, args, fields = record
+    if args:
+        # Messages written for the old print-style log, with several parts, are joined as print would.
+        message = message.format(*args) if '{' in message else ' '.join(map(str, (message,) + args))
+    if json_records:
+        return json.dumps(dict(fields, time=timestamp, level=LEVEL_NAMES.get(record_level, record_level),
+                               message=message), default=str)
+    extra = ''.join(' {}={}'.format(key, value) for key, value in fields.items())
+    return "   LOG::{}{}".format(message, extra)
+
+
+def write_records(queue):
+    """
+    Write records from the queue until it gives None. Runs on the writer thread.
+    Once it catches up, it reports how many records were dropped while it was behind.
+    """
+    reported = dropped
+    while True:
+        record = queue.get()
+        if record is not None:
+            try:
+                print(format_record(record), file=stream or sys.stdout, flush=queue.empty())
+            except Exception as e:
+                # A record that can't be formatted mustn't stop the ones after it.
+                print("   LOG::UNWRITABLE RECORD {!r}: {}".format(record[2], e), file=stream or sys.stdout)
+        if dropped != reported and queue.empty():
+            print("   LOG::DROPPED {} RECORDS WHILE THE LOG WAS FULL.".format(dropped - reported),
+                  file=stream or sys.stdout, flush=True)
+            reported = dropped
+        if record is None:
+            break
+
+
+def log(message, *args, level=DEBUG, **fields):
+    """
+    Log a message, if its level is being logged.
+    :param message: The message, with {} for each of args.
+    :param args: Values formatted into the message by the writer thread.
+                 They should not be changed after being logged.
+    :param level: DEBUG, INFO, WARNING or ERROR.
+    :param fields: Extra fields for the record.
+    """
+    if level < threshold:
+        return
+    bound = getattr(context, 'fields', None)
+    if bound:
+        fields = dict(bound, **fields)
+    global dropped
+    queue = records
+    if queue is not None:
+        try:
+            queue.put_nowait((time(), level, message, args, fields))
+        except Full:
+            with dropped_lock:
+                dropped += 1
+
+
+def debug(message, *args, **fields):
+    log(message, *args, level=DEBUG, **fields)
+
+
+def info(message, *args, **fields):
+    log(message, *args, level=INFO, **fields)
+
+
+def warning(message, *args, **fields):
+    log(message, *args, level=WARNING, **fields)
+
+
+def error(message, *args, **fields):
+    log(message, *args, level=ERROR, **fields)
+
+
+def set_context(**fields):
+    """
+    Add fields to every record logged from this thread, until clear_context is called.
+    """
+    context.fields = dict(getattr(context, 'fields', None) or {}, **fields)
+
+
+def clear_context():
+    context.fields = None
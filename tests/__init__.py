@@ -0,0 +1,37 @@
+# Helpers shared by the test suites.
+
+import vote_manager_node
+from blockchain import Blockchain
+
+# The vote_manager_node globals tests replace, restored by keep_node_globals.
+NODE_GLOBALS = ('blockchain', 'block_interval', 'vote_receipts', 'pending_receipts', 'MAX_VOTE_RECEIPTS',
+                'store_reader', 'writer_address', 'store_refresh_interval', 'results_max_age', 'last_store_refresh')
+
+
+def clone_chain(blockchain, clone=None, length=None):
+    """
+    Copy a blockchain's blocks onto another node, validated as a peer's chain would be.
+    :param blockchain: The Blockchain to copy.
+    :param clone: The Blockchain to copy onto. A new one with the same consensus if None.
+    :param length: Number of blocks to copy. All of them if None.
+    :return: The clone.
+    """
+    if clone is None:
+        clone = Blockchain(blockchain.consensus)
+    valid, state = clone.valid_chain_extension(list(blockchain.chain[:length]), 0)
+    assert valid
+    clone.adopt_chain(*state)
+    return clone
+
+
+def keep_node_globals(test_case):
+    """
+    Restore vote_manager_node's globals once a test is done, whatever it replaced them with.
+    :param test_case: The running TestCase.
+    """
+    saved = {name: getattr(vote_manager_node, name) for name in NODE_GLOBALS}
+
+    def restore():
+        for name, value in saved.items():
+            setattr(vote_manager_node, name, value)
+    test_case.addCleanup(restore)
@@ -0,0 +1,89 @@
+# A suite of test functions that test the block producer mode of a node, and vote receipts.
+# Uses the python unittest test suite.
+
+from unittest import TestCase, mock
+import vote_manager_node
+from blockchain import Blockchain, BLOCK_ADDED
+from consensus import ProofOfWork
+from cryptfuncs import new_rsa
+from tests import clone_chain, keep_node_globals
+
+
+class TestBlockProducer(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.keys = []
+        for _ in range(2):
+            public, private = new_rsa(1024)
+            cls.keys.append((public.export_key().decode(), private.export_key().decode()))
+
+    def setUp(self):
+        keep_node_globals(self)
+        self.blockchain = Blockchain(ProofOfWork(difficulty=1))
+        for public, _ in self.keys:
+            self.blockchain.new_transaction(sender='0', recipient=public, amount=1)
+            self.blockchain.seal_block()
+        vote_manager_node.blockchain = self.blockchain
+        vote_manager_node.block_interval = 1000
+        vote_manager_node.vote_receipts = dict()
+        vote_manager_node.pending_receipts = dict()
+        self.client = vote_manager_node.app.test_client()
+
+    def vote(self, vote_number, candidate='candidate'):
+        return self.client.post('/vote/', data={'id': vote_number, 'key': self.keys[vote_number - 1][1],
+                                                'candidate': candidate}).get_json()
+
+    def status(self, receipt):
+        response = self.client.get('/vote/status/{}'.format(receipt))
+        return response.status_code, response.get_json()
+
+    def test_pending_then_confirmed(self):
+        answer = self.vote(1)
+        self.assertEqual(answer['status'], 'success')
+        self.assertTrue(answer['pending'])
+        self.assertEqual(self.status(answer['receipt']), (200, {'status': 'pending', 'block': None}))
+        block = vote_manager_node.seal_pending_block()
+        self.assertEqual(len(block['transactions']), 1)
+        self.assertEqual(self.status(answer['receipt']), (200, {'status': 'confirmed', 'block': block['index']}))
+        self.assertFalse(vote_manager_node.pending_receipts)
+
+    def test_second_pending_vote_fails(self):
+        self.assertEqual(self.vote(1)['status'], 'success')
+        self.assertEqual(self.vote(1, 'other')['status'], 'fail')
+        self.assertEqual(len(vote_manager_node.vote_receipts), 1)
+
+    def test_rejected_when_peer_seals_another_vote(self):
+        answer = self.vote(1)
+        # A peer seals a different vote by the same voter, and pushes us the block.
+        peer = clone_chain(self.blockchain)
+        public, private = self.keys[0]
+        assert peer.queue_transaction(peer.build_transaction(public, 'other', 1, private, 1))
+        block = peer.seal_block()
+        self.assertEqual(self.blockchain.add_block(block), BLOCK_ADDED)
+        # Our vote is the only one pending, so no block is sealed for it.
+        self.assertIsNone(vote_manager_node.seal_pending_block())
+        self.assertEqual(self.blockchain.chain[-1], block)
+        self.assertEqual(self.status(answer['receipt'])[1]['status'], 'rejected')
+
+    def test_unknown_receipt(self):
+        self.assertEqual(self.status('nonsense'), (404, {'status': 'unknown'}))
+
+    def test_oldest_receipts_dropped(self):
+        vote_manager_node.MAX_VOTE_RECEIPTS = 1
+        first = self.vote(1)['receipt']
+        second = self.vote(2)['receipt']
+        self.assertEqual(list(vote_manager_node.vote_receipts), [second])
+        self.assertEqual(self.status(first)[0], 404)
+        # The dropped vote is still sealed. Only its receipt is forgotten.
+        block = vote_manager_node.seal_pending_block()
+        self.assertEqual(len(block['transactions']), 2)
+        self.assertEqual(self.status(second)[1]['status'], 'confirmed')
+
+    def test_producer_survives_failed_seal(self):
+        self.vote(1)
+        with mock.patch.object(vote_manager_node, 'seal_pending_block', side_effect=TypeError("unhashable")):
+            self.assertIsNone(vote_manager_node.produce_block())
+        # The next round seals the vote as usual.
+        block = vote_manager_node.produce_block()
+        self.assertEqual(len(block['transactions']), 1)
+        self.assertIsNone(vote_manager_node.produce_block())
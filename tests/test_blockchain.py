@@ -4,8 +4,18 @@
 
 import hashlib
 import json
-from unittest import TestCase
-from blockchain import Blockchain
+from threading import Event, Thread
+from time import sleep, time
+from unittest import TestCase, mock
+import flask
+import requests
+import blockchain as blockchain_module
+from blockchain import Blockchain, BLOCK_ADDED, BLOCK_AHEAD, BLOCK_INVALID, BLOCK_KNOWN
+import vote_manager_node
+from consensus import ProofOfWork
+from cryptfuncs import new_rsa
+import wireformat
+from tests import clone_chain, keep_node_globals
 
 
 class BlockchainTestCase(TestCase):
@@ -82,3 +92,556 @@ class TestHashingAndProofs(BlockchainTestCase):
         new_hash = hashlib.sha256(new_block_json).hexdigest()
         assert len(new_hash) == 64
         assert new_hash == self.blockchain.hash(new_block)
+
+    def test_block_hash_cached_for_chain_blocks(self):
+        self.blockchain.new_transaction(sender='0', recipient='a', amount=1)
+        block = self.blockchain.seal_block()
+        assert self.blockchain.last_hash == self.blockchain.hash(block)
+        assert self.blockchain.block_hash(block) == self.blockchain.last_hash
+        # A copy isn't the block on the chain, so it is hashed rather than looked up.
+        altered = dict(block, timestamp=0)
+        assert self.blockchain.block_hash(altered) == self.blockchain.hash(altered)
+        # The block on the chain is looked up, not hashed again.
+        self.blockchain.block_hashes[-1] = 'cached'
+        assert self.blockchain.block_hash(block) == 'cached'
+
+    def test_block_hash_of_malformed_index(self):
+        for index in ('1', None, -1, 100):
+            block = {'index': index, 'transactions': []}
+            assert self.blockchain.block_hash(block) == self.blockchain.hash(block)
+
+
+class TestRedundantTransactions(BlockchainTestCase):
+    def test_index_updated_by_new_block(self):
+        self.create_transaction()
+        transaction = self.blockchain.current_transactions[-1]
+        self.create_block()
+        key = self.blockchain.transaction_key(transaction)
+        assert self.blockchain.transaction_index[key] == 1
+        assert self.blockchain.non_redundant_transaction(transaction, self.blockchain.chain,
+                                                         self.blockchain.transaction_index)
+
+    def test_duplicate_transaction_is_redundant(self):
+        self.create_transaction()
+        self.create_block()
+        transaction = self.blockchain.last_block['transactions'][0]
+        self.blockchain.last_block['transactions'].append(dict(transaction))
+        chain = self.blockchain.chain
+        assert not self.blockchain.non_redundant_transaction(transaction, chain)
+        assert not self.blockchain.chain_transactions_valid(chain)
+
+    def test_index_matches_chain_scan(self):
+        for recipient in ('a', 'b', 'c'):
+            self.create_transaction(recipient=recipient)
+            self.create_block()
+        index = self.blockchain.build_transaction_index(self.blockchain.chain)
+        assert index == self.blockchain.transaction_index
+        assert sum(index.values()) == 3
+
+
+class TestIncrementalValidation(BlockchainTestCase):
+    def mine_block(self, blockchain, recipient):
+        blockchain.new_transaction(sender='0', recipient=recipient, amount=1)
+        last_block = blockchain.last_block
+        proof = blockchain.proof_of_work(last_block)
+        blockchain.new_block(proof, blockchain.hash(last_block))
+
+    def setUp(self):
+        super().setUp()
+        for recipient in ('a', 'b'):
+            self.mine_block(self.blockchain, recipient)
+        self.peer = clone_chain(self.blockchain)
+
+    def test_full_adoption(self):
+        assert self.peer.chain == self.blockchain.chain
+        assert self.peer.block_hashes == self.blockchain.block_hashes
+        assert self.peer.wallets == {'0': -2, 'a': 1, 'b': 1}
+        assert self.peer.total_value == 2
+
+    def test_common_prefix(self):
+        self.mine_block(self.blockchain, 'c')
+        assert self.peer.common_prefix_length(self.blockchain.chain) == 3
+        assert Blockchain().common_prefix_length(self.blockchain.chain) == 0
+
+    def test_suffix_adoption_matches_full_validation(self):
+        self.mine_block(self.blockchain, 'c')
+        chain = list(self.blockchain.chain)
+        fork = self.peer.common_prefix_length(chain)
+        valid, state = self.peer.valid_chain_extension(chain, fork)
+        assert valid
+        self.peer.adopt_chain(*state)
+        assert self.peer.chain == chain
+        assert self.peer.block_hashes == self.blockchain.block_hashes
+        assert self.peer.wallets == self.blockchain.wallets
+        assert self.peer.transaction_index == self.peer.build_transaction_index(chain)
+        assert self.peer.valid_chain(self.peer.chain)
+
+    def test_tampered_suffix_rejected(self):
+        self.mine_block(self.blockchain, 'c')
+        chain = list(self.blockchain.chain)
+        chain[-1] = dict(chain[-1], proof=chain[-1]['proof'] + 1)
+        fork = self.peer.common_prefix_length(chain)
+        valid, state = self.peer.valid_chain_extension(chain, fork)
+        assert not valid
+        assert len(self.peer.chain) == 3
+
+    def test_diverged_chain_rolls_back(self):
+        self.mine_block(self.peer, 'x')
+        self.mine_block(self.blockchain, 'c')
+        self.mine_block(self.blockchain, 'd')
+        chain = list(self.blockchain.chain)
+        fork = self.peer.common_prefix_length(chain)
+        assert fork == 3
+        valid, state = self.peer.valid_chain_extension(chain, fork)
+        assert valid
+        self.peer.adopt_chain(*state)
+        assert self.peer.chain == chain
+        assert self.peer.balance_check('x') == 0
+        assert self.peer.balance_check('d') == 1
+        assert self.peer.total_value == 4
+        assert self.peer.transaction_index == self.peer.build_transaction_index(chain)
+
+    def test_unrelated_chain_replaces_ours(self):
+        # A longer chain sharing no blocks with ours, while ours holds transactions of its own.
+        self.mine_block(self.peer, 'x')
+        other = Blockchain()
+        for recipient in ('c', 'd', 'e', 'f'):
+            self.mine_block(other, recipient)
+        assert self.peer.common_prefix_length(other.chain) == 0
+        assert self.peer.adopt_longest_chain([(len(other.chain), list(other.chain), None)])
+        assert self.peer.wallets == other.wallets
+        assert self.peer.balance_check('x') == 0
+        assert self.peer.transaction_index == other.transaction_index
+
+    def test_malformed_chain_skipped(self):
+        self.mine_block(self.blockchain, 'c')
+        good = list(self.blockchain.chain)
+        bad_peer = clone_chain(self.blockchain)
+        for recipient in ('d', 'e'):
+            self.mine_block(bad_peer, recipient)
+        # The proof of work doesn't cover the transactions, so the last block stays validly sealed.
+        bad = list(bad_peer.chain)
+        bad[-1] = dict(bad[-1], transactions=[{'sender': '0', 'recipient': 'e', 'amount': 1}])
+        assert self.peer.adopt_longest_chain([(len(bad), bad, None), (len(good), good, None)])
+        assert self.peer.chain == good
+
+    def test_non_incremental_adoption(self):
+        self.mine_block(self.blockchain, 'c')
+        chain = list(self.blockchain.chain)
+        assert self.peer.adopt_longest_chain([(len(chain), chain, None)], incremental=False)
+        assert self.peer.wallets == self.blockchain.wallets
+        assert self.peer.total_value == 3
+
+
+class TestSignatureVerification(BlockchainTestCase):
+    def setUp(self):
+        super().setUp()
+        self.keys = [new_rsa(1024) for _ in range(3)]
+        for public, _ in self.keys:
+            self.create_transaction(recipient=public.export_key().decode())
+            self.create_block()
+        self.votes = []
+        for vote_number, (public, private) in enumerate(self.keys, start=1):
+            self.votes.append(self.blockchain.new_transaction(
+                sender=public.export_key().decode(),
+                recipient='candidate',
+                amount=1,
+                signature=private.export_key().decode(),
+                vote_number=vote_number
+            ))
+
+    def test_verification_is_cached(self):
+        vote = self.votes[0]
+        assert self.blockchain.valid_transaction(vote, self.blockchain.chain)
+        assert (vote['sender'], vote['signature'], 1) in self.blockchain.verified_signatures
+
+    def test_wrong_key_not_cached(self):
+        vote = dict(self.votes[0], signature=self.votes[1]['signature'])
+        assert not self.blockchain.valid_transaction(vote, self.blockchain.chain)
+        assert not self.blockchain.verified_signatures
+
+    def test_unhashable_fields_rejected(self):
+        votes = [dict(self.votes[0], signature=['not', 'a', 'key']), dict(self.votes[1], vote_number=[2])]
+        assert self.blockchain.verify_signatures(votes) == 0
+        for vote in votes:
+            assert not self.blockchain.valid_transaction(vote, self.blockchain.chain)
+
+    def test_cache_drops_oldest(self):
+        self.blockchain.max_verified_signatures = 2
+        assert self.blockchain.verify_signatures(self.votes) == 3
+        # A batch larger than the cache is kept whole until it has been validated.
+        assert len(self.blockchain.verified_signatures) == 3
+        self.blockchain.cache_verified([('voter', 'key', 4)])
+        assert len(self.blockchain.verified_signatures) == 2
+        assert ('voter', 'key', 4) in self.blockchain.verified_signatures
+
+    def test_batch_verification_in_worker_processes(self):
+        blockchain_module.PARALLEL_VERIFY_THRESHOLD = 1
+        self.blockchain.verify_workers = 2
+        try:
+            bad_vote = dict(self.votes[0], signature=self.votes[1]['signature'])
+            assert self.blockchain.verify_signatures(self.votes + [bad_vote]) == 3
+            assert self.blockchain.verify_signatures(self.votes) == 0
+        finally:
+            blockchain_module.PARALLEL_VERIFY_THRESHOLD = 64
+        self.create_block()
+        assert len(self.blockchain.last_block['transactions']) == 3
+        assert self.blockchain.chain_transactions_valid(self.blockchain.chain)
+
+
+class TestVoteIndex(TestCase):
+    def setUp(self):
+        self.blockchain = Blockchain(ProofOfWork(difficulty=1))
+        self.keys = []
+        for _ in range(2):
+            public, private = new_rsa(1024)
+            self.keys.append((public.export_key().decode(), private.export_key().decode()))
+            self.blockchain.new_transaction(sender='0', recipient=self.keys[-1][0], amount=1)
+            self.blockchain.seal_block()
+
+    def cast(self, blockchain, vote_number):
+        public, private = self.keys[vote_number - 1]
+        vote = blockchain.build_transaction(public, 'candidate', 1, private, vote_number)
+        assert blockchain.queue_transaction(vote)
+        blockchain.seal_block()
+        return vote
+
+    def test_issued_votes_indexed(self):
+        assert self.blockchain.get_transactor(1) == self.keys[0][0]
+        assert self.blockchain.get_transactor(2) == self.keys[1][0]
+        assert not self.blockchain.get_transactor(0)
+        assert not self.blockchain.get_transactor(3)
+        assert self.blockchain.unspent_votes[self.keys[0][0]] == 1
+
+    def test_cast_vote_is_spent(self):
+        vote = self.cast(self.blockchain, 1)
+        assert self.blockchain.unspent_votes[self.keys[0][0]] == 0
+        assert not self.blockchain.valid_balance(vote)
+        assert self.blockchain.get_transactor(1) == self.keys[0][0]
+        # A block holding a single cast vote doesn't issue a vote.
+        assert not self.blockchain.get_transactor(3)
+
+    def test_index_follows_adopted_chain(self):
+        peer = clone_chain(self.blockchain)
+        self.cast(peer, 2)
+        self.cast(self.blockchain, 1)
+        self.blockchain.new_transaction(sender='0', recipient='late voter', amount=1)
+        self.blockchain.seal_block()
+        chain = list(self.blockchain.chain)
+        valid, state = peer.valid_chain_extension(chain, peer.common_prefix_length(chain))
+        assert valid
+        peer.adopt_chain(*state)
+        assert peer.vote_keys == self.blockchain.vote_keys == peer.build_vote_keys(chain)
+        assert peer.unspent_votes == self.blockchain.unspent_votes
+        assert peer.unspent_votes[self.keys[1][0]] == 1
+
+
+class TestConcurrency(TestCase):
+    def test_concurrent_votes_are_sealed_exactly_once(self):
+        blockchain = Blockchain(ProofOfWork(difficulty=1))
+        threads, votes_per_thread = 8, 500
+
+        def vote(thread_number):
+            for i in range(votes_per_thread):
+                blockchain.new_transaction(sender='0', recipient='{}-{}'.format(thread_number, i), amount=1)
+                if i % 50 == 0:
+                    blockchain.seal_block()
+
+        workers = [Thread(target=vote, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        blockchain.seal_block()
+
+        recipients = [transaction['recipient'] for block in blockchain.chain for transaction in block['transactions']]
+        assert len(recipients) == threads * votes_per_thread
+        assert len(set(recipients)) == len(recipients)
+        assert not blockchain.current_transactions
+        assert blockchain.total_value == threads * votes_per_thread
+        assert blockchain.valid_chain(blockchain.chain)
+
+    def test_concurrent_vote_requests(self):
+        blockchain = Blockchain(ProofOfWork(difficulty=1))
+        keys = []
+        for _ in range(12):
+            public, private = new_rsa(1024)
+            keys.append(private.export_key().decode())
+            blockchain.new_transaction(sender='0', recipient=public.export_key().decode(), amount=1)
+            blockchain.seal_block()
+        keep_node_globals(self)
+        vote_manager_node.blockchain = blockchain
+        answers, heads, served = [], [], []
+        done = Event()
+
+        def vote(vote_number):
+            client = vote_manager_node.app.test_client()
+            answer = client.post('/vote/', data={'id': vote_number, 'key': keys[vote_number - 1], 'candidate': 'a'})
+            answers.append(answer.get_json()['status'])
+
+        def read():
+            client = vote_manager_node.app.test_client()
+            while not done.is_set():
+                head = client.get('/chain/head/').get_json()
+                heads.append((head['length'], head['hash']))
+                since = client.get('/chain/since/1').get_json()
+                served.append((since['length'], len(since['chain'])))
+
+        voters = [Thread(target=vote, args=(n,)) for n in range(1, len(keys) + 1)]
+        reader = Thread(target=read)
+        reader.start()
+        for voter in voters:
+            voter.start()
+        for voter in voters:
+            voter.join()
+        done.set()
+        reader.join()
+
+        assert answers == ['success'] * len(keys)
+        votes = [transaction['vote_number'] for block in blockchain.chain for transaction in block['transactions']
+                 if transaction['sender'] != '0']
+        assert sorted(votes) == list(range(1, len(keys) + 1))
+        assert blockchain.valid_chain(blockchain.chain)
+        # Every head served was the hash of the block at that length.
+        for length, block_hash in heads:
+            assert blockchain.block_hashes[length - 1] == block_hash
+        for length, blocks in served:
+            assert blocks == length - 1
+
+    def test_queue_transaction_refuses_second_pending_vote(self):
+        blockchain = Blockchain()
+        first = blockchain.build_transaction('voter', 'a', 1, 'key', 1)
+        second = blockchain.build_transaction('voter', 'b', 1, 'key', 1)
+        assert blockchain.queue_transaction(first)
+        assert not blockchain.queue_transaction(second)
+        assert blockchain.current_transactions == [first]
+
+
+class PeerResponse:
+    # Stands in for a requests response to a route served by the Flask test client.
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.get_data()
+        self.values = response.get_json()
+
+    def __bool__(self):
+        return self.status_code < 400
+
+    def json(self):
+        return self.values
+
+    def iter_content(self, chunk_size):
+        # Small chunks, so records arrive split across them.
+        for start in range(0, len(self.content), 7):
+            yield self.content[start:start + 7]
+
+    def close(self):
+        pass
+
+
+class TestPeerFetching(TestCase):
+    def setUp(self):
+        self.blockchain = Blockchain(ProofOfWork(difficulty=1))
+        for recipient in ('a', 'b', 'c'):
+            self.blockchain.new_transaction(sender='0', recipient=recipient, amount=1)
+            self.blockchain.seal_block()
+        self.peer = clone_chain(self.blockchain)
+        keep_node_globals(self)
+        vote_manager_node.blockchain = self.peer
+        self.client = vote_manager_node.app.test_client()
+        self.requested = []
+        self.delay = 0
+        self.blockchain.session.get = self.fake_get
+
+    def fake_get(self, url, headers=None, stream=False, timeout=None):
+        if 'dead' in url:
+            raise requests.ConnectionError()
+        sleep(self.delay)
+        route = url[url.index('/', len('http://')):]
+        self.requested.append(route)
+        return PeerResponse(self.client.get(route, headers=headers))
+
+    def test_peers_fetched_concurrently(self):
+        for i in range(8):
+            self.blockchain.register_node('http://192.168.0.{}:5000'.format(i))
+        self.delay = 0.2
+        start = time()
+        assert not self.blockchain.resolve_conflicts()
+        assert time() - start < 0.2 * 4
+        assert len(self.blockchain.nodes) == 8
+
+    def test_reads_published_view(self):
+        self.peer.new_transaction(sender='0', recipient='d', amount=1)
+        self.peer.seal_block()
+        # As if a new chain were half swapped in: its blocks in place, but not yet its hashes.
+        self.blockchain.chain = self.blockchain.chain[:2]
+        length, chain, hashes = self.blockchain.fetch_peer_chain('peer:5000')
+        assert self.requested == ['/chain/head/', '/chain/since/4']
+        assert hashes == self.peer.block_hashes
+
+    def test_length_of_wrong_type_ignored(self):
+        self.peer.new_transaction(sender='0', recipient='d', amount=1)
+        self.peer.seal_block()
+        self.blockchain.register_node('http://peer:5000')
+        head = {'chain_head': lambda: flask.jsonify({'length': '9', 'hash': self.peer.last_hash})}
+        with mock.patch.dict(vote_manager_node.app.view_functions, head):
+            assert self.blockchain.fetch_peer_chain('peer:5000') is None
+            assert not self.blockchain.resolve_conflicts()
+
+        def since(index):
+            records = [{'length': '9', 'start': index}] + self.peer.chain[index:]
+            return flask.Response(b''.join(map(wireformat.encode_json_record, records)),
+                                  mimetype=wireformat.JSON_STREAM_CONTENT_TYPE)
+        with mock.patch.dict(vote_manager_node.app.view_functions, {'chain_since': since}):
+            assert self.blockchain.fetch_peer_chain('peer:5000') is None
+            assert not self.blockchain.resolve_conflicts()
+        assert len(self.blockchain.chain) == 4
+
+    def test_dead_peer_removed(self):
+        self.blockchain.register_node('http://dead:5000')
+        with mock.patch('blockchain.PEER_BACKOFF', 0):
+            assert self.blockchain.fetch_peer_chain('dead:5000') is None
+        assert not self.blockchain.nodes
+
+    def test_up_to_date_peer_sends_only_its_head(self):
+        assert self.blockchain.fetch_peer_chain('peer:5000') is None
+        assert self.requested == ['/chain/head/']
+
+    def test_only_new_blocks_downloaded(self):
+        self.peer.new_transaction(sender='0', recipient='d', amount=1)
+        self.peer.seal_block()
+        length, chain, hashes = self.blockchain.fetch_peer_chain('peer:5000')
+        assert self.requested == ['/chain/head/', '/chain/since/4']
+        assert length == 5
+        assert chain == self.peer.chain
+        assert hashes == self.peer.block_hashes
+        self.blockchain.register_node('http://peer:5000')
+        assert self.blockchain.resolve_conflicts()
+        assert self.blockchain.block_hashes == self.peer.block_hashes
+
+    def test_downloaded_blocks_checked_once(self):
+        for recipient in ('d', 'e'):
+            self.peer.new_transaction(sender='0', recipient=recipient, amount=1)
+            self.peer.seal_block()
+        self.blockchain.register_node('http://peer:5000')
+        consensus = self.blockchain.consensus
+        with mock.patch.object(consensus, 'valid_seal', wraps=consensus.valid_seal) as valid_seal:
+            assert self.blockchain.resolve_conflicts()
+        assert valid_seal.call_count == 2
+        assert self.blockchain.block_hashes == self.peer.block_hashes
+
+    def test_downloaded_hashes_must_link_to_our_chain(self):
+        for recipient in ('d', 'e'):
+            self.peer.new_transaction(sender='0', recipient=recipient, amount=1)
+            self.peer.seal_block()
+        length, chain, hashes = self.blockchain.fetch_peer_chain('peer:5000')
+        # Our chain moved on to a different block while the peer's was being downloaded.
+        self.blockchain.new_transaction(sender='0', recipient='x', amount=1)
+        self.blockchain.seal_block()
+        valid, state = self.blockchain.valid_chain_extension(chain, 5, hashes)
+        assert not valid
+        fork = self.blockchain.common_prefix_length(chain)
+        valid, state = self.blockchain.valid_chain_extension(chain, fork, hashes)
+        assert valid
+
+    def test_steps_back_to_fork(self):
+        self.blockchain.new_transaction(sender='0', recipient='x', amount=1)
+        self.blockchain.seal_block()
+        for recipient in ('d', 'e'):
+            self.peer.new_transaction(sender='0', recipient=recipient, amount=1)
+            self.peer.seal_block()
+        length, chain, hashes = self.blockchain.fetch_peer_chain('peer:5000')
+        assert self.requested == ['/chain/head/', '/chain/since/5', '/chain/since/4']
+        assert length == 6
+        assert chain == self.peer.chain
+        assert hashes == self.peer.block_hashes
+
+    def test_chain_sent_in_negotiated_encoding(self):
+        plain = self.client.get('/chain/', headers={'Accept': blockchain_module.PEER_ACCEPT})
+        assert plain.mimetype == 'application/json'
+        assert plain.get_json()['chain'] == self.peer.chain
+        binary = self.client.get('/chain/', headers={'Accept': blockchain_module.BINARY_PEER_ACCEPT})
+        assert binary.mimetype == wireformat.CONTENT_TYPE
+        assert wireformat.decode(binary.get_data())['chain'] == self.peer.chain
+        assert len(binary.get_data()) < len(plain.get_data())
+
+    def test_chain_streamed_one_block_per_record(self):
+        response = self.client.get('/chain/since/1', headers={'Accept': blockchain_module.PEER_STREAM_ACCEPT})
+        assert response.mimetype == wireformat.JSON_STREAM_CONTENT_TYPE
+        records = list(wireformat.read_json_records([response.get_data()]))
+        assert records[0] == {'length': 4, 'start': 1}
+        assert records[1:] == self.peer.chain[1:]
+        response = self.client.get('/chain/since/1',
+                                   headers={'Accept': blockchain_module.BINARY_PEER_STREAM_ACCEPT})
+        assert response.mimetype == wireformat.STREAM_CONTENT_TYPE
+        assert list(wireformat.read_records([response.get_data()])) == records
+
+    def test_binary_encoding_preferred_on_request(self):
+        self.peer.new_transaction(sender='0', recipient='d', amount=1)
+        self.peer.seal_block()
+        self.addCleanup(blockchain_module.prefer_binary_encoding, False)
+        blockchain_module.prefer_binary_encoding()
+        length, chain, hashes = self.blockchain.fetch_peer_chain('peer:5000')
+        assert chain == self.peer.chain
+        assert hashes == self.peer.block_hashes
+
+    def test_download_abandoned_at_invalid_block(self):
+        self.peer.chain[2] = dict(self.peer.chain[2], previous_hash='0' * 64)
+        assert self.blockchain.fetch_full_peer_chain('peer:5000') is None
+        self.blockchain.chain = self.blockchain.chain[:2]
+        self.blockchain.block_hashes = self.blockchain.block_hashes[:2]
+        self.blockchain.publish_chain()
+        assert self.blockchain.fetch_peer_chain('peer:5000') is None
+        assert self.requested == ['/chain/', '/chain/head/', '/chain/since/2', '/chain/since/1']
+
+
+class TestPushedBlocks(TestCase):
+    def setUp(self):
+        self.sealer = Blockchain(ProofOfWork(difficulty=1))
+        self.sealer.new_transaction(sender='0', recipient='a', amount=1)
+        self.sealer.seal_block()
+        self.receiver = clone_chain(self.sealer)
+
+    def seal(self, recipient):
+        self.sealer.new_transaction(sender='0', recipient=recipient, amount=1)
+        return self.sealer.seal_block()
+
+    def test_block_extending_tip_is_added(self):
+        block = self.seal('b')
+        assert self.receiver.add_block(block) == BLOCK_ADDED
+        assert self.receiver.block_hashes == self.sealer.block_hashes
+        assert self.receiver.balance_check('b') == 1
+        assert self.receiver.add_block(block) == BLOCK_KNOWN
+
+    def test_block_past_tip_needs_sync(self):
+        self.seal('b')
+        assert self.receiver.add_block(self.seal('c')) == BLOCK_AHEAD
+        assert len(self.receiver.chain) == 2
+
+    def test_invalid_block_rejected(self):
+        block = dict(self.seal('b'))
+        block['transactions'] = [dict(block['transactions'][0], amount=-1)]
+        assert self.receiver.add_block(block) == BLOCK_INVALID
+        assert self.receiver.add_block({'index': 'x'}) == BLOCK_INVALID
+        assert len(self.receiver.chain) == 2
+
+
+class TestTally(BlockchainTestCase):
+    def test_tally_follows_new_blocks(self):
+        self.blockchain.set_candidates(['a', 'b'])
+        version = self.blockchain.tally_version
+        self.create_transaction(recipient='a')
+        self.create_transaction(recipient='c')
+        self.create_block()
+        assert self.blockchain.tally == {'a': 1, 'b': 0}
+        assert self.blockchain.tally_version > version
+
+    def test_tally_follows_adopted_chain(self):
+        blockchain = Blockchain(ProofOfWork(difficulty=1))
+        blockchain.new_transaction(sender='0', recipient='a', amount=1)
+        blockchain.seal_block()
+        peer = Blockchain(ProofOfWork(difficulty=1))
+        peer.set_candidates(['a', 'b'])
+        clone_chain(blockchain, peer)
+        assert peer.tally == {'a': 1, 'b': 0}
@@ -0,0 +1,170 @@
+# A suite of test functions that test the on-disk chain store.
+# Uses the python unittest test suite.
+
+import os
+import tempfile
+from unittest import TestCase, mock
+import vote_manager_node
+from blockchain import Blockchain
+from chainstore import ChainStore, ChainReader, INDEX_ENTRY
+from consensus import ProofOfWork
+from tests import clone_chain, keep_node_globals
+
+
+class TestChainStore(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.blockchain = Blockchain(ProofOfWork(difficulty=1))
+        self.blockchain.attach_store(ChainStore(self.directory, snapshot_interval=3))
+
+    def seal(self, blockchain, recipients):
+        for recipient in recipients:
+            blockchain.new_transaction(sender='0', recipient=recipient, amount=1)
+            blockchain.seal_block()
+
+    def restart(self):
+        self.blockchain.store.close()
+        restarted = Blockchain(ProofOfWork(difficulty=1))
+        assert restarted.attach_store(ChainStore(self.directory, snapshot_interval=3))
+        return restarted
+
+    def test_new_store_holds_genesis(self):
+        assert len(self.blockchain.store) == 1
+        assert self.blockchain.store.hashes == self.blockchain.block_hashes
+
+    def test_restart_restores_chain_and_state(self):
+        self.seal(self.blockchain, ['a', 'b', 'c', 'd'])
+        assert self.blockchain.store.snapshot_length == 3
+        restarted = self.restart()
+        assert restarted.chain == self.blockchain.chain
+        assert restarted.block_hashes == self.blockchain.block_hashes
+        assert restarted.wallets == self.blockchain.wallets
+        assert restarted.total_value == 4
+        assert restarted.transaction_index == self.blockchain.transaction_index
+
+    def test_partial_write_dropped(self):
+        self.seal(self.blockchain, ['a', 'b'])
+        size = os.path.getsize(self.blockchain.store.log_path)
+        with open(self.blockchain.store.log_path, 'ab') as f:
+            f.write(b'\x00\x00\x01\x00{"index": 3')
+        restarted = self.restart()
+        assert len(restarted.chain) == 3
+        # The partial block is cut off, so new blocks are written where it was.
+        self.blockchain = restarted
+        self.seal(restarted, ['c'])
+        assert restarted.store.offsets[-1] == size
+        assert self.restart().block_hashes == restarted.block_hashes
+
+    def test_unlinked_block_dropped(self):
+        self.seal(self.blockchain, ['a', 'b', 'c'])
+        # A store missing a block, as if one failed to be written and the next took its slot.
+        directory = tempfile.mkdtemp()
+        store = ChainStore(directory, snapshot_interval=100)
+        for index in (0, 1, 3):
+            store.append(self.blockchain.chain[index], self.blockchain.block_hashes[index])
+        store.close()
+        restarted = Blockchain(ProofOfWork(difficulty=1))
+        assert restarted.attach_store(ChainStore(directory, snapshot_interval=100))
+        assert restarted.block_hashes == self.blockchain.block_hashes[:2]
+
+    def test_replaced_blocks_are_rewritten(self):
+        self.seal(self.blockchain, ['a'])
+        peer = clone_chain(self.blockchain)
+        self.seal(self.blockchain, ['x'])
+        self.seal(peer, ['b', 'c', 'd'])
+        valid, state = self.blockchain.valid_chain_extension(list(peer.chain), 2)
+        assert valid
+        self.blockchain.adopt_chain(*state)
+        restarted = self.restart()
+        assert restarted.block_hashes == peer.block_hashes
+        assert restarted.balance_check('x') == 0
+        assert restarted.balance_check('d') == 1
+
+
+class TestChainReader(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.writer = Blockchain(ProofOfWork(difficulty=1))
+        self.writer.attach_store(ChainStore(self.directory))
+        self.reader = ChainReader(self.directory)
+        self.follower = Blockchain(ProofOfWork(difficulty=1))
+
+    def seal(self, blockchain, recipients):
+        for recipient in recipients:
+            blockchain.new_transaction(sender='0', recipient=recipient, amount=1)
+            blockchain.seal_block()
+
+    def test_follows_appended_blocks(self):
+        self.seal(self.writer, ['a', 'b'])
+        assert self.follower.follow_store(self.reader)
+        assert self.follower.block_hashes == self.writer.block_hashes
+        assert not self.follower.follow_store(self.reader)
+        self.seal(self.writer, ['c', 'd'])
+        assert self.follower.follow_store(self.reader)
+        assert self.follower.chain == self.writer.chain
+        assert self.follower.wallets == self.writer.wallets
+        assert self.follower.vote_keys == self.writer.vote_keys
+
+    def test_follows_replaced_blocks(self):
+        self.seal(self.writer, ['a', 'b'])
+        self.follower.follow_store(self.reader)
+        peer = clone_chain(self.writer, length=2)
+        self.seal(peer, ['x', 'y'])
+        assert self.writer.adopt_longest_chain([(len(peer.chain), peer.chain, None)])
+        assert self.follower.follow_store(self.reader)
+        assert self.follower.block_hashes == peer.block_hashes
+        assert self.follower.balance_check('b') == 0
+        assert self.follower.balance_check('y') == 1
+
+    def test_block_not_matching_its_entry_not_read(self):
+        self.seal(self.writer, ['a', 'b'])
+        # As if the writer replaced the last block between the index and the log being read.
+        with open(self.reader.index_path, 'r+b') as f:
+            f.seek(2 * INDEX_ENTRY.size + 8)
+            f.write(bytes(32))
+        assert self.reader.refresh() is None
+        assert not self.follower.follow_store(self.reader)
+        assert len(self.reader) == 0
+        with open(self.reader.index_path, 'r+b') as f:
+            f.seek(2 * INDEX_ENTRY.size + 8)
+            f.write(bytes.fromhex(self.writer.block_hashes[2]))
+        assert self.follower.follow_store(self.reader)
+        assert self.follower.block_hashes == self.writer.block_hashes
+
+
+class WriterResponse:
+    # Stands in for the writer's response to a forwarded request.
+    status_code = 200
+    headers = {'Content-Type': 'application/json', 'Content-Length': '21'}
+    content = b'{"status": "success"}'
+
+
+class TestReaderWorkers(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.writer = Blockchain(ProofOfWork(difficulty=1))
+        self.writer.attach_store(ChainStore(self.directory))
+        self.writer.new_transaction(sender='0', recipient='a', amount=1)
+        self.writer.seal_block()
+        keep_node_globals(self)
+        vote_manager_node.blockchain = Blockchain(ProofOfWork(difficulty=1))
+        self.client = vote_manager_node.create_app(self.directory, 'http://127.0.0.1:5001/', 0).test_client()
+
+    def test_reads_served_from_store(self):
+        assert self.client.get('/chain/head/').get_json()['hash'] == self.writer.last_hash
+        self.writer.new_transaction(sender='0', recipient='b', amount=1)
+        self.writer.seal_block()
+        assert self.client.get('/chain/head/').get_json()['length'] == 3
+
+    def test_writes_forwarded_to_writer(self):
+        calls = []
+
+        def fake_request(method, url, headers=None, data=None, timeout=None):
+            calls.append((method, url, headers['X-Forwarded-For'], data))
+            return WriterResponse()
+        with mock.patch.object(vote_manager_node.blockchain.session, 'request', fake_request):
+            response = self.client.post('/vote/', data={'id': 1, 'key': 'key', 'candidate': 'a'})
+        assert response.get_json() == {'status': 'success'}
+        method, url, forwarded_for, data = calls[0]
+        assert (method, url, forwarded_for) == ('POST', 'http://127.0.0.1:5001/vote/', '127.0.0.1')
+        assert b'candidate=a' in data
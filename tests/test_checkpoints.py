@@ -0,0 +1,73 @@
+# A suite of test functions that test signed checkpoints and bootstrapping from snapshots.
+# Uses the python unittest test suite.
+
+from unittest import TestCase
+import checkpoints
+import wireformat
+from blockchain import Blockchain
+from consensus import ProofOfWork
+from cryptfuncs import new_rsa
+
+
+class TestCheckpoints(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.public, cls.private = new_rsa(1024)
+
+    def setUp(self):
+        self.blockchain = Blockchain(ProofOfWork(difficulty=1))
+        self.blockchain.checkpoint_key = self.private
+        self.blockchain.checkpoint_interval = 3
+        self.seal(self.blockchain, ['a', 'b', 'c', 'd'])
+
+    def seal(self, blockchain, recipients):
+        for recipient in recipients:
+            blockchain.new_transaction(sender='0', recipient=recipient, amount=1)
+            blockchain.seal_block()
+
+    def test_checkpoint_signed_every_interval(self):
+        checkpoint = self.blockchain.checkpoint
+        assert checkpoint['length'] == 3
+        assert checkpoint['tip_hash'] == self.blockchain.block_hashes[2]
+        assert checkpoints.valid_checkpoint(checkpoint, [self.public])
+        self.seal(self.blockchain, ['e', 'f'])
+        assert self.blockchain.checkpoint['length'] == 6
+
+    def test_tampered_checkpoint_rejected(self):
+        checkpoint = dict(self.blockchain.checkpoint, total_value=100)
+        assert not checkpoints.valid_checkpoint(checkpoint, [self.public])
+        assert not checkpoints.valid_checkpoint(self.blockchain.checkpoint, [new_rsa(1024)[0]])
+
+    def test_bootstrap_from_snapshot(self):
+        # The snapshot goes through the binary encoding, as it does between nodes.
+        snapshot = wireformat.decode(wireformat.encode(self.blockchain.snapshot()))
+        node = Blockchain(ProofOfWork(difficulty=1))
+        assert node.load_snapshot(snapshot, [self.public])
+        assert node.chain == self.blockchain.chain[:3]
+        assert node.wallets == {'0': -2, 'a': 1, 'b': 1}
+        assert node.vote_keys == {1: 'a', 2: 'b'}
+        # The blocks after the checkpoint are validated as an extension of the snapshot.
+        assert node.common_prefix_length(self.blockchain.chain) == 3
+        valid, state = node.valid_chain_extension(self.blockchain.chain, 3)
+        assert valid
+        node.adopt_chain(*state)
+        assert node.wallets == self.blockchain.wallets
+        assert node.checkpoint == self.blockchain.checkpoint
+
+    def test_snapshot_not_matching_checkpoint_rejected(self):
+        node = Blockchain(ProofOfWork(difficulty=1))
+        snapshot = self.blockchain.snapshot()
+        assert not node.load_snapshot(dict(snapshot, wallets=dict(snapshot['wallets'], a=5)), [self.public])
+        altered = [dict(block) for block in snapshot['chain']]
+        altered[1]['timestamp'] += 1
+        assert not node.load_snapshot(dict(snapshot, chain=altered), [self.public])
+        assert not node.load_snapshot(snapshot, [])
+        assert len(node.chain) == 1
+
+    def test_checkpoint_dropped_when_its_blocks_are_replaced(self):
+        peer = Blockchain(ProofOfWork(difficulty=1))
+        self.seal(peer, ['x', 'y', 'z', 'w', 'v'])
+        self.blockchain.checkpoint_key = None
+        assert self.blockchain.adopt_longest_chain([(len(peer.chain), peer.chain, None)])
+        assert self.blockchain.checkpoint is None
+        assert self.blockchain.snapshot() is None
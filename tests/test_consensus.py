@@ -0,0 +1,74 @@
+# A suite of test functions that test the consensus rules.
+# Uses the python unittest test suite.
+
+import argparse
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from blockchain import Blockchain
+from consensus import ProofOfWork, ProofOfAuthority, add_consensus_arguments, consensus_from_args, make_consensus
+from cryptfuncs import new_rsa
+
+
+def seal_blocks(blockchain, recipients):
+    for recipient in recipients:
+        blockchain.new_transaction(sender='0', recipient=recipient, amount=1)
+        proof = blockchain.proof_of_work(blockchain.last_block)
+        blockchain.new_block(proof, blockchain.last_hash)
+
+
+class TestProofOfWork(TestCase):
+    def test_difficulty(self):
+        blockchain = Blockchain(ProofOfWork(difficulty=2))
+        seal_blocks(blockchain, ['a', 'b'])
+        self.assertTrue(blockchain.valid_chain(blockchain.chain))
+        # Much easier than the default, so the same proofs shouldn't pass a harder target.
+        self.assertFalse(Blockchain(ProofOfWork(difficulty=16)).valid_chain(blockchain.chain))
+
+    def test_default_matches_valid_proof(self):
+        blockchain = Blockchain()
+        seal_blocks(blockchain, ['a'])
+        last_block, block = blockchain.chain
+        self.assertTrue(Blockchain.valid_proof(last_block['proof'], block['proof'], blockchain.block_hashes[0]))
+
+
+class TestProofOfAuthority(TestCase):
+    def setUp(self):
+        self.public, self.private = new_rsa(1024)
+        self.blockchain = Blockchain(ProofOfAuthority(signing_key=self.private))
+        seal_blocks(self.blockchain, ['a', 'b', 'c'])
+
+    def test_signed_chain_is_valid(self):
+        self.assertTrue(self.blockchain.valid_chain(self.blockchain.chain))
+        validator = Blockchain(ProofOfAuthority([self.public.export_key().decode()]))
+        self.assertTrue(validator.valid_chain(self.blockchain.chain))
+
+    def test_untrusted_authority_rejected(self):
+        other_public, _ = new_rsa(1024)
+        validator = Blockchain(ProofOfAuthority([other_public.export_key().decode()]))
+        self.assertFalse(validator.valid_chain(self.blockchain.chain))
+
+    def test_altered_block_rejected(self):
+        chain = list(self.blockchain.chain)
+        chain[-1] = dict(chain[-1], transactions=[])
+        self.assertFalse(self.blockchain.consensus.valid_seal(chain[-2], chain[-1], self.blockchain.block_hashes[-2]))
+
+    def test_sealing_needs_key(self):
+        with self.assertRaises(ValueError):
+            seal_blocks(Blockchain(make_consensus('authority')), ['a'])
+
+    def test_keys_created_for_mutual_trust(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        parser = argparse.ArgumentParser()
+        add_consensus_arguments(parser)
+        first, second = os.path.join(directory, 'first.key'), os.path.join(directory, 'second.key')
+        sealer = consensus_from_args(parser.parse_args(['-c', 'authority', '-ak', first]), create_key=True)
+        self.assertTrue(os.path.exists(first + '.pub'))
+        validator = consensus_from_args(parser.parse_args(['-c', 'authority', '-ak', second, '-ta', first + '.pub']),
+                                        create_key=True)
+        self.assertTrue(os.path.exists(second + '.pub'))
+        blockchain = Blockchain(sealer)
+        seal_blocks(blockchain, ['a'])
+        self.assertTrue(Blockchain(validator).valid_chain(blockchain.chain))
@@ -3,6 +3,7 @@
 # Uses the python unittest test suite.
 
 from unittest import TestCase
+import cryptfuncs
 from cryptfuncs import *
 
 
@@ -64,3 +65,33 @@ class TestBatch(TestCase):
             if check == True:
                 break
         self.assertTrue(check)
+
+
+class TestKeyCache(TestCase):
+    def setUp(self):
+        clear_key_cache()
+        self.public, self.private = new_rsa(1024)
+        self.key_string = self.public.export_key().decode()
+
+    def test_cached_key_matches_import(self):
+        self.assertEqual(cryptfuncs.cached_import_key(self.key_string), import_key(self.key_string))
+
+    def test_hits_and_misses(self):
+        # Looked up on the module, since the cache is replaced when it is resized.
+        first = cryptfuncs.cached_import_key(self.key_string)
+        second = cryptfuncs.cached_import_key(self.key_string)
+        self.assertIs(first, second)
+        info = key_cache_info()
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits, 1)
+        self.assertEqual(info.maxsize, KEY_CACHE_SIZE)
+
+    def test_resize(self):
+        cryptfuncs.set_key_cache_size(4)
+        try:
+            cryptfuncs.cached_import_key(self.key_string)
+            info = key_cache_info()
+            self.assertEqual((info.maxsize, info.misses), (4, 1))
+        finally:
+            cryptfuncs.set_key_cache_size(KEY_CACHE_SIZE)
+        self.assertEqual(key_cache_info().maxsize, KEY_CACHE_SIZE)
@@ -0,0 +1,34 @@
+# A suite of test functions that test setting up the votes of an election.
+# Uses the python unittest test suite.
+
+import os
+import tempfile
+from unittest import TestCase
+import initialize_election
+from blockchain import Blockchain
+from consensus import ProofOfWork
+from cryptfuncs import import_key
+
+
+class TestBulkMineVotes(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.original = initialize_election.blockchain, initialize_election.key_file_path
+        initialize_election.blockchain = Blockchain(ProofOfWork(difficulty=1))
+        initialize_election.key_file_path = lambda vote_number: os.path.join(
+            self.directory, 'key_{}.vote'.format(vote_number))
+
+    def tearDown(self):
+        initialize_election.blockchain, initialize_election.key_file_path = self.original
+
+    def test_each_voter_gets_a_block_and_a_key_file(self):
+        initialize_election.bulk_mine_votes(5, 1, workers=2, batch_size=2)
+        blockchain = initialize_election.blockchain
+        assert len(blockchain.chain) == 6
+        assert blockchain.valid_chain(blockchain.chain)
+        for vote_number in range(1, 6):
+            with open(initialize_election.key_file_path(vote_number), 'r') as f:
+                private = import_key(f.read())
+            # The key file holds the private key of the voter the vote was issued to.
+            recipient = blockchain.chain[vote_number]['transactions'][0]['recipient']
+            assert private.publickey().export_key().decode() == recipient
@@ -0,0 +1,127 @@
+# A suite of test functions that test the pool of pending transactions.
+# Uses the python unittest test suite.
+
+from unittest import TestCase, mock
+from blockchain import Blockchain, BLOCK_ADDED
+from consensus import ProofOfWork
+from cryptfuncs import new_rsa
+import vote_manager_node
+from tests import clone_chain, keep_node_globals
+from mempool import Mempool, ADMITTED, DUPLICATE, POOL_FULL, SENDER_LIMIT, INVALID, BEHIND
+
+
+class TestMempool(TestCase):
+    def setUp(self):
+        self.mempool = Mempool(max_size=3, max_per_sender=1)
+
+    def test_duplicate_vote_held_once(self):
+        vote = Blockchain.build_transaction('voter', 'a', 1, 'key', 1)
+        # A copy gossiped by another peer gets a new timestamp, but is the same vote.
+        copy = Blockchain.build_transaction('voter', 'a', 1, 'key', 1)
+        assert self.mempool.add(vote) == ADMITTED
+        assert self.mempool.add(copy) == DUPLICATE
+        assert list(self.mempool) == [vote]
+
+    def test_limits(self):
+        assert self.mempool.add(Blockchain.build_transaction('voter', 'a', 1, 'key', 1)) == ADMITTED
+        assert self.mempool.add(Blockchain.build_transaction('voter', 'b', 1, 'key', 2)) == SENDER_LIMIT
+        for recipient in ('x', 'y'):
+            assert self.mempool.add(Blockchain.build_transaction('0', recipient, 1)) == ADMITTED
+        assert self.mempool.add(Blockchain.build_transaction('0', 'z', 1)) == POOL_FULL
+        assert len(self.mempool.drain()) == 3
+        assert not self.mempool
+        assert self.mempool.add(Blockchain.build_transaction('voter', 'b', 1, 'key', 2)) == ADMITTED
+
+    def test_discard_only_same_transaction(self):
+        vote = Blockchain.build_transaction('voter', 'a', 1, 'key', 1)
+        other = Blockchain.build_transaction('other', 'a', 1, 'key', 2)
+        assert self.mempool.add(vote) == ADMITTED
+        assert self.mempool.add(other) == ADMITTED
+        # A different vote by the same voter doesn't remove the one held.
+        self.mempool.discard([Blockchain.build_transaction('other', 'b', 1, 'key', 2)])
+        self.mempool.discard([vote])
+        assert list(self.mempool) == [other]
+        assert self.mempool.add(Blockchain.build_transaction('voter', 'b', 1, 'key', 3)) == ADMITTED
+
+
+class TestAdmission(TestCase):
+    def setUp(self):
+        self.blockchain = Blockchain(ProofOfWork(difficulty=1))
+        public, private = new_rsa(1024)
+        self.public, self.private = public.export_key().decode(), private.export_key().decode()
+        self.blockchain.new_transaction(sender='0', recipient=self.public, amount=1)
+        self.blockchain.seal_block()
+
+    def test_gossiped_vote_admitted_once(self):
+        for _ in range(3):
+            vote = Blockchain.build_transaction(self.public, 'candidate', 1, self.private, 1)
+            self.blockchain.admit_transaction(vote)
+        assert len(self.blockchain.current_transactions) == 1
+        block = self.blockchain.seal_block()
+        assert len(block['transactions']) == 1
+
+    def test_precheck_rejects_wrong_or_spent_votes(self):
+        wrong_number = Blockchain.build_transaction(self.public, 'candidate', 1, self.private, 0)
+        assert self.blockchain.admit_transaction(wrong_number) == INVALID
+        # A vote issued in a block this node doesn't have yet may be valid, once the chain catches up.
+        ahead = Blockchain.build_transaction(self.public, 'candidate', 1, self.private, 5)
+        assert self.blockchain.admit_transaction(ahead) == BEHIND
+        vote = Blockchain.build_transaction(self.public, 'candidate', 1, self.private, 1)
+        assert self.blockchain.admit_transaction(vote) == ADMITTED
+        self.blockchain.seal_block()
+        # The vote has been cast, so another copy of it is turned away.
+        copy = Blockchain.build_transaction(self.public, 'candidate', 1, self.private, 1)
+        assert self.blockchain.admit_transaction(copy) == INVALID
+
+    def test_fields_of_wrong_type_rejected(self):
+        vote = Blockchain.build_transaction(self.public, 'candidate', 1, self.private, 1)
+        for field, value in (('recipient', ['x']), ('sender', 0), ('amount', '1'), ('timestamp', None)):
+            assert self.blockchain.admit_transaction(dict(vote, **{field: value})) == INVALID
+            assert not self.blockchain.valid_transaction(dict(vote, **{field: value}), self.blockchain.chain)
+        assert not self.blockchain.mempool
+
+    def test_malformed_transaction_rejected_alone(self):
+        # Held by the pool without the admission check, as if it had slipped past it.
+        bad = Blockchain.build_transaction('someone', ['x'], 1, 'key', 2)
+        vote = Blockchain.build_transaction(self.public, 'candidate', 1, self.private, 1)
+        self.blockchain.mempool.add(bad)
+        assert self.blockchain.admit_transaction(vote) == ADMITTED
+        rejected = []
+        block = self.blockchain.seal_block(rejected)
+        assert block['transactions'] == [vote]
+        assert rejected == [bad]
+
+    def test_vote_sealed_elsewhere_leaves_pool(self):
+        vote = Blockchain.build_transaction(self.public, 'candidate', 1, self.private, 1)
+        assert self.blockchain.admit_transaction(vote) == ADMITTED
+        peer = clone_chain(self.blockchain)
+        assert peer.admit_transaction(vote) == ADMITTED
+        assert self.blockchain.add_block(peer.seal_block()) == BLOCK_ADDED
+        assert not self.blockchain.mempool
+
+    def test_nothing_sealed_when_every_pending_vote_is_invalid(self):
+        vote = Blockchain.build_transaction(self.public, 'candidate', 1, self.private, 1)
+        assert self.blockchain.admit_transaction(vote) == ADMITTED
+        self.blockchain.seal_block()
+        length = len(self.blockchain.chain)
+        forged = Blockchain.build_transaction(self.public, 'other', 1, 'not a key', 1)
+        self.blockchain.mempool.add(forged)
+        rejected = []
+        assert self.blockchain.seal_block(rejected) is None
+        assert rejected == [forged]
+        assert len(self.blockchain.chain) == length
+
+    def test_vote_from_ahead_of_chain_is_retried(self):
+        keep_node_globals(self)
+        vote_manager_node.blockchain = self.blockchain
+        client = vote_manager_node.app.test_client()
+        vote = {'sender': self.public, 'recipient': 'candidate', 'amount': 1,
+                'signature': self.private, 'vote_number': 5}
+        with mock.patch.object(vote_manager_node, 'request_sync') as request_sync:
+            response = client.post('/external_transaction/', json=vote)
+        assert response.status_code == 503
+        assert response.get_json() == {'status': BEHIND}
+        request_sync.assert_called_once_with()
+        response = client.post('/external_transaction/', json=dict(vote, vote_number=0))
+        assert response.status_code == 200
+        assert response.get_json() == {'status': INVALID}
@@ -0,0 +1,55 @@
+# A suite of test functions that test the metrics a node serves.
+# Uses the python unittest test suite.
+
+from unittest import TestCase
+import metrics
+import vote_manager_node
+from blockchain import Blockchain, VALID_CHAIN_SECONDS
+from consensus import ProofOfWork
+from tests import keep_node_globals
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        metrics.enable()
+        keep_node_globals(self)
+
+    def tearDown(self):
+        metrics.disable()
+
+    def test_counter_and_histogram_render(self):
+        counter = metrics.Counter('test_things_total', 'Things.', ['kind'])
+        histogram = metrics.Histogram('test_wait_seconds', 'Waits.', buckets=(0.1, 1))
+        counter.inc('a')
+        counter.inc('a', amount=2)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        lines = counter.render() + histogram.render()
+        self.assertIn('test_things_total{kind="a"} 3', lines)
+        self.assertIn('test_wait_seconds_bucket{le="0.1"} 0', lines)
+        self.assertIn('test_wait_seconds_bucket{le="1"} 1', lines)
+        self.assertIn('test_wait_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('test_wait_seconds_count 2', lines)
+        metrics.registry.remove(counter)
+        metrics.registry.remove(histogram)
+
+    def test_nothing_recorded_while_disabled(self):
+        metrics.disable()
+        blockchain = Blockchain(ProofOfWork(difficulty=1))
+        before = sum(VALID_CHAIN_SECONDS.counts)
+        self.assertTrue(blockchain.valid_chain(blockchain.chain))
+        self.assertEqual(sum(VALID_CHAIN_SECONDS.counts), before)
+
+    def test_metrics_route(self):
+        vote_manager_node.blockchain = Blockchain(ProofOfWork(difficulty=1))
+        client = vote_manager_node.app.test_client()
+        client.post('/vote/', data={'id': 5, 'key': 'not a key', 'candidate': 'a'})
+        response = client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Type'], metrics.CONTENT_TYPE)
+        body = response.get_data(as_text=True)
+        self.assertIn('chain_length 1', body)
+        self.assertIn('votes_total{result="fail"}', body)
+        self.assertIn('vote_request_seconds_count', body)
+        metrics.disable()
+        self.assertEqual(client.get('/metrics').status_code, 404)
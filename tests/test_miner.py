@@ -0,0 +1,52 @@
+# A suite of test functions that test proof of work mining.
+# Uses the python unittest test suite.
+
+import hashlib
+from unittest import TestCase
+import miner
+from blockchain import Blockchain
+from consensus import ProofOfWork
+from miner import Miner
+
+
+class TestMiner(TestCase):
+    def test_meets_difficulty(self):
+        self.assertTrue(miner.meets_difficulty(bytes.fromhex('000f' + 'ff' * 30), 3))
+        self.assertFalse(miner.meets_difficulty(bytes.fromhex('001f' + 'ff' * 30), 3))
+        self.assertTrue(miner.meets_difficulty(bytes.fromhex('00ff' + 'ff' * 30), 2))
+        self.assertFalse(miner.meets_difficulty(bytes(32), 65))
+
+    def test_finds_smallest_proof(self):
+        last_hash = hashlib.sha256(b'block').hexdigest()
+        proof = Miner().mine(100, last_hash, 3)
+        guesses = [hashlib.sha256(f'100{p}{last_hash}'.encode()).hexdigest() for p in range(proof + 1)]
+        self.assertTrue(guesses[-1].startswith('000'))
+        self.assertFalse(any(guess.startswith('000') for guess in guesses[:-1]))
+
+    def test_workers_find_same_proof(self):
+        last_hash = hashlib.sha256(b'block').hexdigest()
+        workers = Miner(workers=2)
+        try:
+            for last_proof in range(3):
+                self.assertEqual(workers.mine(last_proof, last_hash, 3), Miner().mine(last_proof, last_hash, 3))
+            self.assertGreater(workers.hash_rate, 0)
+            # Workers are spawned, not forked from a thread of the node.
+            self.assertEqual(workers.executor._mp_context.get_start_method(), 'spawn')
+        finally:
+            workers.close()
+
+
+class TestRecordedDifficulty(TestCase):
+    def test_harder_blocks_accepted(self):
+        blockchain = Blockchain(ProofOfWork(difficulty=1, mining_difficulty=3))
+        blockchain.new_transaction(sender='0', recipient='a', amount=1)
+        block = blockchain.seal_block()
+        self.assertEqual(block['difficulty'], 3)
+        self.assertTrue(miner.valid_proof(blockchain.chain[0]['proof'], block['proof'], blockchain.block_hashes[0], 3))
+        self.assertTrue(Blockchain(ProofOfWork(difficulty=2)).valid_chain(blockchain.chain))
+
+    def test_understated_difficulty_rejected(self):
+        blockchain = Blockchain(ProofOfWork(difficulty=1))
+        blockchain.new_transaction(sender='0', recipient='a', amount=1)
+        blockchain.seal_block()
+        self.assertFalse(Blockchain(ProofOfWork(difficulty=2)).valid_chain(blockchain.chain))
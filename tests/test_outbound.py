@@ -0,0 +1,75 @@
+# A suite of test functions that test background delivery to peers.
+# Uses the python unittest test suite.
+
+from time import sleep, time
+from unittest import TestCase, mock
+import requests
+from outbound import Outbox
+
+
+class TestOutbox(TestCase):
+    def setUp(self):
+        self.posted = []
+        self.session = mock.Mock()
+        self.session.post = self.fake_post
+        self.outbox = Outbox(self.session, max_attempts=3, backoff=0)
+
+    def fake_post(self, url, json=None, timeout=None):
+        self.posted.append((url, json))
+        if 'dead' in url:
+            raise requests.ConnectionError()
+        sleep(0.05)
+        return mock.Mock(__bool__=lambda _: True)
+
+    def wait_for_delivery(self):
+        deadline = time() + 5
+        while any(self.outbox.backlog().values()) and time() < deadline:
+            sleep(0.01)
+
+    def test_send_returns_immediately(self):
+        start = time()
+        self.outbox.broadcast(['a:1', 'b:1', 'c:1'], '/block/', {'index': 1})
+        self.assertLess(time() - start, 0.05)
+        self.wait_for_delivery()
+        self.assertEqual(len(self.posted), 3)
+
+    def test_messages_delivered_in_order(self):
+        for index in range(5):
+            self.outbox.send('a:1', '/block/', {'index': index})
+        self.wait_for_delivery()
+        self.assertEqual([payload['index'] for _, payload in self.posted], list(range(5)))
+
+    def test_dead_peer_retried_then_dropped(self):
+        self.outbox.send('dead:1', '/external_transaction/', {})
+        self.outbox.send('a:1', '/external_transaction/', {})
+        self.wait_for_delivery()
+        self.assertEqual(len([url for url, _ in self.posted if 'dead' in url]), 3)
+        self.assertEqual(self.outbox.dropped, {'dead:1': 1, 'a:1': 0})
+        self.assertEqual(self.outbox.backlog(), {'dead:1': 0, 'a:1': 0})
+
+    def test_full_queue_drops_oldest(self):
+        outbox = Outbox(self.session, max_attempts=1, backoff=0, max_queued=2)
+        for index in range(6):
+            outbox.send('a:1', '/block/', {'index': index})
+        deadline = time() + 5
+        while any(outbox.backlog().values()) and time() < deadline:
+            sleep(0.01)
+        delivered = [payload['index'] for _, payload in self.posted]
+        # The first message was being delivered while the rest filled the queue.
+        self.assertEqual(delivered[-2:], [4, 5])
+        self.assertEqual(len(delivered) + outbox.dropped['a:1'], 6)
+        self.assertGreater(outbox.dropped['a:1'], 0)
+
+    def test_removed_peer_stops(self):
+        self.outbox.send('a:1', '/block/', {'index': 0})
+        self.outbox.send('a:1', '/block/', {'index': 1})
+        self.outbox.remove('a:1')
+        self.assertEqual(self.outbox.backlog(), {})
+        self.assertNotIn('a:1', self.outbox.dropped)
+        sleep(0.2)
+        # At most the message already being delivered was posted.
+        self.assertLessEqual(len(self.posted), 1)
+        self.outbox.send('a:1', '/block/', {'index': 2})
+        self.wait_for_delivery()
+        self.assertEqual(self.posted[-1][1], {'index': 2})
+        self.assertEqual(self.outbox.backlog(), {'a:1': 0})
@@ -0,0 +1,93 @@
+# A suite of test functions that test the logger.
+# Uses the python unittest test suite.
+
+import io
+import json
+import threading
+from unittest import TestCase
+import simplelog
+from simplelog import init_logger, stop_logger, log, set_context, clear_context, INFO, WARNING
+
+
+class Formatted:
+    """
+    A value that counts how often it is formatted.
+    """
+    def __init__(self):
+        self.times = 0
+
+    def __str__(self):
+        self.times += 1
+        return 'formatted'
+
+
+class Blocking:
+    """
+    A value that holds up the writer while it is formatted, until released.
+    """
+    def __init__(self):
+        self.formatting = threading.Event()
+        self.release = threading.Event()
+
+    def __str__(self):
+        self.formatting.set()
+        self.release.wait()
+        return 'blocked'
+
+
+class TestSimpleLog(TestCase):
+    def setUp(self):
+        self.output = io.StringIO()
+
+    def tearDown(self):
+        stop_logger()
+        clear_context()
+
+    def lines(self):
+        # Stopping the logger waits for the writer to write every queued record.
+        stop_logger()
+        return self.output.getvalue().splitlines()
+
+    def test_off_until_initialized(self):
+        value = Formatted()
+        log("VALUE {}", value)
+        self.assertFalse(simplelog.logging)
+        self.assertEqual(value.times, 0)
+
+    def test_levels_below_threshold_not_formatted(self):
+        init_logger(INFO, output=self.output)
+        value = Formatted()
+        log("DEBUG {}", value)
+        log("WARNING {}", value, level=WARNING)
+        self.assertEqual(self.lines(), ["   LOG::WARNING formatted"])
+        self.assertEqual(value.times, 1)
+
+    def test_json_records_carry_context(self):
+        init_logger(json_format=True, output=self.output)
+        set_context(request='abc')
+        set_context(vote=7)
+        log("VOTE {} RECEIVED.", 7, level=INFO, peer='node')
+        record = json.loads(self.lines()[0])
+        self.assertEqual(record['message'], "VOTE 7 RECEIVED.")
+        self.assertEqual(record['level'], 'INFO')
+        self.assertEqual((record['request'], record['vote'], record['peer']), ('abc', 7, 'node'))
+
+    def test_print_style_calls(self):
+        init_logger(output=self.output)
+        log("CHECKING CHAIN.")
+        log("PARTS", 1, 2)
+        self.assertEqual(self.lines(), ["   LOG::CHECKING CHAIN.", "   LOG::PARTS 1 2"])
+
+    def test_full_queue_drops_records(self):
+        init_logger(output=self.output, max_records=2)
+        before = simplelog.dropped
+        value = Blocking()
+        log("FIRST {}", value)
+        # The writer is held up formatting the first record, so the rest back up behind it.
+        value.formatting.wait()
+        for index in range(5):
+            log("RECORD {}", index)
+        value.release.set()
+        self.assertEqual(self.lines(), ["   LOG::FIRST blocked", "   LOG::RECORD 0", "   LOG::RECORD 1",
+                                        "   LOG::DROPPED 3 RECORDS WHILE THE LOG WAS FULL."])
+        self.assertEqual(simplelog.dropped - before, 3)
@@ -0,0 +1,74 @@
+# Authors: Sam Champer and Andi Nosler
+# Tests of the compact binary encoding of blocks and chains.
+# Uses the python unittest test suite.
+
+import json
+from unittest import TestCase
+import cryptfuncs
+import wireformat
+from blockchain import Blockchain
+
+
+class TestWireFormat(TestCase):
+    def setUp(self):
+        public, private = cryptfuncs.new_rsa(1024)
+        self.public = public.export_key().decode()
+        self.private = private.export_key().decode()
+        vote = Blockchain.build_transaction(self.public, 'Candidate A', 1, self.private, 2)
+        self.block = {'index': 2, 'timestamp': 1541113234.8212, 'transactions': [vote],
+                      'proof': 35293, 'previous_hash': Blockchain.hash({'index': 1})}
+
+    def test_round_trip(self):
+        # Test that a decoded block is the same block, with the same hash.
+        decoded = wireformat.decode(wireformat.encode(self.block))
+        self.assertEqual(decoded, self.block)
+        self.assertEqual(Blockchain.hash(decoded), Blockchain.hash(self.block))
+
+    def test_smaller_than_json(self):
+        # Test that keys and hashes are sent as raw bytes.
+        encoded = wireformat.encode(self.block)
+        self.assertLess(len(encoded), len(json.dumps(self.block)) * 0.7)
+
+    def test_unusual_values(self):
+        # Test that values outside what blocks normally hold survive unchanged.
+        values = {'genesis': 1, 'big': 2 ** 80, 'negative': -5, 'flag': True, 'none': None,
+                  'odd_hex': 'abc', 'upper_hex': 'ABCD', 'name': 'Ünïcode', 'list': [1.5, 'x', []],
+                  'public_key': self.public + '\n', 'private_key': self.private.replace('\n', '\r\n')}
+        decoded = wireformat.decode(wireformat.encode(values))
+        self.assertEqual(decoded, values)
+        self.assertEqual(json.dumps(decoded), json.dumps(values))
+
+    def test_lone_surrogates(self):
+        # Test that strings JSON accepts but UTF-8 can't encode, such as a gossiped vote for "\ud800", survive.
+        vote = json.loads(json.dumps(dict(self.block['transactions'][0], recipient='\ud800')))
+        block = dict(self.block, transactions=[vote], **{'\udfff': 'x\ud83d'})
+        decoded = wireformat.decode(wireformat.encode(block))
+        self.assertEqual(decoded, block)
+        self.assertEqual(Blockchain.hash(decoded), Blockchain.hash(block))
+
+    def test_malformed_data(self):
+        # Test that truncated or padded data is rejected.
+        encoded = wireformat.encode(self.block)
+        with self.assertRaises(ValueError):
+            wireformat.decode(encoded[:-10])
+        with self.assertRaises(ValueError):
+            wireformat.decode(encoded + b'\x00')
+        with self.assertRaises(ValueError):
+            wireformat.decode(b'\x63')
+
+    def test_records_split_across_chunks(self):
+        # Test that a stream of records decodes the same however it is split up.
+        data = b''.join(wireformat.encode_record(value) for value in ({'length': 2}, self.block, self.block))
+        chunks = [data[i:i + 5] for i in range(0, len(data), 5)]
+        assert list(wireformat.read_records(chunks)) == [{'length': 2}, self.block, self.block]
+        with self.assertRaises(ValueError):
+            list(wireformat.read_records([data[:-1]]))
+
+    def test_json_records_split_across_chunks(self):
+        # Test that a stream of lines of JSON decodes the same however it is split up.
+        values = [{'length': 2}, self.block, dict(self.block, note='line\nbreak')]
+        data = b''.join(wireformat.encode_json_record(value) for value in values)
+        chunks = [data[i:i + 5] for i in range(0, len(data), 5)]
+        assert list(wireformat.read_json_records(chunks)) == values
+        with self.assertRaises(ValueError):
+            list(wireformat.read_json_records([data[:-1]]))
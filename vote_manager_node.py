@@ -3,14 +3,24 @@
 # along with lots of additional code by the authors to implement the specific needs of a blockchain enabled election.
 
 from uuid import uuid4
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, Response, jsonify, request, render_template
 from argparse import ArgumentParser
-from blockchain import Blockchain
+from blockchain import Blockchain, BLOCK_ADDED, BLOCK_AHEAD, prefer_binary_encoding
+from mempool import ADMITTED, POOL_FULL, BEHIND
+from consensus import add_consensus_arguments, consensus_from_args, load_private_key
+from outbound import Outbox
+from chainstore import ChainStore, ChainReader
+import wireformat
+import cryptfuncs
+import metrics
 import requests
-from time import sleep
+from time import sleep, time
+from os import path
+from threading import Event, Lock, Thread
 from werkzeug.contrib.fixers import ProxyFix
 from urllib.parse import urlparse
 import atexit
+import simplelog
 from simplelog import *
 
 
@@ -24,6 +34,117 @@ node_identifier = str(uuid4()).replace('-', '')
 blockchain = Blockchain()
 
 
+def load_candidates(params_file="vote_params.txt"):
+    """
+    Read the names of the candidates of the election from the vote parameters file.
+    :param params_file: Path of the vote parameters file, relative to this script.
+    :return: A list of candidate names.
+    """
+    with open(path.join(path.dirname(path.abspath(__file__)), params_file), 'r') as f:
+        vote_params = f.read()
+    candidates = vote_params.split("Candidates:")[1].split('\n')
+    return list(filter(lambda x: x != "", candidates))
+
+
+# The candidates are read once, and their balances are kept in the blockchain's tally.
+blockchain.set_candidates(load_candidates())
+
+# Seconds a results response may be reused before it is rebuilt from the tally.
+results_max_age = 0
+# The last results response: {'version': tally version, 'time': when built, 'data': ..., 'etag': ...}
+results_cache = dict()
+
+# Block producer mode. When block_interval is set, votes are queued and sealed into
+# a block every block_interval milliseconds, or as soon as block_transactions are queued.
+block_interval = 0
+block_transactions = 100
+block_ready = Event()
+# Receipts of queued votes: receipt id -> {'transaction': transaction key, 'status': ..., 'block': ...}
+vote_receipts = dict()
+# Most receipts kept. Once there are more, the oldest are forgotten, and report "unknown".
+MAX_VOTE_RECEIPTS = 100000
+# Held while receipts are added, updated or dropped.
+receipts_lock = Lock()
+# Receipt ids of votes that haven't been sealed yet, keyed on transaction key.
+pending_receipts = dict()
+
+# Transactions and blocks are delivered to peers in the background through the outbox.
+outbox = Outbox(blockchain.session)
+# Seconds between background syncs with peers. 0 turns them off.
+sync_interval = 30
+# Held while a sync with peers is running, so only one runs at a time.
+sync_lock = Lock()
+
+# Reader mode, set up by create_app. Each worker process follows the chain store of a writer node,
+# serves reads of the chain and results itself, and passes every other request on to the writer.
+store_reader = None
+writer_address = None
+# Seconds between checks of the chain store for new blocks.
+store_refresh_interval = 0.2
+last_store_refresh = 0
+# Routes a worker answers from the chain store.
+READ_ENDPOINTS = {'index', 'full_chain', 'chain_head', 'chain_since', 'fetch_results', 'display_results', 'static'}
+# Headers that apply to a single connection, so aren't passed on.
+HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'content-encoding', 'content-length', 'host'}
+
+VOTE_SECONDS = metrics.Histogram('vote_request_seconds', 'Time taken to answer a vote.')
+VOTES = metrics.Counter('votes_total', 'Votes received, by outcome.', ['result'])
+metrics.Gauge('chain_length', 'Number of blocks on the chain.', lambda: len(blockchain.chain))
+metrics.Gauge('mempool_size', 'Transactions waiting to be sealed into a block.', lambda: len(blockchain.mempool))
+metrics.Gauge('peers', 'Number of peers this node knows of.', lambda: len(blockchain.nodes))
+metrics.Gauge('log_records_dropped', 'Log records dropped while the log queue was full.',
+              lambda: simplelog.dropped)
+
+
+@app.before_request
+def bind_request_id():
+    """
+    Tag every log record written while handling a request with the request's id,
+    taken from an X-Request-Id header when a proxy has set one.
+    """
+    set_context(request=request.headers.get('X-Request-Id') or uuid4().hex[:16])
+
+
+@app.before_request
+def serve_from_store():
+    """
+    In reader mode, catch up with the writer's chain store before a read,
+    and pass anything that isn't a read on to the writer.
+    """
+    global last_store_refresh
+    if store_reader is None:
+        return None
+    if request.endpoint not in READ_ENDPOINTS:
+        return forward_to_writer()
+    now = time()
+    if now - last_store_refresh >= store_refresh_interval:
+        last_store_refresh = now
+        blockchain.follow_store(store_reader)
+    return None
+
+
+def forward_to_writer():
+    """
+    Pass the current request on to the writer node and send back its response.
+    The client's address is passed on in X-Forwarded-For, for routes that register the sender as a peer.
+    """
+    headers = {key: value for key, value in request.headers.items() if key.lower() not in HOP_HEADERS}
+    headers['X-Forwarded-For'] = request.remote_addr
+    try:
+        url = "http://" + writer_address + request.full_path.rstrip('?')
+        response = blockchain.session.request(request.method, url, headers=headers, data=request.get_data(),
+                                              timeout=(3, 30))
+    except requests.RequestException:
+        return jsonify({'message': 'The writer node is not responding.'}), 502
+    headers = [(key, value) for key, value in response.headers.items() if key.lower() not in HOP_HEADERS]
+    return Response(response.content, status=response.status_code, headers=headers)
+
+
+@app.teardown_request
+def unbind_request_id(exception=None):
+    clear_context()
+
+
 @app.route('/')
 @app.route('/index')
 @app.route('/index.html')
@@ -39,13 +160,101 @@ def full_chain():
     """
     App route to call for sending the chain.
     """
+    chain, _, length = blockchain.view
     response = {
-        'chain': blockchain.chain,
-        'length': len(blockchain.chain),
+        'chain': chain[:length],
+        'length': length,
     }
+    return chain_response(response)
+
+
+def chain_response(response):
+    """
+    Send blocks in the encoding the requester prefers: a stream of one record per block,
+    the compact binary encoding, or JSON.
+    Streamed responses start with a record of everything but the chain, followed by the blocks,
+    so the requester can check each block as it arrives.
+    :param response: The dictionary to send.
+    """
+    encoding = request.accept_mimetypes.best_match(
+        [wireformat.STREAM_CONTENT_TYPE, wireformat.JSON_STREAM_CONTENT_TYPE, wireformat.CONTENT_TYPE,
+         'application/json'])
+    if encoding in (wireformat.STREAM_CONTENT_TYPE, wireformat.JSON_STREAM_CONTENT_TYPE):
+        header = {key: value for key, value in response.items() if key != 'chain'}
+        encode_record = (wireformat.encode_record if encoding == wireformat.STREAM_CONTENT_TYPE
+                         else wireformat.encode_json_record)
+
+        def records():
+            yield encode_record(header)
+            for block in response['chain']:
+                yield encode_record(block)
+        return Response(records(), status=200, mimetype=encoding)
+    if encoding == wireformat.CONTENT_TYPE:
+        return Response(wireformat.encode(response), status=200, mimetype=wireformat.CONTENT_TYPE)
     return jsonify(response), 200
 
 
+@app.route('/chain/head/', methods=['GET'])
+def chain_head():
+    """
+    App route to call for the length of the chain and the hash of its last block,
+    so a peer can tell whether it needs any blocks without downloading the chain.
+    """
+    _, hashes, length = blockchain.view
+    response = {
+        'length': length,
+        'hash': hashes[length - 1],
+    }
+    return jsonify(response), 200
+
+
+@app.route('/chain/since/<int:index>', methods=['GET'])
+def chain_since(index):
+    """
+    App route to call for only the blocks from the given index onward.
+    """
+    chain, _, length = blockchain.view
+    response = {
+        'chain': chain[index:length],
+        'length': length,
+        'start': index,
+    }
+    return chain_response(response)
+
+
+@app.route('/checkpoint/', methods=['GET'])
+def latest_checkpoint():
+    """
+    App route to call for the latest signed checkpoint of this node's chain.
+    """
+    checkpoint = blockchain.checkpoint
+    if checkpoint is None:
+        return jsonify({'message': 'No checkpoint yet.'}), 404
+    return jsonify(checkpoint), 200
+
+
+@app.route('/snapshot/', methods=['GET'])
+def serve_snapshot():
+    """
+    App route to call for the chain up to the latest checkpoint, with the wallets at that point,
+    so a new node can start from it without validating those blocks.
+    """
+    response = blockchain.snapshot()
+    if response is None:
+        return jsonify({'message': 'No checkpoint yet.'}), 404
+    return chain_response(response)
+
+
+@app.route('/metrics', methods=['GET'])
+def serve_metrics():
+    """
+    App route to call for this node's metrics, in the Prometheus text format.
+    """
+    if not metrics.enabled:
+        return jsonify({'message': 'Metrics are off. Start the node with -m to turn them on.'}), 404
+    return Response(metrics.render(), status=200, content_type=metrics.CONTENT_TYPE)
+
+
 @app.route('/nodes/', methods=['GET'])
 def send_node_list():
     """
@@ -58,38 +267,31 @@ def send_node_list():
 @app.route('/results/get_results/', methods=['GET'])
 def fetch_results():
     """
-    If a user is checking the results of the vote, pull the latest chain,
-    resolve conflicts, and then display the wallet balances of all the candidates.
+    If a user is checking the results of the vote, display the wallet balances of all the candidates.
+    Peers push new blocks to this node as they are sealed, and it syncs with them in
+    the background, so the chain is already up to date. The balances come from the
+    blockchain's tally, and a response may be reused for up to results_max_age seconds.
+    Clients that send back the ETag of the results they have get a 304 if nothing changed.
     """
-    blockchain.resolve_conflicts()
-    # If, at some point in the past, there was a parallel operation that resulted in the node failing to respond
-    # to another node's request, this node may have been incorrectly pruned from that node's list of active nodes.
-    # To correct this, send a reciprocation request to all nodes that just responded by sending this node a chain.
-    # This might add a tiny bit to server overhead, and it solves a parallelization problem that probably won't happen,
-    # but it makes the system a tiny bit more robust:
-    for node in blockchain.nodes:
-        try:
-            requests.post("http://" + node + "/recip/", json={'port': port})
-        except:
-            continue
-    # This node may have had the most up to date chain, yet still have pending transactions.
-    # if so, add a block into which any pending transactions can be added.
-    if blockchain.current_transactions:
-        last_block = blockchain.last_block
-        proof = blockchain.proof_of_work(last_block)
-        previous_hash = blockchain.hash(last_block)
-        blockchain.new_block(proof, previous_hash)
-
-    # Now that we have the most up to date chain, fetch the candidates' wallet balances.
-    with open("vote_params.txt", 'r') as f:
-        vote_params = f.read()
-    candidates = vote_params.split("Candidates:")[1].split('\n')
-    candidates = list(filter(lambda x: x != "", candidates))
-
-    data = dict()
-    for candidate in candidates:
-        data[candidate] = blockchain.balance_check(candidate)
-    return jsonify(data), 200
+    global results_cache
+    now = time()
+    cache = results_cache
+    if not cache or (cache['version'] != blockchain.tally_version and now - cache['time'] >= results_max_age):
+        version = blockchain.tally_version
+        cache = {
+            'version': version,
+            'time': now,
+            'data': dict(blockchain.tally),
+            'etag': "{}-{}".format(len(blockchain.chain), version),
+        }
+        results_cache = cache
+    if request.if_none_match.contains(cache['etag']):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(cache['data'])
+    response.set_etag(cache['etag'])
+    response.cache_control.max_age = results_max_age
+    return response
 
 
 @app.route('/results/', methods=['GET'])
@@ -101,6 +303,7 @@ def display_results():
 
 
 @app.route('/vote/', methods=['post'])
+@VOTE_SECONDS.time
 def submit_vote():
     """
     Receive a post from the HTML with the information for
@@ -109,22 +312,28 @@ def submit_vote():
     vote_number = int(request.form["id"])
     signature = request.form["key"]
     recipient = request.form["candidate"]
+    set_context(vote=vote_number)
     sender = blockchain.get_transactor(vote_number)
     if not sender:
         # Failure if user trying to cast non-existent vote.
-        return jsonify({"status": "fail"})
+        return vote_response("fail")
 
-    vote = blockchain.new_transaction(
+    # Build the vote without adding it to the pending transactions until it has been checked.
+    vote = blockchain.build_transaction(
         sender=sender,
         recipient=recipient,
         amount=1,
         signature=signature,
         vote_number=vote_number
     )
-    if not blockchain.valid_transaction(vote, blockchain.chain):
-        return jsonify({"status": "fail"})
+    # The balance check is a lookup in the vote index, so votes already cast are turned
+    # away before their signature is verified.
     if not blockchain.valid_balance(vote):
-        return jsonify({"status": "fail"})
+        return vote_response("fail")
+    if not blockchain.valid_transaction(vote, blockchain.chain):
+        return vote_response("fail")
+    if block_interval:
+        return queue_vote(vote)
     # Do the above checks in order to display to html if the vote is valid.
     # Note: the blockchain will do these checks independently, so even if a malicous
     # party were to remove these checks from their code and then start a node and connect
@@ -133,58 +342,241 @@ def submit_vote():
     # accepting a chain with this transaction in it.
 
     # Transaction appears valid. Add it and any pending transactions to a new block:
-    # Run the proof of work algorithm to get the next proof:
-    last_block = blockchain.last_block
-    proof = blockchain.proof_of_work(last_block)
-    previous_hash = blockchain.hash(last_block)
-    block = blockchain.new_block(proof, previous_hash)
-    # Return fail if transaction somehow was not properly placed in the block.
-    if not block['transactions']:
-        return jsonify({"status": "fail"})
-    if vote not in block['transactions']:
-        return jsonify({"status": "fail"})
+    if not blockchain.queue_transaction(vote):
+        return vote_response("fail")
+    block = blockchain.seal_block()
+    if block:
+        gossip_block(block)
+    # Return fail if transaction somehow was not properly placed in a block.
+    # (Another request may have sealed it into its own block first, which is fine.)
+    if not blockchain.transaction_index.get(blockchain.transaction_key(vote), 0):
+        return vote_response("fail")
     # Transaction successfully added to new block. Broadcast the new transaction to other nodes.
     broadcast_transaction(vote)
     # HTML will now redirect to page for checking vote.
-    return jsonify({"status": "success"})
+    return vote_response("success")
+
+
+def vote_response(status, **values):
+    """
+    Answer a voter, counting the outcome of their vote.
+    :param status: "success" or "fail".
+    :param values: Anything else to send.
+    """
+    VOTES.inc('pending' if values.get('pending') else status)
+    return jsonify(dict(values, status=status))
+
+
+def queue_vote(vote):
+    """
+    Add a checked vote to the pending transactions for the block producer to seal,
+    and give the voter a receipt they can check the status of their vote with.
+    :param vote: A vote transaction that has passed the checks in submit_vote.
+    :return: The response to the voter.
+    """
+    receipt = str(uuid4()).replace('-', '')
+    key = blockchain.transaction_key(vote)
+    with receipts_lock:
+        vote_receipts[receipt] = {'transaction': key, 'status': 'pending', 'block': None}
+        pending_receipts[key] = receipt
+        while len(vote_receipts) > MAX_VOTE_RECEIPTS:
+            oldest = next(iter(vote_receipts))
+            pending_receipts.pop(vote_receipts.pop(oldest)['transaction'], None)
+    if not blockchain.queue_transaction(vote):
+        # The voter already has a vote waiting to be sealed.
+        with receipts_lock:
+            vote_receipts.pop(receipt, None)
+            pending_receipts.pop(key, None)
+        return vote_response("fail")
+    if len(blockchain.mempool) >= block_transactions:
+        block_ready.set()
+    broadcast_transaction(vote)
+    # The vote will be sealed shortly. HTML will now redirect to page for checking vote.
+    return vote_response("success", pending=True, receipt=receipt)
+
+
+def seal_pending_block():
+    """
+    Seal all pending transactions into a new block, and update the receipts of any queued votes.
+    :return: The new block, or None if none of the pending transactions were valid.
+    """
+    rejected = []
+    block = blockchain.seal_block(rejected)
+    if block:
+        gossip_block(block)
+    with receipts_lock:
+        for transaction in block['transactions'] if block else ():
+            receipt = pending_receipts.pop(blockchain.transaction_key(transaction), None)
+            if receipt in vote_receipts:
+                vote_receipts[receipt].update(status='confirmed', block=block['index'])
+        for transaction in rejected:
+            receipt = pending_receipts.pop(blockchain.transaction_key(transaction), None)
+            if receipt in vote_receipts:
+                vote_receipts[receipt]['status'] = 'rejected'
+    return block
+
+
+def block_producer():
+    """
+    Background loop that seals pending transactions into a block every block_interval
+    milliseconds, or sooner once block_transactions are pending.
+    """
+    while True:
+        block_ready.wait(block_interval / 1000)
+        block_ready.clear()
+        produce_block()
+
+
+def produce_block():
+    """
+    One round of the block producer: seal the pending transactions, if there are any.
+    A failed seal is logged rather than raised, so it can't stop the producer and leave
+    queued votes pending forever.
+    :return: The new block, or None if nothing was sealed.
+    """
+    if not blockchain.mempool:
+        return None
+    try:
+        block = seal_pending_block()
+    except Exception as e:
+        log("BLOCK PRODUCER FAILED TO SEAL A BLOCK: {!r}", e, level=ERROR)
+        return None
+    if block:
+        log("BLOCK PRODUCER SEALED {} TRANSACTIONS.", len(block['transactions']), level=INFO)
+    return block
+
+
+@app.route('/vote/status/<receipt>', methods=['GET'])
+def vote_status(receipt):
+    """
+    App route for checking whether a queued vote has been sealed into a block.
+    """
+    with receipts_lock:
+        status = vote_receipts.get(receipt)
+        if status is None:
+            return jsonify({"status": "unknown"}), 404
+        if status['status'] == 'pending' and blockchain.transaction_index.get(status['transaction'], 0):
+            # Sealed into a block by another node, and received through a chain update.
+            status['status'] = 'confirmed'
+            pending_receipts.pop(status['transaction'], None)
+    return jsonify({"status": status['status'], "block": status['block']}), 200
+
+
+def gossip_block(block):
+    """
+    Push a block that this node sealed or just accepted to every node it is linked to,
+    without waiting for them. Peers that already have the block don't push it on again.
+    :param block: A block on this node's chain.
+    """
+    outbox.broadcast(blockchain.nodes, '/block/', block)
+
+
+@app.route('/block/', methods=['post'])
+def receive_block():
+    """
+    Receive a block pushed by a peer. If it extends this node's chain it is added and
+    passed on. If this node is behind, it catches up with its peers in the background.
+    """
+    block = request.get_json(force=True)
+    result = blockchain.add_block(block)
+    if result == BLOCK_ADDED:
+        gossip_block(block)
+    elif result == BLOCK_AHEAD:
+        request_sync()
+    return jsonify({'result': result}), 200
+
+
+@app.route('/resolve/', methods=['GET'])
+def resolve():
+    """
+    App route for a peer to ask this node to catch up with the network, e.g. when the peer is shutting down.
+    """
+    request_sync()
+    return jsonify({'message': 'Sync requested'}), 200
+
+
+def request_sync():
+    """
+    Start a background sync with peers, unless one is already running.
+    """
+    if sync_lock.acquire(blocking=False):
+        Thread(target=sync_with_peers, daemon=True).start()
+
+
+def sync_with_peers():
+    """
+    Catch up with the longest chain among the peers and seal any pending transactions.
+    Must be started with sync_lock held, which is released when done.
+    """
+    try:
+        blockchain.resolve_conflicts()
+        # Stop delivering to peers that were dropped as unresponsive.
+        for node in set(outbox.backlog()) - blockchain.nodes:
+            outbox.remove(node)
+        # If, at some point in the past, there was a parallel operation that resulted in the node failing to respond
+        # to another node's request, this node may have been incorrectly pruned from that node's list of active nodes.
+        # To correct this, send a reciprocation request to all nodes that just responded by sending this node a chain.
+        # This might add a tiny bit to server overhead, and it solves a parallelization problem that probably won't
+        # happen, but it makes the system a tiny bit more robust:
+        for node in list(blockchain.nodes):
+            try:
+                blockchain.session.post("http://" + node + "/recip/", json={'port': port}, timeout=(3, 10))
+            except requests.RequestException:
+                continue
+        # This node may have had the most up to date chain, yet still have pending transactions.
+        # if so, add a block into which any pending transactions can be added.
+        if blockchain.mempool:
+            seal_pending_block()
+    finally:
+        sync_lock.release()
+
+
+def periodic_sync():
+    """
+    Background loop that syncs with peers every sync_interval seconds, in case a pushed block was missed.
+    """
+    while True:
+        sleep(sync_interval)
+        request_sync()
 
 
 def broadcast_transaction(transaction):
     """
-    Broadcast a valid transaction that ths node received to
-    every node that this one is linked to.
+    Broadcast a valid transaction that ths node received to every node that this one
+    is linked to. Delivery happens in the background, so this returns immediately.
     :param transaction: a vote transaction
     """
     if len(blockchain.nodes):
         log("BROADCASTING TRANSACTION TO CONNECTED NODES.")
-        for node in blockchain.nodes:
-            try:
-                attempts = 0
-                while attempts < 2:
-                    response = requests.post("http://" + node + "/external_transaction/",
-                                             json={'sender': transaction['sender'],
-                                                   'recipient': transaction['recipient'],
-                                                   'amount': transaction['amount'],
-                                                   'signature': transaction['signature'],
-                                                   'vote_number': transaction['vote_number']
-                                                   })
-                    attempts += 1
-                    if response:
-                        break
-                    else:
-                        sleep(1)
-            except:
-                continue
+        outbox.broadcast(blockchain.nodes, '/external_transaction/',
+                         {'sender': transaction['sender'],
+                          'recipient': transaction['recipient'],
+                          'amount': transaction['amount'],
+                          'signature': transaction['signature'],
+                          'vote_number': transaction['vote_number']
+                          })
+
+
+@app.route('/outbox/', methods=['GET'])
+def outbox_backlog():
+    """
+    App route to call for the number of messages waiting to be delivered to each peer,
+    and the number dropped after running out of delivery attempts.
+    """
+    response = {
+        'backlog': outbox.backlog(),
+        'dropped': dict(outbox.dropped),
+    }
+    return jsonify(response), 200
 
 
 @app.route('/external_transaction/', methods=['post'])
 def external_transaction():
     """
     Add a transaction from an external source to the list of
-    pending transactions for the next block. Don't actually bother
-    checking the transaction: it will be checked next time a new block
-    is formed, which will occur when/if another vote is cast on this server,
-    or when someone checks the results of the vote on this server.
+    pending transactions for the next block. Only a quick check is done here,
+    with no signature verification: the transaction is fully checked next time
+    a new block is formed. A vote already pending is not added again.
     """
     log("RECEIVED TRANSACTION FROM EXTERNAL SOURCE.")
     values = request.get_json(force=True)
@@ -193,13 +585,22 @@ def external_transaction():
     amount = int(values['amount'])
     signature = values['signature']
     vote_number = int(values['vote_number'])
-    vote = blockchain.new_transaction(
+    set_context(vote=vote_number)
+    vote = blockchain.build_transaction(
         sender=sender,
         recipient=recipient,
         amount=amount,
         signature=signature,
         vote_number=vote_number
     )
+    status = blockchain.admit_transaction(vote)
+    if status != ADMITTED:
+        log("TRANSACTION NOT ADMITTED: {}", status)
+        if status == BEHIND:
+            # The vote was issued in a block this node doesn't have yet.
+            request_sync()
+        # A full mempool, or a chain that is behind, is temporary, so the sender is asked to try again later.
+        return jsonify({"status": status}), 503 if status in (POOL_FULL, BEHIND) else 200
     return jsonify(vote), 200
 
 
@@ -209,7 +610,7 @@ def reciprocate_acknowledgement():
     Route that requests that this node reciprocate acknowledgement of a remote node.
     """
     values = request.get_json(force=True)
-    log("RECEIVED RECIPROCATION REQUEST FROM {}".format(request.remote_addr + ":" + str(values['port'])))
+    log("RECEIVED RECIPROCATION REQUEST FROM {}:{}", request.remote_addr, values['port'], level=INFO)
     blockchain.register_node(request.remote_addr + ":" + str(values['port']))
     response = {
         'message': 'New node added',
@@ -224,8 +625,10 @@ def remove_node():
     App route for a terminating node to call in order to remove itself from other nodes.
     """
     values = request.get_json(force=True)
-    log("RECEIVED REQUEST TO REMOVE NODE: {}".format(request.remote_addr + ":" + str(values['port'])))
-    blockchain.remove_node(request.remote_addr + ":" + str(values['port']))
+    log("RECEIVED REQUEST TO REMOVE NODE: {}:{}", request.remote_addr, values['port'], level=INFO)
+    address = request.remote_addr + ":" + str(values['port'])
+    blockchain.remove_node(address)
+    outbox.remove(address)
     response = {
         'message': 'Node removed',
         'nodes': list(blockchain.nodes)
@@ -233,10 +636,15 @@ def remove_node():
     return jsonify(response), 200
 
 
-def initialize(chain_source):
+def initialize(chain_source, have_chain=False, trusted_keys=()):
     """
     Link up to an election node or a new election miner node
     and import a blockchain from that node.
+    :param chain_source: Address of the node to import the chain from.
+    :param have_chain: True if a chain was loaded from this node's chain store. If so, the node
+                       carries on with that chain when the source can't be reached.
+    :param trusted_keys: Public RsaKeys of nodes whose checkpoints are trusted. If given, a node without
+                         a stored chain starts from the source's snapshot at its latest checkpoint.
     """
     if chain_source[-1] != '/':
         chain_source += '/'
@@ -265,6 +673,11 @@ def initialize(chain_source):
             sleep(2)
             i += 1
             if i == 4:
+                if have_chain:
+                    print("\n  ***Connection failed. Carrying on with the stored blockchain.***\n")
+                    blockchain.remove_node(input_source[:-1])
+                    blockchain.value_lock()
+                    return
                 print("\n  ***Connection failed. Maybe that server isn't alive right now? Please try again. ***")
                 quit()
 
@@ -289,12 +702,20 @@ def initialize(chain_source):
         for node in blockchain.nodes:
             print("      {}".format(node))
 
+    if trusted_keys and not have_chain:
+        if blockchain.bootstrap(chain_source, trusted_keys):
+            print("   Loaded a snapshot of {} blocks at a trusted checkpoint.".format(len(blockchain.chain)))
+            have_chain = True
+        else:
+            print("   No trusted snapshot from the source. Validating the whole chain.")
     initialize_from_source = blockchain.resolve_conflicts()
     # A key feature of using blockchains in an election is that votes cannot be 'mined' after the
     # initial blockchain is set up, though transactions can still be added to blocks with zero value.
     blockchain.value_lock()
     if initialize_from_source:
         print("\n  ***Local blockchain has been initialized to match the specified source!***\n")
+    elif have_chain:
+        print("\n  ***The stored blockchain is up to date with the specified source.***\n")
     else:
         print("\n  ***Failed to import blockchain from the specified source. "
               "Try a different source or maybe just panic?***")
@@ -305,6 +726,15 @@ def initialize(chain_source):
         blockchain.remove_node(input_source[:-1])  # The [:-1] removes the slash from the end of the source address.
 
 
+def size_key_cache(size=0):
+    """
+    Size the parsed key cache. Validating the chain touches a public and a private key per voter,
+    so by default it holds two keys per vote issued so far.
+    :param size: Keys to cache. 0 sizes the cache from the electorate.
+    """
+    cryptfuncs.set_key_cache_size(size or max(cryptfuncs.KEY_CACHE_SIZE, 2 * len(blockchain.vote_keys)))
+
+
 def exit_func():
     print("\n   Shutting down node...")
     for node in blockchain.nodes:
@@ -330,6 +760,29 @@ def exit_func():
 app.wsgi_app = ProxyFix(app.wsgi_app)
 
 
+def create_app(data_dir, writer, refresh_interval=0.2, max_age=0):
+    """
+    App factory for serving reads with a production WSGI server, across as many worker processes as there
+    are cores. The chain is only changed by a single writer: a node started as usual with -db data_dir.
+    Each worker follows the writer's chain store, answers requests for the chain and the results itself,
+    and passes votes and everything else on to the writer. Eg:
+        gunicorn -w 8 -b 0.0.0.0:5000 'vote_manager_node:create_app("chaindata", "127.0.0.1:5001")'
+    :param data_dir: The writer's chain store directory.
+    :param writer: Address of the writer node. Eg. '127.0.0.1:5001'
+    :param refresh_interval: Seconds between checks of the chain store for new blocks.
+    :param max_age: Seconds a results response may be reused before it is rebuilt.
+    :return: The app.
+    """
+    global store_reader, writer_address, store_refresh_interval, results_max_age
+    parsed_url = urlparse(writer if '//' in writer else '//' + writer)
+    writer_address = parsed_url.netloc
+    store_refresh_interval = max(0, refresh_interval)
+    results_max_age = max(0, max_age)
+    store_reader = ChainReader(data_dir)
+    blockchain.follow_store(store_reader)
+    return app
+
+
 if __name__ == '__main__':
     atexit.register(exit_func)
     parser = ArgumentParser()
@@ -338,12 +791,78 @@ if __name__ == '__main__':
                         help='port to listen on')
     parser.add_argument('-log', '--logging', dest='log_output', action='store_true',
                         help=' Add -log to output more verbose logging statements.')
+    parser.add_argument('-ll', '--log_level', default='debug', choices=['debug', 'info', 'warning', 'error'],
+                        help='With -log, the lowest level of statement to output (default debug).')
+    parser.add_argument('-lj', '--log_json', action='store_true',
+                        help='With -log, output each statement as a line of JSON.')
+    parser.add_argument('-bi', '--block_interval', default=0, type=int,
+                        help='Queue votes and seal them into a block every this many milliseconds. '
+                             '0 seals a block for every vote (default).')
+    parser.add_argument('-bt', '--block_transactions', default=100, type=int,
+                        help='With -bi, seal a block as soon as this many votes are queued (default 100).')
+    parser.add_argument('-si', '--sync_interval', default=30, type=int,
+                        help='Seconds between background syncs with peers, in case a pushed block was missed. '
+                             '0 turns them off (default 30).')
+    parser.add_argument('-rma', '--results_max_age', default=0, type=int,
+                        help='Seconds results may be served without reading the latest tally (default 0).')
+    parser.add_argument('-db', '--data_dir', default=None, type=str,
+                        help='Directory to keep this node\'s chain in, so it can restart without re-downloading it.')
+    parser.add_argument('-snap', '--snapshot_interval', default=1000, type=int,
+                        help='With -db, blocks between snapshots of the wallets (default 1000).')
+    parser.add_argument('-ck', '--checkpoint_key', default=None, type=str,
+                        help='File with the private key this node signs checkpoints with. '
+                             'Created, along with a .pub public key file, if it doesn\'t exist.')
+    parser.add_argument('-ci', '--checkpoint_interval', default=1000, type=int,
+                        help='With -ck, blocks between checkpoints (default 1000).')
+    parser.add_argument('-tc', '--trusted_checkpoint', default=[], type=str, action='append',
+                        help='File with the public key of a node whose checkpoints are trusted. If given, start from '
+                             'the source\'s snapshot at its latest checkpoint. Can be given more than once.')
+    parser.add_argument('-kc', '--key_cache', default=0, type=int,
+                        help='Parsed keys to cache. 0 caches two per voter (default).')
+    parser.add_argument('-bw', '--binary_wire', dest='binary_wire', action='store_true',
+                        help='Ask peers for blocks in the compact binary encoding: smaller, but slower to decode.')
+    parser.add_argument('-m', '--metrics', dest='metrics', action='store_true',
+                        help='Record metrics and serve them on /metrics.')
+    parser.add_argument('-mp', '--mempool_size', default=10000, type=int,
+                        help='Most transactions waiting to be sealed at once (default 10000).')
     parser.set_defaults(log_output=False)
+    add_consensus_arguments(parser)
     args = parser.parse_args()
+    try:
+        blockchain.consensus = consensus_from_args(args, create_key=True)
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
     if args.log_output:
-        init_logger()
+        init_logger({'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}[args.log_level],
+                    json_format=args.log_json)
+    if args.metrics:
+        metrics.enable()
+    prefer_binary_encoding(args.binary_wire)
     port = args.port
     source = args.source
-    initialize(source)
+    block_interval = max(0, args.block_interval)
+    block_transactions = max(1, args.block_transactions)
+    sync_interval = max(0, args.sync_interval)
+    results_max_age = max(0, args.results_max_age)
+    blockchain.mempool.max_size = max(1, args.mempool_size)
+    if args.checkpoint_key:
+        blockchain.checkpoint_key = load_private_key(args.checkpoint_key, create=True)
+        blockchain.checkpoint_interval = max(1, args.checkpoint_interval)
+    trusted_keys = []
+    for key_file in args.trusted_checkpoint:
+        with open(key_file, 'r') as f:
+            trusted_keys.append(cryptfuncs.import_key(f.read()))
+    have_chain = False
+    if args.data_dir:
+        have_chain = blockchain.attach_store(ChainStore(args.data_dir, max(1, args.snapshot_interval)))
+        if have_chain:
+            print("\n   Loaded {} blocks from {}".format(len(blockchain.chain), args.data_dir))
+    size_key_cache(args.key_cache)
+    initialize(source, have_chain, trusted_keys)
+    size_key_cache(args.key_cache)
+    if block_interval:
+        Thread(target=block_producer, daemon=True).start()
+    if sync_interval:
+        Thread(target=periodic_sync, daemon=True).start()
     # Initialize the app on the desired port:
     app.run(host='0.0.0.0', port=port, threaded=True)